@@ -1,73 +1,66 @@
 from __future__ import annotations
 from typing import List, Dict
+import asyncio
+import logging
 import random
-from langchain_openai import ChatOpenAI
-from langchain.schema import SystemMessage, HumanMessage
 
 from .config import settings
-from .utils import daterange, to_price_tier, interest_match, mobility_ok
-from .retrieval import fetch_local_events, fetch_osm_pois, fetch_osm_restaurants
+from . import metrics, pools, prefetch
+from .bulk import upsert_batches, dialect_of
+from .cache import TTLCache
+from .cities import city_key, find_city_id, resolve_city_id
+from .db import AsyncSessionLocal, write_lock
+from .geo import places_within
+from .parsing import parse_free_text
+from .utils import daterange, to_price_tier
+from .retrieval import fetch_local_events, fetch_osm_places
+from .scheduler import schedule
+from .tagindex import link_places
 from .weather import geocode_city, daily_weather, summarize_weather, packing_list
 
-LLM_MODEL = "gpt-4o-mini"
+logger = logging.getLogger(__name__)
 
-def parse_free_text(ask: str) -> Dict:
-    if not ask or not settings.openai_api_key:
-        return {}
-    import json
-    try:
-        llm = ChatOpenAI(model=LLM_MODEL, temperature=0, openai_api_key=settings.openai_api_key, timeout=10)
-        sys = SystemMessage(content="""Extract structured trip preferences as JSON with keys:
-budget_tier one of ["$","$$","$$$"], interests array of strings,
-mobility nullable string (e.g., "wheelchair","no-long-hikes","stroller"),
-dietary nullable string (e.g., "vegan","halal","gluten-free"). Only return valid JSON.""")
-        out = llm.invoke([sys, HumanMessage(content=ask)]).content
-        return json.loads(out)
-    except Exception:
-        return {}
-
-def _load_pois_from_db(city: str, interests: List[str], mobility: str | None, price_tier: str, db_session):
-    from .models import POI
-    q = db_session.query(POI).filter(POI.city.ilike(f"%{city.split(',')[0]}%")).all()
-    cards = []
-    for p in q:
-        if not interest_match(p.tags, interests):
-            continue
-        if not mobility_ok(mobility, p.wheelchair_friendly, p.duration_minutes):
-            continue
-        cards.append({
-            "title": p.name,
-            "address": p.address,
-            "geo": (p.lat, p.lon),
-            "price_tier": p.price_tier if p.price_tier in {"$","$$","$$$"} else price_tier,
-            "duration_minutes": p.duration_minutes,
-            "tags": [t.strip() for t in (p.tags or "").split(",") if t.strip()],
-            "wheelchair_friendly": bool(p.wheelchair_friendly),
-            "child_friendly": bool(p.child_friendly),
-        })
-    return cards
+async def _candidates(kind: str, city: str, db_session, lat: float | None, lon: float | None, **filters) -> List[Dict]:
+    # the city's prebuilt pool (nearest first when geocoded), filtered columnar, see candidates.select().
+    # Cities too big to pool and unknown cities query with interest/mobility filters in SQL instead
+    city_id = await find_city_id(db_session, city)
+    where = {k: filters[k] for k in ("interests", "mobility") if k in filters}
+    if city_id is not None:
+        pool = await pools.city_pool(db_session, kind, city_id)
+        source = "pool"
+        if pool is None:
+            pool = await pools.query_places(db_session, kind, city_id, **where)
+            source = "sql"
+        metrics.count("place_sources_total", kind=kind, source=source)
+        return pool.select(lat, lon, **filters)
+    if lat is not None:
+        from .models import POI, Restaurant
+        model = POI if kind == "pois" else Restaurant
+        rows = await places_within(db_session, model, lat, lon, settings.max_radius_km, *pools.sql_filters(kind, **where))
+        metrics.count("place_sources_total", kind=kind, source="radius")
+        return pools.CityPool(-1, [pools.entry_from_row(kind, row) for row, _ in rows]).select(**filters)
+    metrics.count("place_sources_total", kind=kind, source="none")
+    return []
 
-def _load_restaurants_from_db(city: str, price_tier: str, db_session):
-    from .models import Restaurant
-    rs = db_session.query(Restaurant).filter(Restaurant.city.ilike(f"%{city.split(',')[0]}%")).all()
-    out = []
-    for r in rs:
-        tagset = {t.strip().lower() for t in (r.tags or "").split(",") if t.strip()}
-        out.append({
-            "title": r.name, "address": r.address, "geo": (r.lat, r.lon),
-            "price_tier": r.price_tier if r.price_tier in {"$","$$","$$$"} else price_tier,
-            "tags": sorted(tagset) or ["restaurant"]
-        })
-    return out
+async def _load_pois_from_db(city: str, interests: List[str], mobility: str | None, price_tier: str, db_session,
+                             lat: float | None = None, lon: float | None = None):
+    return [{**card, "price_tier": card["price_tier"] or price_tier}
+            for card in await _candidates("pois", city, db_session, lat, lon, interests=interests, mobility=mobility)]
+
+async def _load_restaurants_from_db(city: str, dietary: str | None, price_tier: str, db_session,
+                                    lat: float | None = None, lon: float | None = None):
+    # soft dietary preference: matches first, others kept
+    cards = await _candidates("restaurants", city, db_session, lat, lon,
+                              dietary=dietary, limit=settings.max_restaurants)
+    return [{**card, "price_tier": card["price_tier"] or price_tier} for card in cards]
 
-def _cache_osm_into_db(city: str, pois: List[Dict], restaurants: List[Dict], db_session):
+async def _cache_osm_into_db(city: str, pois: List[Dict], restaurants: List[Dict], db_session):
+    # one multi-row native upsert per table; the (city_id, name) unique key does the dedupe,
+    # so cost scales with the batch and concurrent misses can't double-insert
     from .models import POI, Restaurant
-    existing_pois = { (p.name, p.city) for p in db_session.query(POI.name, POI.city).all() }
-    for p in pois:
-        key = (p["title"], city)
-        if key in existing_pois: 
-            continue
-        db_session.add(POI(
+    async with write_lock():
+        city_id = await resolve_city_id(db_session, city)
+        poi_rows = [dict(
             name=p["title"],
             address=p.get("address",""),
             lat=p["geo"][0], lon=p["geo"][1],
@@ -76,105 +69,170 @@ def _cache_osm_into_db(city: str, pois: List[Dict], restaurants: List[Dict], db_
             duration_minutes=p.get("duration_minutes", 90),
             wheelchair_friendly=1 if p.get("wheelchair_friendly") else 0,
             child_friendly=1 if p.get("child_friendly") else 0,
-            city=city
-        ))
-    existing_rest = { (r.name, r.city) for r in db_session.query(Restaurant.name, Restaurant.city).all() }
-    for r in restaurants:
-        key = (r["title"], city)
-        if key in existing_rest:
-            continue
-        db_session.add(Restaurant(
+            city=city, city_id=city_id,
+        ) for p in pois]
+        rest_rows = [dict(
             name=r["title"], address=r.get("address",""),
             lat=r["geo"][0], lon=r["geo"][1],
             tags=",".join(r.get("tags",[])),
             price_tier=r.get("price_tier","$$"),
-            city=city
-        ))
+            city=city, city_id=city_id,
+        ) for r in restaurants]
+        try:
+            with metrics.stage("place_write"):
+                dialect = dialect_of(db_session)
+                for model, rows in ((POI, poi_rows), (Restaurant, rest_rows)):
+                    for stmt, chunk in upsert_batches(model, rows, dialect):
+                        await db_session.execute(stmt, chunk)
+                await db_session.run_sync(link_places, "pois", poi_rows)
+                await db_session.run_sync(link_places, "restaurants", rest_rows)
+                await db_session.execute(pools.bump_versions([city_id]))
+                await db_session.commit()
+        except Exception as e:
+            logger.warning("storing OSM places for %r failed: %s", city, e)
+            await db_session.rollback()
+    pools.invalidate([city_id])
+
+# city key -> in-flight OSM sync; _osm_synced = cities whose OSM neighbourhood was written lately
+# (as long as the Overpass disk cache keeps the answer, so a resync after that sees fresh data)
+_osm_inflight: Dict[str, asyncio.Future] = {}
+_osm_synced = TTLCache(maxsize=50_000, ttl=settings.overpass_cache_ttl_days * 86400)
+
+async def _sync_osm(city: str, lat: float, lon: float) -> bool:
+    pois, restaurants = await fetch_osm_places(lat, lon, settings.max_radius_km)
+    if not pois and not restaurants:
+        return False
+    # shared by every waiting request, so it writes on its own session, not the first caller's
+    async with AsyncSessionLocal() as db:
+        # OSM carries no prices: leave the POI tier blank so every request fills in its own
+        await _cache_osm_into_db(city, [{**p, "price_tier": ""} for p in pois], restaurants, db)
+    return True
+
+async def sync_osm_places(city: str, lat: float | None, lon: float | None) -> bool:
+    """Write every OSM place around the city to the DB, at most once per city per
+    Overpass cache TTL in this process. True if new places may have arrived (callers reload)."""
+    key = city_key(city)
+    if lat is None or not key or key in _osm_synced:
+        return False
+    fut = _osm_inflight.get(key)
+    if fut is None:
+        fut = asyncio.ensure_future(_sync_osm(city, lat, lon))
+        _osm_inflight[key] = fut
+
+        def _done(f):
+            _osm_inflight.pop(key, None)
+            if not f.cancelled() and f.exception() is None and f.result():
+                _osm_synced.set(key, True)
+        fut.add_done_callback(_done)
     try:
-        db_session.commit()
+        return await asyncio.shield(fut)
     except Exception:
-        db_session.rollback()
-
-def _soft_dietary_rank(items: List[Dict], dietary: str | None) -> List[Dict]:
-    if not dietary:
-        return items
-    # prefer matches but don't drop others entirely
-    def score(it):
-        tags = {t.lower() for t in it.get("tags", [])}
-        return (1 if dietary.lower() in tags else 0, -len(tags))
-    return sorted(items, key=score, reverse=True)
-
-def pick_activities(city: str, interests: List[str], mobility: str | None, price_tier: str, db_session, lat: float, lon: float):
-    cards = _load_pois_from_db(city, interests, mobility, price_tier, db_session)
-    if not cards:
-        osm = fetch_osm_pois(lat, lon, settings.radius_km, settings.max_radius_km)
-        cards = []
-        for p in osm:
-            if not interest_match(",".join(p.get("tags", [])), interests):
-                continue
-            if not mobility_ok(mobility, 1 if p.get("wheelchair_friendly") else 0, p.get("duration_minutes",90)):
-                continue
-            p["price_tier"] = price_tier
-            cards.append(p)
-        _cache_osm_into_db(city, cards, [], db_session)
+        return False
+
+async def pick_activities(city: str, interests: List[str], mobility: str | None, price_tier: str, db_session, lat: float | None, lon: float | None):
+    cards = await _load_pois_from_db(city, interests, mobility, price_tier, db_session, lat, lon)
+    rounds = 1
+    if not cards and await sync_osm_places(city, lat, lon):
+        cards = await _load_pois_from_db(city, interests, mobility, price_tier, db_session, lat, lon)
+        rounds = 2
+    metrics.count("place_rounds_total", kind="pois", rounds=rounds)
     return cards
 
-def pick_restaurants(city: str, dietary: str | None, price_tier: str, db_session, lat: float, lon: float):
-    out = _load_restaurants_from_db(city, price_tier, db_session)
-    if not out:
-        osm = fetch_osm_restaurants(lat, lon, settings.radius_km, settings.max_radius_km)
-        out = []
-        for r in osm:
-            r["price_tier"] = r.get("price_tier","$$") or price_tier
-            out.append(r)
-        _cache_osm_into_db(city, [], out, db_session)
-    # soft dietary preference: rank matches first, keep others
-    out = _soft_dietary_rank(out, dietary)
-    return out[: settings.max_restaurants]
-
-def allocate_blocks(per_day_items: List[dict]):
-    blocks = {"morning": [], "afternoon": [], "evening": []}
-    for i, item in enumerate(per_day_items):
-        if i % 3 == 0: blocks["morning"].append(item)
-        elif i % 3 == 1: blocks["afternoon"].append(item)
-        else: blocks["evening"].append(item)
-    return blocks
-
-def _restaurants_as_activities(restaurants: List[Dict]) -> List[Dict]:
-    out: List[Dict] = []
-    for r in restaurants or []:
-        out.append({
-            "title": r.get("title", "Restaurant"),
-            "address": r.get("address", ""),
-            "geo": r.get("geo", (0.0, 0.0)),
-            "price_tier": r.get("price_tier", "$$"),
-            "duration_minutes": 75,  # typical meal duration
-            "tags": r.get("tags", ["restaurant"]),
-            "wheelchair_friendly": True,
-            "child_friendly": True,
-        })
+async def pick_restaurants(city: str, dietary: str | None, price_tier: str, db_session, lat: float | None, lon: float | None):
+    out = await _load_restaurants_from_db(city, dietary, price_tier, db_session, lat, lon)
+    rounds = 1
+    if not out and await sync_osm_places(city, lat, lon):
+        out = await _load_restaurants_from_db(city, dietary, price_tier, db_session, lat, lon)
+        rounds = 2
+    metrics.count("place_rounds_total", kind="restaurants", rounds=rounds)
     return out
 
-def build_plan(booking, preferences, ask, db_session):
-    overrides = parse_free_text(ask) if ask else {}
+async def _empty() -> Dict:
+    return {}
+
+class TripContext:
+    """The where/when-only inputs of a plan (coordinates, weather, events). Each is fetched at
+    most once and shared by every plan built with the same context, e.g. one per city and date
+    window in a batch."""
+
+    def __init__(self, location: str, start_date, end_date):
+        self.location, self.start_date, self.end_date = location, start_date, end_date
+        self._tasks: Dict[str, asyncio.Future] = {}
+
+    def _once(self, name: str, make):
+        task = self._tasks.get(name)
+        if task is None:
+            task = self._tasks[name] = asyncio.ensure_future(make())
+        # one plan giving up must not cancel the fetch for the others
+        return asyncio.shield(task)
+
+    async def coords(self):
+        return await self._once("coords", lambda: geocode_city(self.location))
+
+    async def weather(self) -> Dict:
+        coords = await self.coords()
+        if not coords:
+            return {}
+        return await self._once("weather", lambda: daily_weather(*coords, self.start_date, self.end_date))
+
+    async def events(self) -> List[Dict]:
+        return await self._once("events", lambda: fetch_local_events(
+            self.location, self.start_date.isoformat(), self.end_date.isoformat()))
+
+async def plan_events(booking, preferences, ask, sessions, rng: random.Random | None = None,
+                      context: TripContext | None = None):
+    """Geocode + parse first, then fan out weather/places/restaurants/events concurrently,
+    yielding (stage, payload) as soon as each part is ready: "weather" (summary + packing list),
+    "restaurants", one "day" per date, then "notes".
+    `sessions` is an async session factory (e.g. db.AsyncSessionLocal); pass a seeded `rng`
+    for a reproducible itinerary and a shared `context` to reuse another plan's fetches."""
+    rng = rng or random.Random()
+    prefetch.observe(booking.location)
+    ctx = context or TripContext(booking.location, booking.start_date, booking.end_date)
+    overrides, coords = await asyncio.gather(
+        metrics.timed("parse", parse_free_text(ask)) if ask else _empty(),
+        metrics.timed("geocode", ctx.coords()),
+    )
     interests = overrides.get("interests") or preferences.interests
     mobility = overrides.get("mobility") or preferences.mobility
     dietary = overrides.get("dietary") or preferences.dietary
     price_tier = to_price_tier(overrides.get("budget_tier") or preferences.budget_tier)
+    # unresolved location: DB-cached places only, no weather/Overpass around a bogus (0, 0)
+    lat, lon = coords or (None, None)
+
+    # an AsyncSession can't be shared by concurrent tasks; each stage gets its own
+    async def activities():
+        with metrics.stage("activities"):
+            async with sessions() as db_session:
+                return await pick_activities(booking.location, interests, mobility, price_tier, db_session, lat, lon)
 
-    lat, lon = geocode_city(booking.location)
-    weather = daily_weather(lat, lon, booking.start_date, booking.end_date)
-    weather_summary = summarize_weather(weather)
-    pack = packing_list(weather, mobility)
+    async def dining():
+        with metrics.stage("restaurants"):
+            async with sessions() as db_session:
+                return await pick_restaurants(booking.location, dietary, price_tier, db_session, lat, lon)
 
-    pois = pick_activities(booking.location, interests, mobility, price_tier, db_session, lat, lon)
-    restaurants = pick_restaurants(booking.location, dietary, price_tier, db_session, lat, lon)
+    weather_t, pois_t, restaurants_t, events_t = tasks = [
+        asyncio.ensure_future(c) for c in (metrics.timed("weather", ctx.weather()), activities(), dining(),
+                                           metrics.timed("events", ctx.events()))
+    ]
+    try:
+        weather = await weather_t
+        yield "weather", {"weather_summary": summarize_weather(weather),
+                          "packing_checklist": packing_list(weather, mobility)}
+        restaurants = await restaurants_t
+        yield "restaurants", restaurants
+        pois, events = await pois_t, await events_t
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+            elif not t.cancelled():
+                t.exception()   # mark retrieved; the first failure already propagated
 
-    events = fetch_local_events(booking.location, booking.start_date.isoformat(), booking.end_date.isoformat())
     event_cards = [{
         "title": e["name"],
         "address": booking.location,
-        "geo": (lat, lon),
+        "geo": coords or (0.0, 0.0),
         "price_tier": price_tier,
         "duration_minutes": 90,
         "tags": e.get("tags", ["event"]),
@@ -182,52 +240,31 @@ def build_plan(booking, preferences, ask, db_session):
         "child_friendly": True,
     } for e in events]
 
-    # Build a richer pool: POIs + events + a subset of restaurants as activities
-    activity_restaurants = _restaurants_as_activities(restaurants)
-    combined_pool = pois + event_cards + activity_restaurants
-
-    # Cap to a reasonable size to avoid overly large itineraries
-    if len(combined_pool) > 60:
-        combined_pool = combined_pool[:60]
-
-    itinerary: List[Dict] = []
+    # sights clustered per day and routed; restaurants fill the lunch/dinner slots
     days = list(daterange(booking.start_date, booking.end_date))
-    items_per_day = 3
-
-    if not combined_pool:
-        for d in days:
-            itinerary.append({
-                "date": d.isoformat(),
-                "blocks": allocate_blocks([])
-            })
-    else:
-        # Shuffle once, then create cycles; repeats only after the whole pool is used
-        base_pool = combined_pool[:]
-        random.shuffle(base_pool)
-        needed = len(days) * items_per_day
-        sequence: List[Dict] = []
-        while len(sequence) < needed:
-            # add a full non-repeating pass
-            sequence.extend(random.sample(base_pool, k=len(base_pool)))
-
-        for i, d in enumerate(days):
-            start = i * items_per_day
-            day_slice = sequence[start:start+items_per_day]
-            itinerary.append({
-                "date": d.isoformat(),
-                "blocks": allocate_blocks(day_slice)
-            })
-
-    note_bits = [f"Auto-fetched within {settings.radius_km}–{settings.max_radius_km}km of {booking.location} (OSM)."]
+    preferred = [bool(dietary) and dietary.lower() in {t.lower() for t in r.get("tags", [])} for r in restaurants]
+    with metrics.stage("schedule"):
+        itinerary = schedule(days, pois, restaurants, event_cards, rng, preferred)
+
+    note_bits = [f"Auto-fetched nearest places within {settings.max_radius_km}km of {booking.location} (OSM)."]
     if not pois:
-        note_bits.append("No POIs found; try increasing RADIUS_KM.")
+        note_bits.append("No POIs found; try increasing MAX_RADIUS_KM.")
     if not restaurants:
         note_bits.append("No restaurants found; dietary tags on OSM are sparse.")
 
-    return {
-        "itinerary": itinerary,
-        "restaurants": restaurants,
-        "packing_checklist": pack,
-        "weather_summary": weather_summary,
-        "notes": " ".join(note_bits),
-    }
+    for day in itinerary:
+        yield "day", day
+    yield "notes", " ".join(note_bits)
+
+async def build_plan(booking, preferences, ask, sessions, rng: random.Random | None = None,
+                     context: TripContext | None = None) -> Dict:
+    """The whole plan at once; see plan_events() for the arguments."""
+    out: Dict = {"itinerary": []}
+    async for stage, payload in plan_events(booking, preferences, ask, sessions, rng, context):
+        if stage == "weather":
+            out.update(payload)
+        elif stage == "day":
+            out["itinerary"].append(payload)
+        else:
+            out[stage] = payload
+    return out
@@ -0,0 +1,54 @@
+from __future__ import annotations
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+# rows per executemany round-trip (and per multi-row INSERT on MySQL)
+CHUNK_ROWS = 1000
+
+def _dedupe(rows: List[Dict], key: Sequence[str]) -> List[Dict]:
+    seen, out = set(), []
+    for r in rows:
+        k = tuple(r.get(c) for c in key)
+        if k in seen:
+            continue
+        seen.add(k)
+        out.append(r)
+    return out
+
+def upsert_batches(model, rows: List[Dict], dialect: str, key: Sequence[str] = ("city_id", "name"),
+                   update: bool = False, chunk: int = CHUNK_ROWS) -> Iterator[Tuple[object, List[Dict]]]:
+    """(statement, rows) per chunk for `execute(stmt, rows)`, using the dialect's native upsert on
+    the unique `key`: existing rows are skipped (or, with update=True, overwritten).
+
+    The statement is one parametrized row run as executemany: pymysql folds it into a single
+    multi-row INSERT and SQLite loops the prepared statement in C."""
+    rows = _dedupe(rows, key)
+    if not rows:
+        return
+    table = model.__table__
+    # columns the INSERT will carry: the given ones plus Python-side defaults (e.g. geocell)
+    cols = [c.name for c in table.columns
+            if c.name not in key and not c.primary_key and (c.name in rows[0] or c.default is not None)]
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table)
+        # no-op assignment instead of INSERT IGNORE, which would also swallow real errors
+        stmt = stmt.on_duplicate_key_update(
+            {c: stmt.inserted[c] for c in cols} if update else {key[-1]: table.c[key[-1]]}
+        )
+    elif dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table)
+        if update:
+            stmt = stmt.on_conflict_do_update(index_elements=list(key), set_={c: stmt.excluded[c] for c in cols})
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=list(key))
+    else:
+        raise ValueError(f"no native upsert for dialect {dialect!r}")
+    for i in range(0, len(rows), chunk):
+        yield stmt, rows[i : i + chunk]
+
+def dialect_of(session) -> str:
+    return session.bind.dialect.name
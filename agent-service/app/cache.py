@@ -0,0 +1,146 @@
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Any, Hashable
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+
+_MISSING = object()
+
+class TTLCache:
+    """Small in-process LRU with per-entry expiry and hit/miss counters."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        it = self._data.get(key, _MISSING)
+        if it is _MISSING or it[0] <= time.monotonic():
+            if it is not _MISSING:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return it[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        it = self._data.pop(key, _MISSING)
+        return default if it is _MISSING else it[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        it = self._data.get(key)
+        return it is not None and it[0] > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 3) if total else 0.0}
+
+
+class DiskCache:
+    """Content-addressed, gzip-compressed JSON blobs under `root`, bounded to `max_bytes`
+    by least-recently-used eviction (file mtime is bumped on every hit)."""
+
+    def __init__(self, root: str, max_bytes: int = 256 * 1024 * 1024, ttl: float = 7 * 86400):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._index: dict[str, tuple[int, float]] | None = None   # key -> (size, last access)
+        self._bytes = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ".json.gz")
+
+    def _load_index(self):
+        if self._index is not None:
+            return
+        self._index, self._bytes = {}, 0
+        for dirpath, _, files in os.walk(self.root):
+            for f in files:
+                if not f.endswith(".json.gz"):
+                    continue
+                st = os.stat(os.path.join(dirpath, f))
+                self._index[f[: -len(".json.gz")]] = (st.st_size, st.st_mtime)
+                self._bytes += st.st_size
+
+    def _drop(self, key: str):
+        size, _ = self._index.pop(key, (0, 0.0))
+        self._bytes -= size
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            self._load_index()
+            if key not in self._index:
+                self.misses += 1
+                return None
+            try:
+                with gzip.open(self._path(key), "rt", encoding="utf-8") as fh:
+                    blob = json.load(fh)
+            except (OSError, ValueError):
+                self._drop(key)
+                self.misses += 1
+                return None
+            if time.time() - blob.get("stored_at", 0) > self.ttl:
+                self._drop(key)
+                self.misses += 1
+                return None
+            now = time.time()
+            os.utime(self._path(key), (now, now))
+            self._index[key] = (self._index[key][0], now)
+            self.hits += 1
+            return blob.get("value")
+
+    def set(self, key: str, value: Any):
+        path = self._path(key)
+        data = gzip.compress(json.dumps({"stored_at": time.time(), "value": value}).encode("utf-8"))
+        with self._lock:
+            self._load_index()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(data)
+            os.replace(tmp, path)   # atomic: readers never see a partial file
+            if key in self._index:
+                self._bytes -= self._index[key][0]
+            self._index[key] = (len(data), time.time())
+            self._bytes += len(data)
+            if self._bytes > self.max_bytes:
+                for old in sorted(self._index, key=lambda k: self._index[k][1]):
+                    if self._bytes <= self.max_bytes or old == key:
+                        break
+                    self._drop(old)
+                    self.evictions += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"entries": len(self._index or {}), "bytes": self._bytes, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 3) if total else 0.0}
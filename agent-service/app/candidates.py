@@ -0,0 +1,90 @@
+from __future__ import annotations
+from typing import Dict, Iterable, List, Sequence
+import numpy as np
+
+from .utils import haversine_km
+
+ONE = np.uint64(1)
+
+class TagVocab:
+    """Interned tags -> bit positions. Masks are uint64 words, so the vocabulary can grow
+    past 64 tags without changing how filters are evaluated."""
+
+    def __init__(self, tags: Iterable[str] = ()):
+        self.index: Dict[str, int] = {}
+        for t in tags:
+            self.index.setdefault(t, len(self.index))
+
+    @property
+    def words(self) -> int:
+        return max(1, (len(self.index) + 63) // 64)
+
+    def mask(self, tags: Iterable[str]) -> np.ndarray:
+        """Bits for the known tags; unknown tags can't match anything, so they are dropped."""
+        m = np.zeros(self.words, dtype=np.uint64)
+        for t in tags:
+            b = self.index.get(t)
+            if b is not None:
+                m[b >> 6] |= ONE << np.uint64(b & 63)
+        return m
+
+class CandidateColumns:
+    """A candidate pool as columns: coordinates, duration and wheelchair flags as arrays, tags
+    as an (n, words) bitmap. Filtering and ranking are a few array ops over the whole pool."""
+
+    def __init__(self, cards: Sequence[Dict], tagsets: Sequence[frozenset]):
+        n = len(cards)
+        self.vocab = TagVocab(t for tags in tagsets for t in sorted(tags))
+        self.lats = np.fromiter((c["geo"][0] for c in cards), dtype=float, count=n)
+        self.lons = np.fromiter((c["geo"][1] for c in cards), dtype=float, count=n)
+        self.duration = np.fromiter((c.get("duration_minutes") or 0 for c in cards), dtype=np.int32, count=n)
+        self.wheelchair = np.fromiter((bool(c.get("wheelchair_friendly")) for c in cards), dtype=bool, count=n)
+        self.ntags = np.fromiter((len(c.get("tags") or ()) for c in cards), dtype=np.int32, count=n)
+        # (row, bit) pairs for every tag, OR-ed into the bitmap in one scatter
+        index = self.vocab.index
+        rows = np.repeat(np.arange(n), [len(t) for t in tagsets])
+        pos = np.fromiter((index[t] for tags in tagsets for t in tags), dtype=np.int64, count=len(rows))
+        self.tagbits = np.zeros((n, self.vocab.words), dtype=np.uint64)
+        np.bitwise_or.at(self.tagbits, (rows, pos >> 6), ONE << (pos & 63).astype(np.uint64))
+
+    def __len__(self) -> int:
+        return len(self.lats)
+
+    def has_any(self, tags: Iterable[str]) -> np.ndarray:
+        want = self.vocab.mask(tags)
+        return (self.tagbits & want).any(axis=1)
+
+    def mask(self, interests: Iterable[str] = (), mobility: str | None = None) -> np.ndarray:
+        """Rows that share a tag with `interests` (all rows when there are none) and suit `mobility`."""
+        wants = {i.strip().lower() for i in interests or [] if i and i.strip()}
+        keep = self.has_any(wants) if wants else np.ones(len(self), dtype=bool)
+        if mobility == "wheelchair":
+            keep &= self.wheelchair
+        elif mobility == "no-long-hikes":
+            keep &= self.duration <= 120
+        return keep
+
+    def nearest_first(self, lat: float | None, lon: float | None) -> np.ndarray:
+        if lat is None or len(self) < 2:
+            return np.arange(len(self))
+        return np.argsort(haversine_km(lat, lon, self.lats, self.lons), kind="stable")
+
+    def dietary_first(self, idx: np.ndarray, dietary: str | None) -> np.ndarray:
+        """Soft dietary preference: matching rows first, then fewer tags (more specific) first;
+        the incoming order breaks ties."""
+        if not dietary or not len(idx):
+            return idx
+        match = self.has_any([dietary.lower()])[idx]
+        return idx[np.lexsort((self.ntags[idx], ~match))]
+
+def select(entries: List, cols: CandidateColumns, lat: float | None = None, lon: float | None = None,
+           interests: Iterable[str] = (), mobility: str | None = None, dietary: str | None = None,
+           limit: int | None = None) -> List[Dict]:
+    """Cards from (card, tagset) `entries` that pass the filters: nearest first, soft dietary
+    ranking on top, at most `limit`."""
+    order = cols.nearest_first(lat, lon)
+    idx = order[cols.mask(interests, mobility)[order]]
+    idx = cols.dietary_first(idx, dietary)
+    if limit is not None:
+        idx = idx[:limit]
+    return [entries[i][0] for i in idx.tolist()]
@@ -0,0 +1,103 @@
+from __future__ import annotations
+from typing import Dict, Tuple
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from .cache import TTLCache
+from .models import City, CityAlias
+from .utils import normalize_location
+
+US_STATES: Dict[str, str] = {
+    "alabama": "al", "alaska": "ak", "arizona": "az", "arkansas": "ar", "california": "ca",
+    "colorado": "co", "connecticut": "ct", "delaware": "de", "district of columbia": "dc",
+    "florida": "fl", "georgia": "ga", "hawaii": "hi", "idaho": "id", "illinois": "il",
+    "indiana": "in", "iowa": "ia", "kansas": "ks", "kentucky": "ky", "louisiana": "la",
+    "maine": "me", "maryland": "md", "massachusetts": "ma", "michigan": "mi", "minnesota": "mn",
+    "mississippi": "ms", "missouri": "mo", "montana": "mt", "nebraska": "ne", "nevada": "nv",
+    "new hampshire": "nh", "new jersey": "nj", "new mexico": "nm", "new york": "ny",
+    "north carolina": "nc", "north dakota": "nd", "ohio": "oh", "oklahoma": "ok", "oregon": "or",
+    "pennsylvania": "pa", "rhode island": "ri", "south carolina": "sc", "south dakota": "sd",
+    "tennessee": "tn", "texas": "tx", "utah": "ut", "vermont": "vt", "virginia": "va",
+    "washington": "wa", "west virginia": "wv", "wisconsin": "wi", "wyoming": "wy",
+}
+
+_ids = TTLCache(maxsize=10_000, ttl=86400.0)   # alias key -> city id; city rows never change
+
+def city_key(location: str) -> str:
+    """'Portland, Oregon' / 'portland,OR' -> 'portland, or'. Only name + first qualifier count."""
+    parts = [p.strip() for p in normalize_location(location).split(",") if p.strip()]
+    if not parts:
+        return ""
+    if len(parts) == 1:
+        return parts[0]
+    region = US_STATES.get(parts[1], parts[1])
+    return f"{parts[0]}, {region}"
+
+def _lookup(db, key: str) -> Tuple[int | None, bool]:
+    """Sync-session lookup: (city id, found by alias). Alias row -> unique bare-name match."""
+    hit = db.execute(select(CityAlias.city_id).where(CityAlias.alias == key)).scalar()
+    if hit is not None:
+        return hit, True
+    name, _, region = key.partition(", ")
+    if not region:
+        # bare 'portland' only binds to an existing city if that name is unambiguous
+        ids = db.execute(select(City.id).where(City.name == name).limit(2)).scalars().all()
+        if len(ids) == 1:
+            return ids[0], False
+    return None, False
+
+def _get_or_create(db, key: str) -> int:
+    """Sync-session resolver: alias row -> unique bare-name match -> new city."""
+    city_id, aliased = _lookup(db, key)
+    if aliased:
+        return city_id
+    name, _, region = key.partition(", ")
+    try:
+        with db.begin_nested():
+            if city_id is None:
+                city = City(key=key, name=name, region=region or None)
+                db.add(city)
+                db.flush()
+                city_id = city.id
+            db.add(CityAlias(alias=key, city_id=city_id))
+            db.flush()
+    except IntegrityError:
+        # lost a race with a concurrent resolver; its row is there now
+        city_id = db.execute(select(CityAlias.city_id).where(CityAlias.alias == key)).scalar()
+    return city_id
+
+def resolve_city_id_sync(db, location: str) -> int | None:
+    key = city_key(location)
+    if not key:
+        return None
+    cid = _ids.get(key)
+    if cid is None:
+        cid = _get_or_create(db, key)
+        _ids.set(key, cid)
+    return cid
+
+async def find_city_id(db, location: str) -> int | None:
+    """City id for a free-text location, or None if no places were ever stored for it.
+    Read paths use this so junk or one-off locations don't add cities."""
+    key = city_key(location)
+    if not key:
+        return None
+    cid = _ids.get(key)
+    if cid is None:
+        cid, _ = await db.run_sync(lambda s: _lookup(s, key))
+        if cid is not None:
+            _ids.set(key, cid)
+    return cid
+
+async def resolve_city_id(db, location: str) -> int | None:
+    """City id for a free-text location, created on first sight (commits); cached in-process.
+    For writers: only call it when places are about to be stored under the city."""
+    key = city_key(location)
+    if not key:
+        return None
+    cid = _ids.get(key)
+    if cid is None:
+        cid = await db.run_sync(lambda s: _get_or_create(s, key))
+        await db.commit()
+        _ids.set(key, cid)
+    return cid
@@ -7,24 +7,115 @@ load_dotenv()
 class Settings(BaseModel):
     port: int = int(os.getenv("PORT", "8088"))
     database_url: str = os.getenv("DATABASE_URL", "sqlite:///./dev.db")
+    # SQLite only: how long a writer waits for the lock; SQLITE_WAL=1 switches the file to WAL
+    # so reads don't block writes (recommended under concurrent load; changes the file for good)
+    sqlite_busy_timeout_s: float = float(os.getenv("SQLITE_BUSY_TIMEOUT_S", "30"))
+    sqlite_wal: bool = os.getenv("SQLITE_WAL", "0") == "1"
 
     openai_api_key: str | None = os.getenv("OPENAI_API_KEY") or None
     anthropic_api_key: str | None = os.getenv("ANTHROPIC_API_KEY") or None
     tavily_api_key: str | None = os.getenv("TAVILY_API_KEY") or None
 
     # Dynamic place fetch config
-    radius_km: float = float(os.getenv("RADIUS_KM", "5"))         # initial radius
-    max_radius_km: float = float(os.getenv("MAX_RADIUS_KM", "15"))# we’ll expand up to this
+    radius_km: float = float(os.getenv("RADIUS_KM", "5"))         # near set of the Overpass query, complete in dense cities
+    max_radius_km: float = float(os.getenv("MAX_RADIUS_KM", "15"))# far set: single Overpass query covers both
     max_pois: int = int(os.getenv("MAX_POIS", "40"))
     max_restaurants: int = int(os.getenv("MAX_RESTAURANTS", "40"))
 
-    # Try multiple Overpass mirrors to avoid rate-limits
-    overpass_endpoints: list[str] = [
+    # Geocode cache: in-process LRU in front of the geocode_cache table
+    geocode_ttl_days: float = float(os.getenv("GEOCODE_TTL_DAYS", "30"))
+    geocode_negative_ttl_s: float = float(os.getenv("GEOCODE_NEGATIVE_TTL_S", "600"))
+    geocode_lru_size: int = int(os.getenv("GEOCODE_LRU_SIZE", "2048"))
+
+    # Forecast cache: one row per (grid cell, day); TTL shrinks as the day gets closer
+    forecast_grid_deg: float = float(os.getenv("FORECAST_GRID_DEG", "0.1"))
+    forecast_lru_size: int = int(os.getenv("FORECAST_LRU_SIZE", "8192"))
+
+    # Upstream HTTP (app.upstream): pooled keep-alive clients, HTTP/2 when h2 is installed,
+    # per-upstream timeouts (s) and retries (idempotent calls; capped at HTTP_RETRY_BUDGET x traffic)
+    http_http2: bool = os.getenv("HTTP_HTTP2", "1") == "1"
+    http_max_connections: int = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+    http_max_keepalive: int = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+    http_keepalive_expiry_s: float = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_S", "30"))
+    http_retry_base_s: float = float(os.getenv("HTTP_RETRY_BASE_S", "0.2"))
+    http_retry_budget: float = float(os.getenv("HTTP_RETRY_BUDGET", "0.2"))
+    geocode_timeout_s: float = float(os.getenv("GEOCODE_TIMEOUT_S", "8"))
+    geocode_retries: int = int(os.getenv("GEOCODE_RETRIES", "2"))
+    forecast_timeout_s: float = float(os.getenv("FORECAST_TIMEOUT_S", "8"))
+    forecast_retries: int = int(os.getenv("FORECAST_RETRIES", "2"))
+    overpass_timeout_s: float = float(os.getenv("OVERPASS_TIMEOUT_S", "15"))   # mirrors hedge instead of retrying
+    tavily_timeout_s: float = float(os.getenv("TAVILY_TIMEOUT_S", "10"))
+    tavily_retries: int = int(os.getenv("TAVILY_RETRIES", "1"))
+    llm_timeout_s: float = float(os.getenv("LLM_TIMEOUT_S", "10"))
+    # Upstream base URLs (benchmarks point these at bench.stubs)
+    geocode_url: str = os.getenv("GEOCODE_URL", "https://geocoding-api.open-meteo.com/v1/search")
+    forecast_url: str = os.getenv("FORECAST_URL", "https://api.open-meteo.com/v1/forecast")
+    tavily_url: str = os.getenv("TAVILY_URL", "https://api.tavily.com/search")
+    openai_base_url: str | None = os.getenv("OPENAI_BASE_URL") or None
+
+    # On-disk Overpass response cache (content-addressed by normalized query)
+    overpass_cache_dir: str = os.getenv("OVERPASS_CACHE_DIR", ".cache/overpass")
+    overpass_cache_max_mb: int = int(os.getenv("OVERPASS_CACHE_MAX_MB", "256"))
+    overpass_cache_ttl_days: float = float(os.getenv("OVERPASS_CACHE_TTL_DAYS", "7"))
+
+    # Per-city candidate pools (prebuilt POI/restaurant cards), checked against cities.places_version
+    pool_cache_cities: int = int(os.getenv("POOL_CACHE_CITIES", "256"))
+    pool_cache_ttl_s: float = float(os.getenv("POOL_CACHE_TTL_S", "3600"))
+    # cities with more places than this aren't pooled: each request queries with its filters in SQL
+    pool_max_rows: int = int(os.getenv("POOL_MAX_ROWS", "20000"))
+
+    # Plan memoization: identical requests reuse the last PlanRun for this long (0 disables)
+    plan_cache_ttl_s: float = float(os.getenv("PLAN_CACHE_TTL_S", "900"))
+    # Write-behind plan run log: queue bound (full -> requests wait), rows per transaction, max wait
+    # before a partial batch is written; RUN_WRITE_BEHIND=0 writes each run before responding
+    run_write_behind: bool = os.getenv("RUN_WRITE_BEHIND", "1") == "1"
+    run_queue_max: int = int(os.getenv("RUN_QUEUE_MAX", "10000"))
+    run_flush_batch: int = int(os.getenv("RUN_FLUSH_BATCH", "500"))
+    run_flush_interval_s: float = float(os.getenv("RUN_FLUSH_INTERVAL_S", "0.05"))
+    # Run ids carry a node number (0-63) each writing process leases from run_id_nodes; a lease left
+    # by a process that died is reused after this long
+    run_id_node_lease_s: float = float(os.getenv("RUN_ID_NODE_LEASE_S", "600"))
+    # Plan run retention (app.runstore): compact runs older than this many days, delete them past
+    # the purge age (0 keeps them), pass every N seconds in the API process (0 = cron the CLI instead)
+    run_compact_after_days: float = float(os.getenv("RUN_COMPACT_AFTER_DAYS", "7"))
+    run_purge_after_days: float = float(os.getenv("RUN_PURGE_AFTER_DAYS", "0"))
+    run_retention_every_s: float = float(os.getenv("RUN_RETENTION_EVERY_S", "3600"))
+    # /agent/plan/batch: itineraries built at once (fetches are shared per city regardless)
+    plan_batch_concurrency: int = int(os.getenv("PLAN_BATCH_CONCURRENCY", "16"))
+
+    # /agent/jobs queue: worker processes started with the API (0 = run `python -m app.jobs` instead),
+    # jobs each worker runs at once, retries with exponential backoff, lease before a stuck job is requeued
+    job_workers: int = int(os.getenv("JOB_WORKERS", "1"))
+    job_concurrency: int = int(os.getenv("JOB_CONCURRENCY", "4"))
+    job_max_attempts: int = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    job_retry_base_s: float = float(os.getenv("JOB_RETRY_BASE_S", "5"))
+    job_lease_s: float = float(os.getenv("JOB_LEASE_S", "300"))
+    job_poll_s: float = float(os.getenv("JOB_POLL_S", "0.5"))
+
+    # Predictive cache warming (app.prefetch): every N s (0 = off), warm upcoming bookings' cities and
+    # date windows plus the most-planned cities, spending at most PREFETCH_BUDGET upstream calls a pass
+    prefetch_every_s: float = float(os.getenv("PREFETCH_EVERY_S", "900"))
+    prefetch_budget: int = int(os.getenv("PREFETCH_BUDGET", "60"))
+    prefetch_horizon_days: int = int(os.getenv("PREFETCH_HORIZON_DAYS", "14"))
+    prefetch_popular_cities: int = int(os.getenv("PREFETCH_POPULAR_CITIES", "20"))
+    prefetch_popular_window_days: float = float(os.getenv("PREFETCH_POPULAR_WINDOW_DAYS", "7"))
+
+    # Free-text parsing: answer locally when this share of the ask's words is understood;
+    # LLM_FAKE=1 swaps in a deterministic offline stand-in for the LLM
+    parse_local_min_coverage: float = float(os.getenv("PARSE_LOCAL_MIN_COVERAGE", "0.75"))
+    llm_fake: bool = os.getenv("LLM_FAKE", "0") == "1"
+
+    # Try multiple Overpass mirrors to avoid rate-limits (OVERPASS_URLS=comma list overrides all)
+    overpass_endpoints: list[str] = [u.strip() for u in os.getenv("OVERPASS_URLS", "").split(",") if u.strip()] or [
         # primary
         os.getenv("OVERPASS_URL", "https://overpass-api.de/api/interpreter"),
         # fallbacks
         "https://overpass.kumi.systems/api/interpreter",
         "https://overpass.openstreetmap.ru/api/interpreter",
     ]
+    # Mirror health: race the next-best mirror after this long, trip a mirror after N straight failures
+    overpass_hedge_after_s: float = float(os.getenv("OVERPASS_HEDGE_AFTER_S", "3"))
+    overpass_breaker_failures: int = int(os.getenv("OVERPASS_BREAKER_FAILURES", "3"))
+    overpass_breaker_cooldown_s: float = float(os.getenv("OVERPASS_BREAKER_COOLDOWN_S", "60"))
 
 settings = Settings()
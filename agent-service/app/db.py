@@ -1,13 +1,66 @@
-from sqlalchemy import create_engine
+from contextlib import asynccontextmanager
+import asyncio
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from .config import settings
 
-engine = create_engine(settings.database_url, pool_pre_ping=True, pool_recycle=3600)
+def _sqlite_args(url: str) -> dict:
+    # concurrent writers (first-sight cities, cache upserts, run batches) wait for the lock
+    # instead of failing with 'database is locked'
+    return {"connect_args": {"timeout": settings.sqlite_busy_timeout_s}} if url.startswith("sqlite") else {}
+
+def _sqlite_pragmas(engine):
+    if engine.dialect.name != "sqlite" or not settings.sqlite_wal:
+        return
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_conn, _):
+        # WAL: readers and the one writer stop blocking each other (a property of the file, hence opt-in)
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.close()
+
+engine = create_engine(settings.database_url, pool_pre_ping=True, pool_recycle=3600, **_sqlite_args(settings.database_url))
+_sqlite_pragmas(engine)
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
 
+def _async_url(url: str) -> str:
+    # same database, async driver (aiosqlite / aiomysql)
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("mysql+pymysql:"):
+        return url.replace("mysql+pymysql:", "mysql+aiomysql:", 1)
+    if url.startswith("mysql:"):
+        return url.replace("mysql:", "mysql+aiomysql:", 1)
+    return url
+
+async_engine = create_async_engine(_async_url(settings.database_url), pool_pre_ping=True, pool_recycle=3600,
+                                   **_sqlite_args(settings.database_url))
+_sqlite_pragmas(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+_write_lock = asyncio.Lock()
+
+@asynccontextmanager
+async def write_lock():
+    """SQLite takes one writer at a time. Writers in this process queue here, first come first
+    served, instead of in SQLite's sleep-and-retry busy handler, which starves some of them
+    under load. A no-op on other databases."""
+    if async_engine.dialect.name != "sqlite":
+        yield
+        return
+    async with _write_lock:
+        yield
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
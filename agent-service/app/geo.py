@@ -0,0 +1,66 @@
+from __future__ import annotations
+from typing import List, Tuple
+import math
+import numpy as np
+from sqlalchemy import select, or_
+
+from .utils import haversine_km
+
+# Fixed grid: changing it means re-running migrate.backfill_geocells().
+GEO_CELL_DEG = 0.05              # ~5.5 km of latitude
+_COLS = int(round(360 / GEO_CELL_DEG))
+_KM_PER_DEG_LAT = 111.32
+
+def geocell(lat: float, lon: float) -> int:
+    """Row-major integer id of the grid cell containing (lat, lon)."""
+    y = int(math.floor((lat + 90.0) / GEO_CELL_DEG))
+    x = int(math.floor((lon + 180.0) / GEO_CELL_DEG)) % _COLS
+    return y * _COLS + x
+
+def geocell_default(ctx) -> int | None:
+    # column default for POI/Restaurant: works for ORM adds and Core (multi-row) inserts
+    p = ctx.get_current_parameters()
+    if p.get("lat") is None or p.get("lon") is None:
+        return None
+    return geocell(p["lat"], p["lon"])
+
+def bounding_box(lat: float, lon: float, radius_km: float) -> Tuple[float, float, float, float]:
+    dlat = radius_km / _KM_PER_DEG_LAT
+    dlon = radius_km / (_KM_PER_DEG_LAT * max(math.cos(math.radians(lat)), 0.01))
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+def cell_ranges(lat: float, lon: float, radius_km: float) -> List[Tuple[int, int]]:
+    """Covering cells of the radius's bounding box as one contiguous id range per grid row."""
+    s, n, w, e = bounding_box(lat, lon, radius_km)
+    y0 = int(math.floor((max(s, -90.0) + 90.0) / GEO_CELL_DEG))
+    y1 = int(math.floor((min(n, 89.999999) + 90.0) / GEO_CELL_DEG))
+    x0 = int(math.floor((w + 180.0) / GEO_CELL_DEG))
+    x1 = int(math.floor((e + 180.0) / GEO_CELL_DEG))
+    spans = [(x0, x1)] if x0 >= 0 and x1 < _COLS else [(x0 % _COLS, _COLS - 1), (0, x1 % _COLS)]
+    return [(y * _COLS + a, y * _COLS + b) for y in range(y0, y1 + 1) for a, b in spans]
+
+def _within_stmt(model, lat: float, lon: float, radius_km: float, *where):
+    s, n, w, e = bounding_box(lat, lon, radius_km)
+    cells = or_(*[model.geocell.between(a, b) for a, b in cell_ranges(lat, lon, radius_km)])
+    stmt = select(model).where(cells, model.lat.between(s, n), *where)
+    if w >= -180.0 and e <= 180.0:
+        stmt = stmt.where(model.lon.between(w, e))
+    return stmt
+
+def sort_by_distance(rows, lat: float | None, lon: float | None) -> list:
+    if lat is None or len(rows) < 2:
+        return list(rows)
+    d = haversine_km(lat, lon, [r.lat for r in rows], [r.lon for r in rows])
+    return [rows[i] for i in np.argsort(d, kind="stable")]
+
+def _refine(rows, lat: float, lon: float, radius_km: float, limit: int | None):
+    if not rows:
+        return []
+    d = haversine_km(lat, lon, [r.lat for r in rows], [r.lon for r in rows])
+    order = [i for i in np.argsort(d, kind="stable") if d[i] <= radius_km]
+    return [(rows[i], float(d[i])) for i in order[:limit]]
+
+async def places_within(db, model, lat: float, lon: float, radius_km: float, *where, limit: int | None = None):
+    """[(row, distance_km)] nearest first: indexed cell ranges -> bbox -> exact haversine."""
+    rows = (await db.execute(_within_stmt(model, lat, lon, radius_km, *where))).scalars().all()
+    return _refine(rows, lat, lon, radius_km, limit)
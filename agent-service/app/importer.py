@@ -0,0 +1,405 @@
+"""Streaming bulk importer for POI / restaurant catalogs.
+
+    python -m app.importer places.csv --city "Austin, TX"
+    python -m app.importer extract.geojson --workers 4 --defer-indexes
+    python -m app.importer overpass.ndjson --format osm --checkpoint .import.ckpt
+
+Records flow read -> parse (optionally in worker processes) -> batched Core upsert,
+one transaction per batch, so memory stays flat regardless of file size. A checkpoint
+file records how many input records are committed; re-running with it resumes there.
+"""
+from __future__ import annotations
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple
+import argparse
+import csv
+import gzip
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session
+
+from .bulk import upsert_batches
+from .cities import resolve_city_id_sync
+from .db import engine
+from .migrate import ensure_schema
+from .models import POI, Restaurant
+from .pools import bump_versions
+from .tagindex import link_places
+from .retrieval import POI_FILTERS, RESTO_FILTERS, _matches, _elements_to_pois, _elements_to_restos
+
+FORMATS = ("csv", "geojson", "osm")
+# secondary indexes that are cheaper to build once after the load than to maintain per row;
+# the unique (city_id, name) index stays because the upsert relies on it
+DEFERRABLE_INDEXES = {
+    "pois": [("ix_pois_geocell", "geocell"), ("ix_pois_city_id", "city_id")],
+    "restaurants": [("ix_restaurants_geocell", "geocell"), ("ix_restaurants_city_id", "city_id")],
+}
+
+# ---------- Read: raw records, streamed ----------
+
+def _open(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+def _sniff_format(path: str) -> str:
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".geojson", ".geojsonl", ".geojsons")):
+        return "geojson"
+    return "osm"
+
+def _iter_json_array(fh, key: str, bufsize: int = 1 << 16) -> Iterator[dict]:
+    """Items of the top-level array `key` in a (possibly huge) JSON document, one at a time."""
+    dec = json.JSONDecoder()
+    buf, found = "", False
+    while not found:
+        chunk = fh.read(bufsize)
+        if not chunk:
+            return
+        buf += chunk
+        i = buf.find(f'"{key}"')
+        if i >= 0:
+            j = buf.find("[", i)
+            if j >= 0:
+                buf, found = buf[j + 1 :], True
+            else:
+                buf = buf[i:]
+    while True:
+        buf = buf.lstrip().lstrip(",").lstrip()
+        if buf.startswith("]"):
+            return
+        try:
+            obj, end = dec.raw_decode(buf)
+        except ValueError:
+            chunk = fh.read(bufsize)
+            if not chunk:
+                return
+            buf += chunk
+            continue
+        yield obj
+        buf = buf[end:]
+
+def read_records(path: str, fmt: str) -> Iterator:
+    with _open(path) as fh:
+        if fmt == "csv":
+            yield from csv.DictReader(fh)
+            return
+        first = fh.read(1)
+        while first and first.isspace():
+            first = fh.read(1)
+        if fmt == "geojson" and first == "{":
+            # FeatureCollection unless the first line is itself a Feature (GeoJSONSeq)
+            line = first + fh.readline()
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                fh.seek(0)
+                yield from _iter_json_array(fh, "features")
+                return
+            if obj.get("type") == "FeatureCollection":   # minified onto one line
+                yield from obj.get("features") or []
+                return
+            yield obj
+        elif fmt == "osm" and first == "{":
+            head = first + fh.readline()
+            try:
+                obj = json.loads(head)    # newline-delimited elements
+            except ValueError:
+                fh.seek(0)
+                yield from _iter_json_array(fh, "elements")   # a saved Overpass response
+                return
+            if "elements" in obj:
+                yield from obj["elements"]
+                return
+            yield obj
+        for line in fh:
+            line = line.strip().lstrip("\x1e")   # GeoJSONSeq record separator
+            if line:
+                yield line
+
+# ---------- Parse: raw record -> (kind, row) ----------
+
+def _bool01(v, default: int) -> int:
+    if v is None or v == "":
+        return default
+    return 1 if str(v).strip().lower() in {"1", "true", "yes", "y", "designated"} else 0
+
+def _row_from_card(kind: str, card: Dict, city: str) -> Tuple[str, Dict]:
+    row = dict(
+        name=card["title"][:200], address=(card.get("address") or "")[:200],
+        lat=card["geo"][0], lon=card["geo"][1],
+        tags=",".join(t for t in card.get("tags", []) if t)[:200],
+        price_tier=card.get("price_tier", "$$"), city=city,
+    )
+    if kind == "pois":
+        row.update(duration_minutes=card.get("duration_minutes", 90),
+                   wheelchair_friendly=1 if card.get("wheelchair_friendly") else 0,
+                   child_friendly=1 if card.get("child_friendly", True) else 0)
+    return kind, row
+
+def _parse_element(el: Dict, default_city: str, kind: Optional[str]) -> List[Tuple[str, Dict]]:
+    tags = el.get("tags") or {}
+    city = tags.get("addr:city") or default_city
+    out = []
+    if kind in (None, "pois") and (kind or _matches(tags, POI_FILTERS)):
+        out += [_row_from_card("pois", c, city) for c in _elements_to_pois([el])]
+    if kind in (None, "restaurants") and (kind or _matches(tags, RESTO_FILTERS)):
+        out += [_row_from_card("restaurants", c, city) for c in _elements_to_restos([el])]
+    return out
+
+def _parse_csv(rec: Dict, default_city: str, kind: Optional[str]) -> List[Tuple[str, Dict]]:
+    k = kind or ("restaurants" if (rec.get("kind") or "").lower().startswith("rest") else "pois")
+    if not rec.get("name") or not rec.get("lat") or not rec.get("lon"):
+        return []
+    row = dict(
+        name=rec["name"][:200], address=(rec.get("address") or "")[:200],
+        lat=float(rec["lat"]), lon=float(rec["lon"]),
+        tags=",".join(t.strip() for t in (rec.get("tags") or "").replace(";", ",").split(",") if t.strip())[:200],
+        price_tier=rec.get("price_tier") if rec.get("price_tier") in {"$", "$$", "$$$"} else "$$",
+        city=rec.get("city") or default_city,
+    )
+    if k == "pois":
+        row.update(duration_minutes=int(rec.get("duration_minutes") or 90),
+                   wheelchair_friendly=_bool01(rec.get("wheelchair_friendly"), 0),
+                   child_friendly=_bool01(rec.get("child_friendly"), 1))
+    return [(k, row)]
+
+def _feature_point(geom: Dict) -> Optional[Tuple[float, float]]:
+    if not geom:
+        return None
+    coords = geom.get("coordinates")
+    t = geom.get("type")
+    if t == "Point":
+        return coords[1], coords[0]
+    # polygons / lines: mean of the outer ring is close enough for a map pin
+    while coords and isinstance(coords[0], list) and isinstance(coords[0][0], list):
+        coords = coords[0]
+    if not coords:
+        return None
+    return sum(c[1] for c in coords) / len(coords), sum(c[0] for c in coords) / len(coords)
+
+def parse_batch(fmt: str, records: List, default_city: str, kind: Optional[str]) -> List[Tuple[str, Dict]]:
+    """Worker entry point: a list of raw records -> parsed (kind, row) pairs; bad records are dropped."""
+    out: List[Tuple[str, Dict]] = []
+    for rec in records:
+        try:
+            if rec is None:
+                continue
+            if fmt == "csv":
+                out += _parse_csv(rec, default_city, kind)
+                continue
+            obj = json.loads(rec) if isinstance(rec, str) else rec
+            if fmt == "geojson":
+                pt = _feature_point(obj.get("geometry"))
+                if pt is None:
+                    continue
+                props = obj.get("properties") or {}
+                el = {"lat": pt[0], "lon": pt[1], "tags": props.get("tags") if isinstance(props.get("tags"), dict) else props}
+            else:
+                el = obj
+            out += _parse_element(el, default_city, kind)
+        except (KeyError, TypeError, ValueError):
+            continue
+    return out
+
+# ---------- Write: batched Core upserts ----------
+
+class Stats:
+    def __init__(self):
+        self.t0 = time.monotonic()
+        self.seconds = {"read": 0.0, "parse": 0.0, "write": 0.0}
+        self.records = 0
+        self.rows = 0
+        self.dropped = 0        # rows with no city (no addr:city and no --city)
+
+    def report(self, final: bool = False):
+        wall = max(time.monotonic() - self.t0, 1e-9)
+        per = "  ".join(f"{k} {s:.1f}s ({self.records / s:,.0f} rec/s)" if s else f"{k} 0.0s"
+                        for k, s in self.seconds.items())
+        tag = "done" if final else "…"
+        dropped = f", {self.dropped:,} dropped without a city" if self.dropped else ""
+        print(f"[import {tag}] {self.records:,} records -> {self.rows:,} rows{dropped} in {wall:.1f}s "
+              f"({self.records / wall:,.0f} rec/s) | {per}", file=sys.stderr, flush=True)
+
+def _write_batch(parsed: List[Tuple[str, Dict]], city_ids: Dict[str, Optional[int]]) -> Tuple[int, int]:
+    """Store one batch; (rows written, rows dropped because their city is blank)."""
+    with Session(engine) as db:
+        by_model: Dict[str, List[Dict]] = {"pois": [], "restaurants": []}
+        kept: List[Dict] = []
+        for kind, row in parsed:
+            if row["city"] not in city_ids:
+                city_ids[row["city"]] = resolve_city_id_sync(db, row["city"])
+            cid = city_ids[row["city"]]
+            if cid is None:
+                # a NULL city_id escapes the (city_id, name) key and every city read path
+                continue
+            row["city_id"] = cid
+            by_model[kind].append(row)
+            kept.append(row)
+        dialect = engine.dialect.name
+        for model, rows in ((POI, by_model["pois"]), (Restaurant, by_model["restaurants"])):
+            for stmt, chunk in upsert_batches(model, rows, dialect):
+                db.execute(stmt, chunk)
+        for kind, rows in by_model.items():
+            link_places(db, kind, rows)
+        # running servers rebuild these cities' candidate pools on their next request
+        if kept:
+            db.execute(bump_versions(r["city_id"] for r in kept))
+        db.commit()
+    return len(kept), len(parsed) - len(kept)
+
+def _load_checkpoint(path: Optional[str], source: str) -> int:
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path) as fh:
+        ck = json.load(fh)
+    return ck.get("records_done", 0) if ck.get("source") == os.path.abspath(source) else 0
+
+def _save_checkpoint(path: Optional[str], source: str, done: int):
+    if not path:
+        return
+    tmp = path + ".tmp"
+    with open(tmp, "w") as fh:
+        json.dump({"source": os.path.abspath(source), "records_done": done, "at": time.time()}, fh)
+    os.replace(tmp, path)
+
+# both check what exists first (MySQL has no DROP/CREATE INDEX IF [NOT] EXISTS), so a
+# re-run after an import that died halfway works either way
+def _drop_deferred_indexes(conn):
+    for table, idxs in DEFERRABLE_INDEXES.items():
+        present = {i["name"] for i in inspect(conn).get_indexes(table)}
+        for name, _ in idxs:
+            if name in present:
+                conn.execute(text(f"DROP INDEX {name} ON {table}" if conn.dialect.name == "mysql" else f"DROP INDEX {name}"))
+
+def _create_deferred_indexes(conn):
+    for table, idxs in DEFERRABLE_INDEXES.items():
+        present = {i["name"] for i in inspect(conn).get_indexes(table)}
+        for name, col in idxs:
+            if name not in present:
+                conn.execute(text(f"CREATE INDEX {name} ON {table} ({col})"))
+
+def _journal_mode(mode: Optional[str] = None) -> str:
+    """SQLite journal mode of the database file; sets it first when `mode` is given."""
+    with engine.begin() as conn:
+        return conn.execute(text(f"PRAGMA journal_mode={mode}" if mode else "PRAGMA journal_mode")).scalar()
+
+def run_import(path: str, fmt: Optional[str] = None, city: str = "", kind: Optional[str] = None,
+               batch_size: int = 5000, workers: int = 0, checkpoint: Optional[str] = None,
+               defer_indexes: bool = False, report_every: int = 10) -> Stats:
+    fmt = fmt or _sniff_format(path)
+    ensure_schema()
+    stats = Stats()
+    skip = _load_checkpoint(checkpoint, path)
+    done = skip
+    city_ids: Dict[str, Optional[int]] = {}
+
+    # WAL lets the API keep reading while batches commit; the file's own mode is put back after
+    restore_journal = None
+    if engine.dialect.name == "sqlite":
+        mode = _journal_mode()
+        if mode.lower() != "wal" and _journal_mode("WAL").lower() == "wal":
+            restore_journal = mode
+    if defer_indexes:
+        with engine.begin() as conn:
+            _drop_deferred_indexes(conn)
+
+    def batches() -> Iterator[List]:
+        it = read_records(path, fmt)
+        for _ in range(skip):
+            if next(it, StopIteration) is StopIteration:
+                return
+        batch: List = []
+        t = time.monotonic()
+        for rec in it:
+            batch.append(rec)
+            if len(batch) >= batch_size:
+                stats.seconds["read"] += time.monotonic() - t
+                yield batch
+                batch = []
+                t = time.monotonic()
+        stats.seconds["read"] += time.monotonic() - t
+        if batch:
+            yield batch
+
+    def commit(n_records: int, parsed: List[Tuple[str, Dict]]):
+        nonlocal done
+        t = time.monotonic()
+        written, dropped = _write_batch(parsed, city_ids)
+        stats.rows += written
+        stats.dropped += dropped
+        stats.seconds["write"] += time.monotonic() - t
+        done += n_records
+        stats.records += n_records
+        _save_checkpoint(checkpoint, path, done)
+
+    try:
+        n = 0
+        if workers > 0:
+            # bounded window of in-flight batches: Pool.imap would read the whole file ahead
+            with mp.get_context("spawn").Pool(workers) as pool:
+                window: deque = deque()
+                for batch in batches():
+                    window.append((len(batch), pool.apply_async(parse_batch, (fmt, batch, city, kind))))
+                    while len(window) > workers * 2:
+                        size, res = window.popleft()
+                        t = time.monotonic()
+                        parsed = res.get()
+                        stats.seconds["parse"] += time.monotonic() - t
+                        commit(size, parsed)
+                        n += 1
+                        if n % report_every == 0:
+                            stats.report()
+                while window:
+                    size, res = window.popleft()
+                    t = time.monotonic()
+                    parsed = res.get()
+                    stats.seconds["parse"] += time.monotonic() - t
+                    commit(size, parsed)
+        else:
+            for batch in batches():
+                t = time.monotonic()
+                parsed = parse_batch(fmt, batch, city, kind)
+                stats.seconds["parse"] += time.monotonic() - t
+                commit(len(batch), parsed)
+                n += 1
+                if n % report_every == 0:
+                    stats.report()
+    finally:
+        if defer_indexes:
+            t = time.monotonic()
+            with engine.begin() as conn:
+                _create_deferred_indexes(conn)
+            print(f"[import] rebuilt deferred indexes in {time.monotonic() - t:.1f}s", file=sys.stderr)
+        if restore_journal:
+            engine.dispose()    # leaving WAL needs the only connection to the file
+            try:
+                _journal_mode(restore_journal)
+            except Exception as e:
+                print(f"[import] couldn't restore journal_mode={restore_journal}: {e}", file=sys.stderr)
+    stats.report(final=True)
+    return stats
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(prog="python -m app.importer", description="Stream POI/restaurant extracts into the DB.")
+    ap.add_argument("path", help="CSV, GeoJSON(/Seq) or newline-delimited OSM JSON; .gz ok")
+    ap.add_argument("--format", choices=FORMATS, help="default: from the file extension")
+    ap.add_argument("--city", default="", help="city for records without one (e.g. 'Austin, TX'); "
+                                                   "records with neither are skipped")
+    ap.add_argument("--kind", choices=("pois", "restaurants"), help="force all records into one table")
+    ap.add_argument("--batch-size", type=int, default=5000)
+    ap.add_argument("--workers", type=int, default=0, help="parse worker processes (0 = inline)")
+    ap.add_argument("--checkpoint", help="resume file; progress is saved after every committed batch")
+    ap.add_argument("--defer-indexes", action="store_true", help="drop secondary indexes during the load, rebuild after")
+    a = ap.parse_args(argv)
+    run_import(a.path, a.format, a.city, a.kind, a.batch_size, a.workers, a.checkpoint, a.defer_indexes)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,5 @@
-from .db import engine
-from .models import Base
+from .migrate import ensure_schema
 
 if __name__ == "__main__":
-    Base.metadata.create_all(bind=engine)
+    ensure_schema()
     print("✅ Database tables created.")
@@ -0,0 +1,238 @@
+# Async plan jobs: POST /agent/jobs queues a row in plan_jobs, worker processes claim and run
+# them. The table is the queue, so API nodes and workers scale separately and a crashed worker
+# only costs a lease timeout. Run extra workers with:  python -m app.jobs --workers 4
+from __future__ import annotations
+from datetime import timedelta
+from typing import List, Optional, Tuple
+import argparse
+import asyncio
+import logging
+import multiprocessing as mp
+import os
+import signal
+import socket
+import time
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from .config import settings
+from .db import AsyncSessionLocal
+from .models import PlanJob, PlanRun
+from .runs import persist_runs
+from .schemas import AgentRequest, PlanResponse
+from .utils import utcnow
+from . import memo, runs, runstore
+
+logger = logging.getLogger(__name__)
+
+# ---------- Queue ----------
+
+async def submit(db, req: AgentRequest, priority: int = 0) -> Tuple[PlanJob, bool]:
+    """(job, deduplicated). An identical queued/running job is returned instead of a new one
+    (raised to the higher priority); a still-fresh memoized plan gives a job that is already done."""
+    key = memo.plan_key(req)
+    for _ in range(3):
+        pending = (await db.execute(select(PlanJob).where(PlanJob.active_key == key))).scalars().first()
+        if pending is not None:
+            if priority > pending.priority:
+                pending.priority = priority
+                await db.commit()
+            return pending, True
+
+        now = utcnow()
+        job = PlanJob(request_key=key, active_key=key, request_json=req.model_dump(mode="json"),
+                      priority=priority, status="queued", attempts=0, available_at=now)
+        # a run still waiting for the writer has no plan_runs row for run_id to point at
+        hit = await memo.cached_run(db, key, persisted_only=True)
+        if hit is not None:
+            job.status, job.active_key, job.run_id, job.finished_at = "done", None, hit.id, now
+        db.add(job)
+        try:
+            await db.commit()
+            return job, False
+        except IntegrityError:
+            # an identical submit got its pending job in first: return that one
+            await db.rollback()
+    raise RuntimeError(f"couldn't queue or find a pending job for {key}")
+
+async def job_status(db, job_id: int) -> Optional[dict]:
+    job = await db.get(PlanJob, job_id)
+    if job is None:
+        return None
+    out = {"job_id": job.id, "status": job.status, "priority": job.priority, "attempts": job.attempts,
+           "run_id": job.run_id, "error": job.error, "output": None}
+    if job.status == "done" and job.run_id is not None:
+        run = await db.get(PlanRun, job.run_id)
+        if run is not None:
+            await runstore.hydrate(db, [run])
+            out["output"] = run.result
+    return out
+
+async def _claim(db, worker_id: str) -> Optional[PlanJob]:
+    # optimistic claim: pick the best candidate, then flip it only if it is still queued;
+    # portable across SQLite/MySQL/Postgres and safe with any number of worker processes
+    for _ in range(5):
+        now = utcnow()
+        job_id = (await db.execute(
+            select(PlanJob.id).where(PlanJob.status == "queued", PlanJob.available_at <= now)
+            .order_by(PlanJob.priority.desc(), PlanJob.id).limit(1)
+        )).scalar()
+        if job_id is None:
+            return None
+        res = await db.execute(
+            update(PlanJob).where(PlanJob.id == job_id, PlanJob.status == "queued")
+            .values(status="running", locked_by=worker_id, locked_at=now, attempts=PlanJob.attempts + 1)
+        )
+        await db.commit()
+        if res.rowcount == 1:
+            return await db.get(PlanJob, job_id, populate_existing=True)
+    return None
+
+async def requeue_stale(db) -> int:
+    """Running jobs whose worker died: back to the queue, or failed once out of attempts."""
+    now = utcnow()
+    stale = (PlanJob.status == "running", PlanJob.locked_at < now - timedelta(seconds=settings.job_lease_s))
+    failed = await db.execute(update(PlanJob).where(*stale, PlanJob.attempts >= settings.job_max_attempts)
+                              .values(status="failed", active_key=None, error="worker lease expired", finished_at=now))
+    requeued = await db.execute(update(PlanJob).where(*stale)
+                                .values(status="queued", locked_by=None, locked_at=None, available_at=now))
+    await db.commit()
+    return failed.rowcount + requeued.rowcount
+
+async def _finish(job: PlanJob, **values) -> bool:
+    # only while this worker still holds the lease: a requeued job belongs to its new owner
+    async with AsyncSessionLocal() as db:
+        res = await db.execute(update(PlanJob).where(PlanJob.id == job.id, PlanJob.locked_by == job.locked_by,
+                                                     PlanJob.status == "running")
+                               .values(locked_by=None, **values))
+        await db.commit()
+    if res.rowcount != 1:
+        logger.warning("job %s: lease lost before it finished, result left to the new owner", job.id)
+    return res.rowcount == 1
+
+async def _keep_lease(job: PlanJob):
+    """Push locked_at forward while the job runs, so a slow plan isn't requeued under us."""
+    while True:
+        await asyncio.sleep(settings.job_lease_s / 3)
+        try:
+            async with AsyncSessionLocal() as db:
+                res = await db.execute(update(PlanJob).where(PlanJob.id == job.id, PlanJob.locked_by == job.locked_by,
+                                                             PlanJob.status == "running")
+                                       .values(locked_at=utcnow()))
+                await db.commit()
+            if res.rowcount != 1:
+                return
+        except Exception as e:
+            logger.warning("job %s lease renewal failed: %s", job.id, e)
+
+async def run_job(job: PlanJob):
+    from .agent import build_plan
+    lease = asyncio.ensure_future(_keep_lease(job))
+    try:
+        req = AgentRequest.model_validate(job.request_json)
+        output = await build_plan(req.booking, req.preferences, req.ask, AsyncSessionLocal,
+                                  rng=memo.plan_rng(job.request_key))
+        result = PlanResponse.model_validate(output)
+        async with AsyncSessionLocal() as db:
+            [run_id] = await persist_runs(db, [(req, job.request_key, result)])
+        await _finish(job, status="done", active_key=None, run_id=run_id, error=None, finished_at=utcnow())
+    except Exception as e:
+        logger.warning("job %s attempt %s failed: %s", job.id, job.attempts, e)
+        if job.attempts < settings.job_max_attempts:
+            delay = settings.job_retry_base_s * 2 ** (job.attempts - 1)
+            await _finish(job, status="queued", error=str(e), available_at=utcnow() + timedelta(seconds=delay))
+        else:
+            await _finish(job, status="failed", active_key=None, error=str(e), finished_at=utcnow())
+    finally:
+        lease.cancel()
+
+# ---------- Workers ----------
+
+async def work(worker_id: str, concurrency: int, stop: asyncio.Event):
+    """Claim and run jobs, up to `concurrency` at a time, until `stop` is set."""
+    slots = asyncio.Semaphore(concurrency)
+    running: set = set()
+    last_reap = 0.0
+    while not stop.is_set():
+        await slots.acquire()
+        try:
+            async with AsyncSessionLocal() as db:
+                if time.monotonic() - last_reap > settings.job_lease_s / 4:
+                    last_reap = time.monotonic()
+                    await requeue_stale(db)
+                job = await _claim(db, worker_id)
+        except Exception as e:
+            logger.warning("job claim failed: %s", e)
+            job = None
+        if job is None:
+            slots.release()
+            try:
+                await asyncio.wait_for(stop.wait(), settings.job_poll_s)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        task = asyncio.ensure_future(run_job(job))
+        running.add(task)
+        task.add_done_callback(lambda t: (running.discard(t), slots.release()))
+    # finish what we hold; anything cut short is requeued once its lease expires
+    if running:
+        await asyncio.gather(*running, return_exceptions=True)
+
+async def _worker_async(worker_id: str, concurrency: int):
+    from . import upstream, weather
+    from .db import async_engine
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await asyncio.to_thread(runs.lease_node)
+    node_lease = asyncio.ensure_future(runs.node_lease_loop(stop))
+    try:
+        await work(worker_id, concurrency, stop)
+    finally:
+        stop.set()
+        await node_lease
+        await asyncio.to_thread(runs.release_node)
+        await weather.flush_writes()
+        await upstream.aclose()
+        await async_engine.dispose()
+
+def _worker_main(index: int, concurrency: int):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    asyncio.run(_worker_async(f"{socket.gethostname()}:{os.getpid()}:{index}", concurrency))
+
+def start_workers(n: int, concurrency: int | None = None) -> List[mp.Process]:
+    ctx = mp.get_context("spawn")
+    procs = [ctx.Process(target=_worker_main, args=(i, concurrency or settings.job_concurrency),
+                         name=f"plan-worker-{i}", daemon=True) for i in range(n)]
+    for p in procs:
+        p.start()
+    return procs
+
+def stop_workers(procs: List[mp.Process], timeout: float = 30.0):
+    for p in procs:
+        if p.is_alive():
+            p.terminate()   # SIGTERM: stop claiming, finish running jobs
+    deadline = time.monotonic() + timeout
+    for p in procs:
+        p.join(max(0.0, deadline - time.monotonic()))
+        if p.is_alive():
+            p.kill()
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Run plan job workers.")
+    ap.add_argument("--workers", type=int, default=max(1, settings.job_workers), help="worker processes")
+    ap.add_argument("--concurrency", type=int, default=settings.job_concurrency, help="jobs per worker")
+    args = ap.parse_args(argv)
+    from .migrate import ensure_schema
+    ensure_schema()
+    procs = start_workers(args.workers, args.concurrency)
+    print(f"✅ {args.workers} plan worker(s) x {args.concurrency} running. Ctrl-C to stop.")
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        stop_workers(procs)
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,53 @@
-from fastapi import FastAPI, Depends, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, Header, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-import logging, traceback
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio, json, logging, traceback
 
-from .db import get_db, engine
-from .models import Base, Booking, Preference, PlanRun
-from .schemas import AgentRequest, AgentResponse, PlanResponse
-from .agent import build_plan
+from .db import get_async_db, async_engine, AsyncSessionLocal
+from .migrate import ensure_schema
+from .config import settings
+from .schemas import AgentRequest, AgentResponse, BatchPlanRequest, DayPlan, JobStatus, PlanResponse, RestaurantCard
+from .agent import build_plan, plan_events, TripContext
+from .utils import normalize_location
+from . import memo, jobs, metrics, prefetch, runs, runstore, upstream, weather
 
 logger = logging.getLogger("uvicorn.error")
 
 # Ensure tables (demo-safe; use Alembic in prod)
-Base.metadata.create_all(bind=engine)
+ensure_schema()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(runs.lease_node)
+    workers = jobs.start_workers(settings.job_workers) if settings.job_workers > 0 else []
+    if settings.run_write_behind:
+        runs.writer.start()
+    stop = asyncio.Event()
+    node_lease = asyncio.ensure_future(runs.node_lease_loop(stop))
+    retention = asyncio.ensure_future(runstore.retention_loop(stop)) if settings.run_retention_every_s > 0 else None
+    warming = asyncio.ensure_future(prefetch.prefetch_loop(stop)) if settings.prefetch_every_s > 0 else None
+    yield
+    stop.set()
+    if warming is not None:
+        warming.cancel()     # a half-done warm-up is harmless, but it must stop before the clients close
+        try:
+            await warming
+        except asyncio.CancelledError:
+            pass
+    if retention is not None:
+        await retention
+    await asyncio.to_thread(jobs.stop_workers, workers)
+    await runs.writer.aclose()   # every run already answered gets stored
+    await node_lease
+    await asyncio.to_thread(runs.release_node)
+    await weather.flush_writes()
+    await upstream.aclose()
+    await async_engine.dispose()
 
 app = FastAPI(
+    lifespan=lifespan,
     title="AI Concierge Agent",
     version="1.0.0",
     description="""
@@ -29,8 +63,10 @@ Test at **POST /agent/plan**. Swagger is this page.
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], allow_credentials=True
+    allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], allow_credentials=True,
+    expose_headers=["Server-Timing", "X-Plan-Cache"],
 )
+app.add_middleware(metrics.ServerTiming)
 
 @app.get("/")
 def index():
@@ -41,42 +77,201 @@ def health():
     return {"ok": True, "env": "development"}
 
 @app.post("/agent/plan", response_model=AgentResponse)
-def plan(req: AgentRequest, db: Session = Depends(get_db)):
+async def plan(req: AgentRequest, response: Response, db: AsyncSession = Depends(get_async_db),
+               cache_control: str | None = Header(default=None)):
     try:
-        # persist booking/preference
-        booking = Booking(
-            start_date=req.booking.start_date,
-            end_date=req.booking.end_date,
-            location=req.booking.location,
-            party_type=req.booking.party_type
-        )
-        db.add(booking); db.flush()
-
-        pref = Preference(
-            budget_tier=req.preferences.budget_tier,
-            interests=",".join(req.preferences.interests),
-            mobility=req.preferences.mobility or None,
-            dietary=req.preferences.dietary or None
-        )
-        db.add(pref); db.flush()
-
-        # build plan
-        output: dict = build_plan(req.booking, req.preferences, req.ask, db)
+        # identical request planned recently: answer from its PlanRun (Cache-Control: no-cache skips this)
+        key = memo.plan_key(req)
+        if not memo.wants_fresh(cache_control):
+            with metrics.stage("memo"):
+                hit = await memo.cached_run(db, key)
+            if hit is not None:
+                response.headers["X-Plan-Cache"] = "hit"
+                return AgentResponse(run_id=hit.id, output=PlanResponse.model_validate(hit.result))
+        response.headers["X-Plan-Cache"] = "miss"
+
+        # build plan first: the pipeline's own sessions write to the place cache, and
+        # holding this session's write transaction open meanwhile would lock SQLite
+        output: dict = await build_plan(req.booking, req.preferences, req.ask, AsyncSessionLocal,
+                                        rng=memo.plan_rng(key))
         result = PlanResponse.model_validate(output)
 
-        # log run
-        run = PlanRun(
-            booking_id=booking.id,
-            preference_id=pref.id,
-            user_query=req.ask or "",
-            weather_summary=result.weather_summary,
-            result_json=result.model_dump()
-        )
-        db.add(run); db.commit(); db.refresh(run)
+        # booking/preference/run rows are written behind the response
+        with metrics.stage("persist"):
+            [run_id] = await runs.writer.submit([(req, key, result)])
 
-        return AgentResponse(run_id=run.id, output=result)
+        return AgentResponse(run_id=run_id, output=result)
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error("plan() failed: %s\n%s", e, traceback.format_exc())
         raise HTTPException(status_code=400, detail=f"Agent error: {e}")
+
+def _ndjson(event: dict) -> bytes:
+    return (json.dumps(event, default=str) + "\n").encode()
+
+def _sse(event: dict) -> bytes:
+    return f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n".encode()
+
+def _validated(stage: str, payload):
+    # each piece is checked against its part of PlanResponse before it goes out
+    if stage == "restaurants":
+        return [RestaurantCard.model_validate(r).model_dump(mode="json") for r in payload]
+    if stage == "day":
+        return DayPlan.model_validate(payload).model_dump(mode="json")
+    return payload
+
+def _cached_events(result: dict):
+    yield "weather", {"weather_summary": result["weather_summary"], "packing_checklist": result["packing_checklist"]}
+    yield "restaurants", result["restaurants"]
+    for day in result["itinerary"]:
+        yield "day", day
+    yield "notes", result.get("notes")
+
+async def _plan_stream(req: AgentRequest, fresh: bool, encode):
+    key = memo.plan_key(req)
+    try:
+        if not fresh:
+            with metrics.stage("memo"):
+                async with AsyncSessionLocal() as db:
+                    hit = await memo.cached_run(db, key)
+            if hit is not None:
+                for stage, payload in _cached_events(hit.result):
+                    yield encode({"type": stage, "data": payload})
+                yield encode({"type": "done", "run_id": hit.id, "cached": True})
+                return
+
+        out: dict = {"itinerary": []}
+        async for stage, payload in plan_events(req.booking, req.preferences, req.ask, AsyncSessionLocal,
+                                                rng=memo.plan_rng(key)):
+            payload = _validated(stage, payload)
+            if stage == "weather":
+                out.update(payload)
+            elif stage == "day":
+                out["itinerary"].append(payload)
+            else:
+                out[stage] = payload
+            yield encode({"type": stage, "data": payload})
+
+        result = PlanResponse.model_validate(out)
+        with metrics.stage("persist"):
+            [run_id] = await runs.writer.submit([(req, key, result)])
+        yield encode({"type": "done", "run_id": run_id, "cached": False})
+    except Exception as e:
+        logger.error("plan_stream() failed: %s\n%s", e, traceback.format_exc())
+        yield encode({"type": "error", "detail": f"Agent error: {e}"})
+
+@app.post("/agent/plan/stream")
+async def plan_stream(req: AgentRequest, accept: str | None = Header(default=None),
+                      cache_control: str | None = Header(default=None)):
+    """/agent/plan, delivered piecewise as each stage finishes: `weather` (summary + packing
+    list), `restaurants`, one `day` per date, `notes`, then `done` with the run_id (or `error`).
+    NDJSON by default; Server-Sent Events with `Accept: text/event-stream`."""
+    if "text/event-stream" in (accept or ""):
+        return StreamingResponse(_plan_stream(req, memo.wants_fresh(cache_control), _sse),
+                                 media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    return StreamingResponse(_plan_stream(req, memo.wants_fresh(cache_control), _ndjson),
+                             media_type="application/x-ndjson")
+
+async def _batch_events(reqs, fresh: bool):
+    keys = [memo.plan_key(r) for r in reqs]
+    async with AsyncSessionLocal() as db:
+        hits = {} if fresh else await memo.cached_runs(db, keys)
+    run_ids = [hits[k].id if k in hits else None for k in keys]
+    for i, k in enumerate(keys):
+        if k in hits:
+            yield _ndjson({"type": "result", "index": i, "run_id": hits[k].id, "cached": True,
+                           "output": hits[k].result})
+
+    # identical requests build once; every request for the same city and dates shares one
+    # TripContext, so geocode/weather/events (and the OSM sync) happen once per city window
+    contexts: dict = {}
+    sem = asyncio.Semaphore(settings.plan_batch_concurrency)
+
+    async def build(req: AgentRequest, key: str) -> PlanResponse:
+        b = req.booking
+        ctx_key = (normalize_location(b.location), b.start_date, b.end_date)
+        ctx = contexts.get(ctx_key)
+        if ctx is None:
+            ctx = contexts[ctx_key] = TripContext(b.location, b.start_date, b.end_date)
+        async with sem:
+            output = await build_plan(b, req.preferences, req.ask, AsyncSessionLocal,
+                                      rng=memo.plan_rng(key), context=ctx)
+        return PlanResponse.model_validate(output)
+
+    tasks: dict = {}     # key -> task
+    waiting: dict = {}   # task -> [index, ...]
+    for i, (req, k) in enumerate(zip(reqs, keys)):
+        if k in hits:
+            continue
+        if k not in tasks:
+            tasks[k] = asyncio.ensure_future(build(req, k))
+        waiting.setdefault(tasks[k], []).append(i)
+
+    built = []
+    failed = 0
+    try:
+        pending = set(waiting)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                for i in waiting[task]:
+                    if task.exception() is not None:
+                        failed += 1
+                        logger.error("plan_batch[%d] failed: %s", i, task.exception())
+                        yield _ndjson({"type": "error", "index": i, "detail": f"Agent error: {task.exception()}"})
+                    else:
+                        built.append((i, task.result()))
+                        yield _ndjson({"type": "result", "index": i, "run_id": None, "cached": False,
+                                       "output": task.result().model_dump(mode="json")})
+    finally:
+        for task in waiting:
+            task.cancel()
+
+    # everything built is handed to the run writer together
+    done_event = {"type": "done", "run_ids": run_ids, "cached": len(reqs) - len(built) - failed,
+                  "planned": len(built), "failed": failed}
+    if built:
+        try:
+            ids = await runs.writer.submit([(reqs[i], keys[i], result) for i, result in built])
+            for (i, _), run_id in zip(built, ids):
+                run_ids[i] = run_id
+        except Exception as e:
+            logger.error("plan_batch persist failed: %s\n%s", e, traceback.format_exc())
+            done_event["persist_error"] = str(e)
+    yield _ndjson(done_event)
+
+@app.post("/agent/plan/batch")
+async def plan_batch(batch: BatchPlanRequest, cache_control: str | None = Header(default=None)):
+    """Plans many requests at once, streamed as NDJSON: a `result` (or `error`) line per request
+    as soon as it is ready, in completion order, then a `done` line carrying every run_id."""
+    return StreamingResponse(_batch_events(batch.requests, memo.wants_fresh(cache_control)),
+                             media_type="application/x-ndjson")
+
+@app.post("/agent/jobs", response_model=JobStatus, status_code=202)
+async def submit_job(req: AgentRequest, priority: int = 0, db: AsyncSession = Depends(get_async_db)):
+    """Queue a plan and return at once; poll GET /agent/jobs/{job_id}. Higher priority runs first,
+    and an identical job that is still pending is returned instead of queueing a second one."""
+    job, deduplicated = await jobs.submit(db, req, priority)
+    return JobStatus(job_id=job.id, status=job.status, priority=job.priority, attempts=job.attempts,
+                     run_id=job.run_id, deduplicated=deduplicated)
+
+@app.get("/agent/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: int, db: AsyncSession = Depends(get_async_db)):
+    status = await jobs.job_status(db, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return status
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """Prometheus text: plan_stage_seconds, upstream_request_seconds, http_request_seconds,
+    cache hit/miss and Overpass mirror counters (see app.metrics)."""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/agent/prefetch")
+def prefetch_stats():
+    """Cache warming: share of plans whose city was warmed ahead of time, the last pass
+    (targets, upstream calls spent) and the caches it fills."""
+    return prefetch.prefetch_stats()
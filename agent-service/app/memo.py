@@ -0,0 +1,88 @@
+from __future__ import annotations
+from datetime import timedelta
+from typing import Dict, Iterable, Tuple
+import hashlib
+import json
+import random
+from sqlalchemy import select
+
+from .config import settings
+from .models import PlanRun
+from .utils import normalize_location, utcnow
+from . import metrics, runstore
+
+def _norm(s: str | None) -> str:
+    return " ".join((s or "").lower().split())
+
+def canonical_request(req) -> dict:
+    """Everything that shapes the plan, with cosmetic differences (case, spacing, interest
+    order, 'Portland, OR' vs 'portland or') normalized away."""
+    b, p = req.booking, req.preferences
+    return {
+        "location": normalize_location(b.location),
+        "start": b.start_date.isoformat(),
+        "end": b.end_date.isoformat(),
+        "party": b.party_type,
+        "tier": p.budget_tier,
+        "interests": sorted({_norm(i) for i in p.interests if _norm(i)}),
+        "mobility": _norm(p.mobility) or None,
+        "dietary": _norm(p.dietary) or None,
+        "ask": _norm(req.ask) or None,
+    }
+
+def plan_key(req) -> str:
+    blob = json.dumps(canonical_request(req), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"v1|{blob}".encode()).hexdigest()
+
+def plan_rng(key: str) -> random.Random:
+    # same request -> same itinerary, whether it's served from the memo or rebuilt
+    return random.Random(int(key[:16], 16))
+
+def wants_fresh(cache_control: str | None) -> bool:
+    return "no-cache" in {d.strip().lower() for d in (cache_control or "").split(",")}
+
+def expiry():
+    return utcnow() + timedelta(seconds=settings.plan_cache_ttl_s) if settings.plan_cache_ttl_s > 0 else None
+
+# runs accepted by the write-behind writer (runs.RunWriter) but not stored yet
+_pending: Dict[str, PlanRun] = {}
+
+def hold(key: str, run: PlanRun):
+    _pending[key] = run
+
+def release(runs: Iterable[Tuple[str, int]]):
+    # (key, run id): a newer pending run for the same key stays until its own write
+    for key, run_id in runs:
+        if key in _pending and _pending[key].id == run_id:
+            del _pending[key]
+
+async def cached_run(db, key: str, persisted_only: bool = False) -> PlanRun | None:
+    """Newest unexpired run for the key; its PlanResponse dict is on run.result.
+    persisted_only skips runs still queued for the writer, for callers storing the run id."""
+    if settings.plan_cache_ttl_s <= 0:
+        return None
+    if key in _pending and not persisted_only:
+        metrics.cache_lookup("plan_memo", True)
+        return _pending[key]
+    stmt = (select(PlanRun)
+            .where(PlanRun.request_key == key, PlanRun.expires_at > utcnow())
+            .order_by(PlanRun.id.desc()).limit(1))
+    run = (await db.execute(stmt)).scalars().first()
+    metrics.cache_lookup("plan_memo", run is not None)
+    await runstore.hydrate(db, [run])
+    return run
+
+async def cached_runs(db, keys) -> dict:
+    """{key: newest unexpired PlanRun} for a whole batch in one query."""
+    keys = list(set(keys))
+    if settings.plan_cache_ttl_s <= 0 or not keys:
+        return {}
+    stmt = (select(PlanRun)
+            .where(PlanRun.request_key.in_(keys), PlanRun.expires_at > utcnow())
+            .order_by(PlanRun.id))
+    out = {run.request_key: run for run in (await db.execute(stmt)).scalars()}
+    await runstore.hydrate(db, out.values())
+    out.update((k, _pending[k]) for k in keys if k in _pending)
+    metrics.count("cache_lookups_total", len(out), cache="plan_memo", result="hit")
+    metrics.count("cache_lookups_total", len(keys) - len(out), cache="plan_memo", result="miss")
+    return out
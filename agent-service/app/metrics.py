@@ -0,0 +1,210 @@
+# Process-local metrics: latency histograms per plan stage, per upstream and per API route, plus
+# counters for cache hits/misses, Overpass mirror answers and place lookups, served as Prometheus
+# text on GET /metrics. The stages one request ran through also go back to the client in its
+# Server-Timing header (ServerTiming middleware). Job workers are separate processes with their
+# own, unexported numbers.
+from __future__ import annotations
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Tuple
+import bisect
+import time
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _labels(kw: Dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in kw.items()))
+
+def _fmt(labels: Labels) -> str:
+    if not labels:
+        return ""
+    esc = lambda v: v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels) + "}"
+
+def _num(v: float) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = BUCKETS):
+        self.name, self.help, self.buckets = name, help, buckets
+        self.series: Dict[Labels, list] = {}     # labels -> [count per bucket..., sum, count]
+
+    def observe(self, value: float, labels: Labels = ()):
+        s = self.series.get(labels)
+        if s is None:
+            s = self.series[labels] = [0] * len(self.buckets) + [0.0, 0]
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            s[i] += 1
+        s[-2] += value
+        s[-1] += 1
+
+    def samples(self) -> Iterable[str]:
+        for labels, s in sorted(self.series.items()):
+            cum = 0
+            for b, c in zip(self.buckets, s):
+                cum += c
+                yield f"{self.name}_bucket{_fmt(labels + (('le', _num(b)),))} {cum}"
+            yield f"{self.name}_bucket{_fmt(labels + (('le', '+Inf'),))} {s[-1]}"
+            yield f"{self.name}_sum{_fmt(labels)} {round(s[-2], 6)}"
+            yield f"{self.name}_count{_fmt(labels)} {s[-1]}"
+
+class Counter:
+    """Counted here, plus any `sources` (callables -> {labels: value}) read at scrape time for
+    numbers other objects already keep, e.g. TTLCache hits."""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name, self.help = name, help
+        self.series: Dict[Labels, float] = {}
+        self.sources: List[Callable[[], Dict[Labels, float]]] = []
+
+    def inc(self, n: float = 1, labels: Labels = ()):
+        self.series[labels] = self.series.get(labels, 0) + n
+
+    def _values(self) -> Dict[Labels, float]:
+        out = dict(self.series)
+        for src in self.sources:
+            for labels, v in src().items():
+                out[labels] = out.get(labels, 0) + v
+        return out
+
+    def samples(self) -> Iterable[str]:
+        for labels, v in sorted(self._values().items()):
+            yield f"{self.name}{_fmt(labels)} {_num(v)}"
+
+class Gauge(Counter):
+    kind = "gauge"
+
+_metrics: Dict[str, Histogram | Counter] = {}
+
+def _define(m):
+    _metrics[m.name] = m
+    return m
+
+STAGES = _define(Histogram("plan_stage_seconds", "Time a request spent in each plan stage (stages overlap)"))
+_define(Histogram("upstream_request_seconds", "Upstream HTTP attempts (retries count separately) by upstream and outcome"))
+_define(Histogram("http_request_seconds", "API requests by route, method and status"))
+_define(Histogram("run_flush_seconds", "Write-behind plan run batches"))
+_define(Counter("cache_lookups_total", "Cache lookups by cache and result"))
+_define(Gauge("cache_entries", "Entries held per cache"))
+_define(Counter("overpass_answers_total", "Overpass fetches by answering mirror (none = all failed); "
+                                          "fallback=true when it wasn't the first-ranked mirror"))
+_define(Counter("overpass_truncated_total", "Overpass result sets that filled the limit (an arbitrary slice), by radius"))
+_define(Counter("place_sources_total", "Candidate loads by kind and source (pool, sql, radius, none)"))
+_define(Counter("place_rounds_total", "Place lookups by kind and rounds (2 = DB miss, OSM sync, reload)"))
+_define(Counter("ask_parses_total", "Free-text asks by how they were parsed"))
+_define(Counter("run_writes_total", "Plan runs stored by the write-behind writer, by result"))
+_define(Gauge("run_queue_depth", "Plan runs waiting for the write-behind writer"))
+
+def observe(name: str, value: float, **labels):
+    _metrics[name].observe(value, _labels(labels))
+
+def count(name: str, n: float = 1, **labels):
+    _metrics[name].inc(n, _labels(labels))
+
+def cache_lookup(cache: str, hit: bool):
+    count("cache_lookups_total", cache=cache, result="hit" if hit else "miss")
+
+def track_cache(name: str, cache):
+    """Export a TTLCache / DiskCache's own hit, miss and size counters under `name`."""
+    def lookups():
+        s = cache.stats()
+        return {_labels(dict(cache=name, result="hit")): s["hits"], _labels(dict(cache=name, result="miss")): s["misses"]}
+
+    def entries():
+        s = cache.stats()
+        return {_labels(dict(cache=name)): s.get("size", s.get("entries", 0))}
+    _metrics["cache_lookups_total"].sources.append(lookups)
+    _metrics["cache_entries"].sources.append(entries)
+
+def gauge(name: str, read: Callable[[], float]):
+    """Read an unlabelled gauge at scrape time."""
+    _metrics[name].sources.append(lambda: {(): read()})
+
+def render() -> str:
+    lines = []
+    for m in _metrics.values():
+        lines += [f"# HELP {m.name} {m.help}", f"# TYPE {m.name} {m.kind}", *m.samples()]
+    return "\n".join(lines) + "\n"
+
+# ---------- Per-request stage timings (Server-Timing) ----------
+
+# (name, seconds or None, desc); tasks a request starts share its list
+_timings: ContextVar[List[Tuple[str, float | None, str | None]] | None] = ContextVar("stage_timings", default=None)
+
+@contextmanager
+def stage(name: str):
+    """Time the block into plan_stage_seconds{stage=name} and the current request's Server-Timing."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        dt = time.perf_counter() - t0
+        STAGES.observe(dt, (("stage", name),))
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((name, dt, None))
+
+async def timed(name: str, aw):
+    with stage(name):
+        return await aw
+
+def annotate(name: str, desc: str):
+    """A Server-Timing entry without a duration, e.g. which mirror answered."""
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((name, None, desc))
+
+def server_timing(timings, total: float) -> str:
+    # one entry per stage: repeats (e.g. two place loads) are summed, the last description wins
+    durs: Dict[str, float | None] = {}
+    descs: Dict[str, str] = {}
+    for name, dt, desc in timings:
+        if dt is not None:
+            durs[name] = (durs.get(name) or 0.0) + dt
+        else:
+            durs.setdefault(name, None)
+            descs[name] = desc.replace('"', "'")
+    parts = []
+    for name, d in durs.items():
+        part = name if d is None else f"{name};dur={d * 1000:.1f}"
+        parts.append(part + (f';desc="{descs[name]}"' if name in descs else ""))
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+class ServerTiming:
+    """ASGI middleware: per-request stage list, Server-Timing on the response and
+    http_request_seconds per route. Streamed responses send their headers before planning
+    starts, so theirs only has the total; their stages still reach the histograms."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        timings: list = []
+        token = _timings.set(timings)
+        t0 = time.perf_counter()
+        status = 500
+
+        async def send_timed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers") or [])
+                headers.append((b"server-timing", server_timing(timings, time.perf_counter() - t0).encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            _timings.reset(token)
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            observe("http_request_seconds", time.perf_counter() - t0, route=route, method=scope["method"], status=status)
@@ -0,0 +1,136 @@
+# Demo-safe schema setup: create_all() for new tables, plus additive upgrades
+# (new columns / indexes + backfill) for databases created by an older version.
+# Use Alembic in prod.
+from sqlalchemy import inspect, text
+
+from .db import engine
+from .geo import geocell
+from .models import Base
+
+def _columns(conn, table: str) -> set[str]:
+    return {c["name"] for c in inspect(conn).get_columns(table)}
+
+def _indexes(conn, table: str) -> set[str]:
+    return {i["name"] for i in inspect(conn).get_indexes(table)}
+
+def backfill_geocells(conn, table: str) -> int:
+    rows = conn.execute(text(f"SELECT id, lat, lon FROM {table} WHERE geocell IS NULL")).all()
+    if rows:
+        conn.execute(text(f"UPDATE {table} SET geocell = :g WHERE id = :id"),
+                     [{"g": geocell(lat, lon), "id": id_} for id_, lat, lon in rows])
+    return len(rows)
+
+def _add_places_version(conn):
+    if "places_version" not in _columns(conn, "cities"):
+        conn.execute(text("ALTER TABLE cities ADD COLUMN places_version INTEGER NOT NULL DEFAULT 0"))
+
+def _add_geocell(conn):
+    for table in ("pois", "restaurants"):
+        if "geocell" not in _columns(conn, table):
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN geocell INTEGER"))
+        if f"ix_{table}_geocell" not in _indexes(conn, table):
+            conn.execute(text(f"CREATE INDEX ix_{table}_geocell ON {table} (geocell)"))
+        backfill_geocells(conn, table)
+
+def _add_city_id(conn):
+    from sqlalchemy.orm import Session
+    from .cities import resolve_city_id_sync
+    for table in ("pois", "restaurants"):
+        if "city_id" not in _columns(conn, table):
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN city_id INTEGER REFERENCES cities(id)"))
+        if f"ix_{table}_city_id" not in _indexes(conn, table):
+            conn.execute(text(f"CREATE INDEX ix_{table}_city_id ON {table} (city_id)"))
+        names = conn.execute(text(f"SELECT DISTINCT city FROM {table} WHERE city_id IS NULL")).scalars().all()
+        if names:
+            db = Session(bind=conn)
+            ids = {n: resolve_city_id_sync(db, n) for n in names}
+            db.flush()
+            # blank cities resolve to None and stay unlinked; executemany can't take an empty list
+            params = [{"cid": cid, "city": n} for n, cid in ids.items() if cid is not None]
+            if params:
+                conn.execute(text(f"UPDATE {table} SET city_id = :cid WHERE city = :city AND city_id IS NULL"), params)
+
+def _unique_city_name(conn):
+    for table in ("pois", "restaurants"):
+        name = f"uq_{table}_city_name"
+        insp = inspect(conn)
+        if name in {u["name"] for u in insp.get_unique_constraints(table)} | _indexes(conn, table):
+            continue
+        # keep the oldest copy of any (city_id, name) duplicate before enforcing uniqueness
+        dupes = conn.execute(text(
+            f"SELECT id FROM {table} t WHERE city_id IS NOT NULL AND EXISTS "
+            f"(SELECT 1 FROM {table} o WHERE o.city_id = t.city_id AND o.name = t.name AND o.id < t.id)"
+        )).scalars().all()
+        if dupes:
+            conn.execute(text(f"DELETE FROM {table} WHERE id = :id"), [{"id": i} for i in dupes])
+        conn.execute(text(f"CREATE UNIQUE INDEX {name} ON {table} (city_id, name)"))
+
+def _add_plan_memo(conn):
+    cols = _columns(conn, "plan_runs")
+    if "request_key" not in cols:
+        conn.execute(text("ALTER TABLE plan_runs ADD COLUMN request_key VARCHAR(64)"))
+    if "expires_at" not in cols:
+        conn.execute(text("ALTER TABLE plan_runs ADD COLUMN expires_at DATETIME"))
+    if "ix_plan_runs_request_key" not in _indexes(conn, "plan_runs"):
+        conn.execute(text("CREATE INDEX ix_plan_runs_request_key ON plan_runs (request_key)"))
+
+def _backfill_place_tags(conn):
+    # places written before the tag index existed; new writes link their own tags
+    from sqlalchemy.orm import Session
+    from .tagindex import link_places
+    if conn.execute(text("SELECT 1 FROM tags LIMIT 1")).first() is not None:
+        return
+    db = Session(bind=conn)
+    for kind in ("pois", "restaurants"):
+        rows = conn.execute(text(f"SELECT city_id, name, tags FROM {kind} WHERE city_id IS NOT NULL")).mappings().all()
+        link_places(db, kind, [dict(r) for r in rows])
+    db.flush()
+
+def _widen_run_ids(conn):
+    # run ids are time-based (runs.new_run_ids) and outgrow a 32-bit INT; SQLite's is 64-bit already
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        return
+    cols = {c["name"]: c for c in inspect(conn).get_columns("plan_runs")}
+    if "BIGINT" in str(cols["id"]["type"]).upper():
+        return
+    if dialect == "mysql":
+        conn.execute(text("SET FOREIGN_KEY_CHECKS=0"))
+        conn.execute(text("ALTER TABLE plan_runs MODIFY id BIGINT NOT NULL AUTO_INCREMENT"))
+        conn.execute(text("ALTER TABLE plan_jobs MODIFY run_id BIGINT NULL"))
+        conn.execute(text("SET FOREIGN_KEY_CHECKS=1"))
+    else:
+        conn.execute(text("ALTER TABLE plan_runs ALTER COLUMN id TYPE BIGINT"))
+        conn.execute(text("ALTER TABLE plan_jobs ALTER COLUMN run_id TYPE BIGINT"))
+
+def _add_run_blob(conn):
+    if "result_blob" not in _columns(conn, "plan_runs"):
+        blob = {"mysql": "MEDIUMBLOB", "postgresql": "BYTEA"}.get(conn.dialect.name, "BLOB")
+        conn.execute(text(f"ALTER TABLE plan_runs ADD COLUMN result_blob {blob}"))
+    if "ix_plan_runs_created_at" not in _indexes(conn, "plan_runs"):
+        conn.execute(text("CREATE INDEX ix_plan_runs_created_at ON plan_runs (created_at)"))
+
+def _add_job_active_key(conn):
+    if "active_key" not in _columns(conn, "plan_jobs"):
+        conn.execute(text("ALTER TABLE plan_jobs ADD COLUMN active_key VARCHAR(64)"))
+    if "ix_plan_jobs_active_key" in _indexes(conn, "plan_jobs"):
+        return
+    # the oldest pending job per request holds the key; any duplicates still run, just undeduped
+    ids = conn.execute(text("SELECT MIN(id) FROM plan_jobs WHERE status IN ('queued', 'running') "
+                            "AND active_key IS NULL GROUP BY request_key")).scalars().all()
+    if ids:
+        conn.execute(text("UPDATE plan_jobs SET active_key = request_key WHERE id = :id"), [{"id": i} for i in ids])
+    conn.execute(text("CREATE UNIQUE INDEX ix_plan_jobs_active_key ON plan_jobs (active_key)"))
+
+UPGRADES = [_add_places_version, _add_geocell, _add_city_id, _unique_city_name, _add_plan_memo, _backfill_place_tags, _widen_run_ids,
+            _add_run_blob, _add_job_active_key]
+
+def ensure_schema(bind=engine):
+    Base.metadata.create_all(bind=bind)
+    with bind.begin() as conn:
+        for step in UPGRADES:
+            step(conn)
+
+if __name__ == "__main__":
+    ensure_schema()
+    print("✅ Schema up to date.")
@@ -0,0 +1,118 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+import asyncio
+import time
+
+@dataclass
+class MirrorStats:
+    url: str
+    order: int                       # position in settings, used to break ties
+    ewma_latency: float = 0.0        # seconds
+    ewma_error: float = 0.0          # 0..1
+    consecutive_failures: int = 0
+    open_until: float = 0.0          # circuit open (skipped) until this monotonic time
+    requests: int = 0
+    failures: int = 0
+    wins: int = 0
+
+    def score(self) -> float:
+        # lower is better; errors weigh heavily so a fast-but-flaky mirror loses to a slow-but-steady one
+        return self.ewma_latency * (1.0 + 4.0 * self.ewma_error) + 10.0 * self.ewma_error
+
+class MirrorPool:
+    """Health-scored mirror selection with hedged requests and a per-mirror circuit breaker.
+
+    `query(send)` calls `send(url)` on the healthiest mirror; if it hasn't answered after
+    `hedge_after_s` (or fails / returns nothing) the next mirror is raced against it, and the
+    first non-empty answer wins. Mirrors failing `breaker_failures` times in a row are skipped
+    for `breaker_cooldown_s`, then get one half-open probe."""
+
+    def __init__(self, endpoints: List[str], hedge_after_s: float = 3.0,
+                 breaker_failures: int = 3, breaker_cooldown_s: float = 60.0, alpha: float = 0.3):
+        self.hedge_after_s = hedge_after_s
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown_s = breaker_cooldown_s
+        self.alpha = alpha
+        self.stats: Dict[str, MirrorStats] = {u: MirrorStats(u, i) for i, u in enumerate(endpoints)}
+
+    def ranked(self) -> List[str]:
+        now = time.monotonic()
+        closed = [m for m in self.stats.values() if m.open_until <= now]
+        if not closed:
+            # everything is tripped: better to probe the one closest to recovery than to give up
+            return [min(self.stats.values(), key=lambda m: m.open_until).url] if self.stats else []
+        return [m.url for m in sorted(closed, key=lambda m: (m.score(), m.order))]
+
+    def _observe_latency(self, m: MirrorStats, latency: float):
+        m.requests += 1
+        m.ewma_latency = latency if m.requests == 1 else (1 - self.alpha) * m.ewma_latency + self.alpha * latency
+
+    def record(self, url: str, ok: bool, latency: float):
+        m = self.stats[url]
+        self._observe_latency(m, latency)
+        m.ewma_error = (1 - self.alpha) * m.ewma_error + self.alpha * (0.0 if ok else 1.0)
+        if ok:
+            m.consecutive_failures = 0
+            m.open_until = 0.0
+            return
+        m.failures += 1
+        m.consecutive_failures += 1
+        if m.consecutive_failures >= self.breaker_failures:
+            m.open_until = time.monotonic() + self.breaker_cooldown_s
+
+    async def _timed(self, send: Callable[[str], Awaitable[list]], url: str) -> Optional[list]:
+        t0 = time.monotonic()
+        try:
+            out = await send(url)
+        except asyncio.CancelledError:
+            # lost a hedge race: not an error, but it was at least this slow
+            self._observe_latency(self.stats[url], time.monotonic() - t0)
+            raise
+        except Exception:
+            self.record(url, False, time.monotonic() - t0)
+            return None
+        self.record(url, True, time.monotonic() - t0)
+        return out
+
+    async def query(self, send: Callable[[str], Awaitable[list]]) -> list:
+        candidates = self.ranked()
+        pending: Dict[asyncio.Task, str] = {}
+        nxt = 0
+
+        def launch():
+            nonlocal nxt
+            url = candidates[nxt]
+            nxt += 1
+            pending[asyncio.ensure_future(self._timed(send, url))] = url
+
+        if not candidates:
+            return []
+        launch()
+        try:
+            while pending:
+                hedge = self.hedge_after_s if nxt < len(candidates) else None
+                done, _ = await asyncio.wait(pending, timeout=hedge, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch()   # primary is slow: race the next-best mirror
+                    continue
+                for t in done:
+                    url = pending.pop(t)
+                    out = t.result()
+                    if out:
+                        self.stats[url].wins += 1
+                        return out
+                if nxt < len(candidates):
+                    launch()   # failed/empty: move on without waiting for the hedge timer
+            return []
+        finally:
+            for t in pending:
+                t.cancel()
+
+    def snapshot(self) -> List[dict]:
+        now = time.monotonic()
+        return [{
+            "url": m.url, "score": round(m.score(), 3), "ewma_latency_s": round(m.ewma_latency, 3),
+            "ewma_error": round(m.ewma_error, 3), "requests": m.requests, "failures": m.failures,
+            "wins": m.wins, "circuit_open": m.open_until > now,
+        } for m in sorted(self.stats.values(), key=lambda m: m.order)]
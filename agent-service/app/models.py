@@ -1,8 +1,10 @@
 from __future__ import annotations
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import String, Integer, Date, DateTime, Text, Float, ForeignKey, JSON, func
+from sqlalchemy import BigInteger, LargeBinary, String, Integer, Date, DateTime, Text, Float, ForeignKey, JSON, UniqueConstraint, func
 from datetime import date, datetime
 
+from .geo import geocell_default
+
 class Base(DeclarativeBase):
     pass
 
@@ -23,18 +25,52 @@ class Preference(Base):
     mobility: Mapped[str | None] = mapped_column(String(50), nullable=True)
     dietary: Mapped[str | None] = mapped_column(String(120), nullable=True)
 
+# 64-bit ids assigned by the app (runs.new_run_ids); on SQLite INTEGER already is, and stays the rowid
+RunId = BigInteger().with_variant(Integer, "sqlite")
+
+class RunIdNode(Base):
+    # node leases for runs.new_run_ids: one row per node a live process writes run ids under
+    __tablename__ = "run_id_nodes"
+    node: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    holder: Mapped[str] = mapped_column(String(120))
+    expires_at: Mapped[datetime] = mapped_column(DateTime)
+
 class PlanRun(Base):
     __tablename__ = "plan_runs"
-    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    id: Mapped[int] = mapped_column(RunId, primary_key=True, index=True)
     booking_id: Mapped[int] = mapped_column(ForeignKey("bookings.id"))
     preference_id: Mapped[int] = mapped_column(ForeignKey("preferences.id"))
     user_query: Mapped[str] = mapped_column(Text, default="")
     weather_summary: Mapped[str] = mapped_column(Text, default="")
-    result_json: Mapped[dict] = mapped_column(JSON)
-    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+    result_json: Mapped[dict] = mapped_column(JSON)              # {} once compacted into result_blob
+    result_blob: Mapped[bytes | None] = mapped_column(LargeBinary(2**24), nullable=True)   # runstore.encode()
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), index=True)
+    request_key: Mapped[str | None] = mapped_column(String(64), nullable=True, index=True)  # memo.plan_key()
+    expires_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)           # reusable until then
+
+class PlanCard(Base):
+    # content-addressed activity/restaurant cards shared by compacted runs
+    __tablename__ = "plan_cards"
+    key: Mapped[str] = mapped_column(String(32), primary_key=True)      # runstore.card_key()
+    card: Mapped[dict] = mapped_column(JSON)
+    last_seen: Mapped[datetime] = mapped_column(DateTime, index=True)   # newest run using it; purge GC
+
+class City(Base):
+    __tablename__ = "cities"
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    key: Mapped[str] = mapped_column(String(160), unique=True)          # cities.city_key(): "portland, or"
+    name: Mapped[str] = mapped_column(String(120), index=True)          # "portland"
+    region: Mapped[str | None] = mapped_column(String(60), nullable=True)
+    places_version: Mapped[int] = mapped_column(Integer, default=0, server_default="0")  # bumped on every place write
+
+class CityAlias(Base):
+    __tablename__ = "city_aliases"
+    alias: Mapped[str] = mapped_column(String(160), primary_key=True)   # any city_key() that means this city
+    city_id: Mapped[int] = mapped_column(ForeignKey("cities.id"), index=True)
 
 class POI(Base):
     __tablename__ = "pois"
+    __table_args__ = (UniqueConstraint("city_id", "name", name="uq_pois_city_name"),)
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     name: Mapped[str] = mapped_column(String(200))
     address: Mapped[str] = mapped_column(String(200))
@@ -46,9 +82,12 @@ class POI(Base):
     wheelchair_friendly: Mapped[int] = mapped_column(Integer, default=0)
     child_friendly: Mapped[int] = mapped_column(Integer, default=1)
     city: Mapped[str] = mapped_column(String(120))
+    city_id: Mapped[int | None] = mapped_column(ForeignKey("cities.id"), nullable=True, index=True)
+    geocell: Mapped[int | None] = mapped_column(Integer, nullable=True, index=True, default=geocell_default)
 
 class Restaurant(Base):
     __tablename__ = "restaurants"
+    __table_args__ = (UniqueConstraint("city_id", "name", name="uq_restaurants_city_name"),)
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     name: Mapped[str] = mapped_column(String(200))
     address: Mapped[str] = mapped_column(String(200))
@@ -57,3 +96,66 @@ class Restaurant(Base):
     tags: Mapped[str] = mapped_column(String(200))
     price_tier: Mapped[str] = mapped_column(String(10), default="$$")
     city: Mapped[str] = mapped_column(String(120))
+    city_id: Mapped[int | None] = mapped_column(ForeignKey("cities.id"), nullable=True, index=True)
+    geocell: Mapped[int | None] = mapped_column(Integer, nullable=True, index=True, default=geocell_default)
+
+class Tag(Base):
+    __tablename__ = "tags"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(String(100), unique=True)          # tagindex.split_tags(): lowercased
+
+# place <-> tag links; the primary key leads with tag_id so "places with tag X" is an index range
+class POITag(Base):
+    __tablename__ = "poi_tags"
+    tag_id: Mapped[int] = mapped_column(ForeignKey("tags.id"), primary_key=True)
+    poi_id: Mapped[int] = mapped_column(ForeignKey("pois.id"), primary_key=True, index=True)
+
+class RestaurantTag(Base):
+    __tablename__ = "restaurant_tags"
+    tag_id: Mapped[int] = mapped_column(ForeignKey("tags.id"), primary_key=True)
+    restaurant_id: Mapped[int] = mapped_column(ForeignKey("restaurants.id"), primary_key=True, index=True)
+
+class GeocodeCache(Base):
+    __tablename__ = "geocode_cache"
+    key: Mapped[str] = mapped_column(String(160), primary_key=True)   # utils.normalize_location()
+    lat: Mapped[float | None] = mapped_column(Float, nullable=True)
+    lon: Mapped[float | None] = mapped_column(Float, nullable=True)
+    ok: Mapped[int] = mapped_column(Integer, default=1)                 # 0 = negative (lookup failed)
+    fetched_at: Mapped[datetime] = mapped_column(DateTime)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, index=True)
+
+class ForecastDay(Base):
+    __tablename__ = "forecast_days"
+    grid_y: Mapped[int] = mapped_column(Integer, primary_key=True)      # round(lat / forecast_grid_deg)
+    grid_x: Mapped[int] = mapped_column(Integer, primary_key=True)      # round(lon / forecast_grid_deg)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    temperature_2m_max: Mapped[float | None] = mapped_column(Float, nullable=True)
+    temperature_2m_min: Mapped[float | None] = mapped_column(Float, nullable=True)
+    precipitation_probability_mean: Mapped[float | None] = mapped_column(Float, nullable=True)
+    fetched_at: Mapped[datetime] = mapped_column(DateTime)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, index=True)
+
+class AskParse(Base):
+    __tablename__ = "ask_parses"
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)      # sha256(model | prompt version | normalized ask)
+    ask: Mapped[str] = mapped_column(Text)
+    result_json: Mapped[dict] = mapped_column(JSON)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+
+class PlanJob(Base):
+    __tablename__ = "plan_jobs"
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    request_key: Mapped[str] = mapped_column(String(64), index=True)            # memo.plan_key()
+    # request_key while queued/running, NULL once done/failed: the unique index dedupes pending jobs
+    active_key: Mapped[str | None] = mapped_column(String(64), nullable=True, unique=True, index=True)
+    request_json: Mapped[dict] = mapped_column(JSON)
+    priority: Mapped[int] = mapped_column(Integer, default=0)                   # higher runs first
+    status: Mapped[str] = mapped_column(String(16), default="queued", index=True)  # queued|running|done|failed
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    available_at: Mapped[datetime] = mapped_column(DateTime, index=True)         # retry backoff
+    locked_by: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    locked_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)  # lease start; stale -> requeued
+    run_id: Mapped[int | None] = mapped_column(RunId, ForeignKey("plan_runs.id"), nullable=True)
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
@@ -0,0 +1,270 @@
+from __future__ import annotations
+from typing import Dict, List, Tuple
+import asyncio
+import hashlib
+import json
+import logging
+import re
+from langchain.schema import AIMessage, SystemMessage, HumanMessage
+
+from .cache import TTLCache
+from .config import settings
+from .db import AsyncSessionLocal, write_lock
+from .models import AskParse
+from .retrieval import POI_FILTERS
+from . import metrics, upstream
+
+LLM_MODEL = "gpt-4o-mini"
+PROMPT_VERSION = 1
+
+SYSTEM_PROMPT = """Extract structured trip preferences as JSON with keys:
+budget_tier one of ["$","$$","$$$"], interests array of strings,
+mobility nullable string (e.g., "wheelchair","no-long-hikes","stroller"),
+dietary nullable string (e.g., "vegan","halal","gluten-free"). Only return valid JSON."""
+
+logger = logging.getLogger(__name__)
+
+# ---------- Tier 1: local keyword extractor ----------
+
+BUDGET = {
+    "$": ["cheap", "budget", "inexpensive", "affordable", "low cost", "low-cost", "frugal"],
+    "$$": ["moderate", "mid range", "mid-range", "midrange", "reasonable", "mid-priced"],
+    "$$$": ["luxury", "luxurious", "upscale", "fancy", "splurge", "high end", "high-end", "fine dining"],
+}
+MOBILITY = {
+    "wheelchair": ["wheelchair", "wheelchair accessible", "accessible", "step free", "step-free"],
+    "no-long-hikes": ["no long hikes", "no hikes", "no hiking", "short walks", "limited walking",
+                      "cant walk far", "can't walk far", "no-long-hikes"],
+    "stroller": ["stroller", "pram", "buggy", "baby"],
+}
+DIETARY = {
+    "vegan": ["vegan", "plant based", "plant-based"],
+    "vegetarian": ["vegetarian", "veggie"],
+    "halal": ["halal"],
+    "kosher": ["kosher"],
+    "gluten-free": ["gluten free", "gluten-free", "celiac", "coeliac"],
+}
+# every tag Overpass can hand back for a POI, plus the seed catalog's descriptive tags
+INTERESTS: Dict[str, List[str]] = {
+    tag: [tag, tag.replace("_", " ")] for _, rx in POI_FILTERS for tag in rx.split("|")
+}
+INTERESTS.update({
+    "museum": ["museum", "museums"],
+    "gallery": ["gallery", "galleries"],
+    "park": ["park", "parks"],
+    "garden": ["garden", "gardens", "botanical"],
+    "viewpoint": ["viewpoint", "viewpoints", "views", "scenic", "lookout"],
+    "theatre": ["theatre", "theater", "theatres", "theaters", "shows", "broadway"],
+    "playground": ["playground", "playgrounds"],
+    "attraction": ["attraction", "attractions", "sightseeing", "landmarks", "sights"],
+    "library": ["library", "libraries", "books"],
+    "art": ["art", "arts"],
+    "history": ["history", "historic", "historical"],
+    "science": ["science"],
+    "beach": ["beach", "beaches"],
+    "zoo": ["zoo", "zoos", "animals"],
+    "market": ["market", "markets", "shopping"],
+    "kid-friendly": ["kid-friendly", "kid friendly", "kids", "children", "family-friendly", "family friendly"],
+})
+
+STOPWORDS = frozenset("""a an and or the i im i'm we we're us our my me to of for in on at with
+want wants would like love prefer please some any lots lot really very also plus just but
+into looking trip visit visiting stuff things thing place places spots food options only
+be is are it its that this so something more mostly mainly maybe""".split())
+NEGATIONS = frozenset({"no", "not", "nothing", "without", "avoid", "never", "dont", "don't", "hate"})
+
+def _phrase_table() -> List[Tuple[Tuple[str, ...], str, str]]:
+    rows = []
+    for field, vocab in (("budget_tier", BUDGET), ("mobility", MOBILITY),
+                         ("dietary", DIETARY), ("interests", INTERESTS)):
+        for value, phrases in vocab.items():
+            for p in phrases:
+                rows.append((tuple(_tokens(p)), field, value))
+    # longest phrase wins ('no long hikes' before 'hikes', 'wheelchair accessible' before 'accessible')
+    return sorted(rows, key=lambda r: -len(r[0]))
+
+def _tokens(text: str) -> List[str]:
+    return re.findall(r"\${1,3}(?!\w)|[a-z0-9][a-z0-9'\-]*", text.lower().replace("’", "'"))
+
+_PHRASES = None
+
+def _scan(ask: str) -> Tuple[Dict, float, bool]:
+    """(preferences, confidence, negated). Values named after a negation word ('no museums',
+    'I hate museums but like parks') and fields given conflicting values are left out, since
+    keywords can't tell what the negation covers."""
+    global _PHRASES
+    if _PHRASES is None:
+        _PHRASES = _phrase_table()
+    toks = _tokens(ask)
+    used = [False] * len(toks)
+    found: Dict[str, List[Tuple[str, int]]] = {}
+    for i in range(len(toks)):
+        if used[i]:
+            continue
+        if re.fullmatch(r"\${1,3}", toks[i]):
+            found.setdefault("budget_tier", []).append((toks[i], i))
+            used[i] = True
+            continue
+        for phrase, field, value in _PHRASES:
+            n = len(phrase)
+            if tuple(toks[i:i + n]) == phrase and not any(used[i:i + n]):
+                found.setdefault(field, []).append((value, i))
+                used[i:i + n] = [True] * n
+                break
+    # phrases like 'no long hikes' carry their own negation; only a stray one counts
+    neg_at = next((i for i, t in enumerate(toks) if t in NEGATIONS and not used[i]), None)
+    out: Dict = {}
+    ambiguous = False
+    for field, hits in found.items():
+        values = list(dict.fromkeys(v for v, i in hits if neg_at is None or i < neg_at))
+        if field == "interests":
+            if values:
+                out[field] = values
+        elif len(set(v for v, _ in hits)) > 1:
+            ambiguous = True
+        elif values:
+            out[field] = values[0]
+    content = [i for i, t in enumerate(toks) if t not in STOPWORDS]
+    negated = neg_at is not None
+    if not content or not out or ambiguous or negated:
+        return out, 0.0, negated
+    return out, sum(used[i] for i in content) / len(content), False
+
+def local_parse(ask: str) -> Tuple[Dict, float]:
+    """(preferences, confidence): confidence is the share of non-filler words accounted for,
+    0 when a negation or conflicting values make the keyword reading unsafe."""
+    out, confidence, _ = _scan(ask)
+    return out, confidence
+
+# ---------- Tier 3: LLM (one shared client; FakeLLM offline) ----------
+
+class FakeLLM:
+    """Offline stand-in with the ChatModel.ainvoke surface. Answers with `answers[ask]` when
+    given (tests pin what "the LLM" says), else with the local parse; counts calls and asks."""
+
+    def __init__(self, answers: Dict[str, Dict] | None = None):
+        self.answers = answers or {}
+        self.calls = 0
+        self.asks: List[str] = []
+
+    async def ainvoke(self, messages):
+        ask = messages[-1].content
+        self.calls += 1
+        self.asks.append(ask)
+        out = self.answers[ask] if ask in self.answers else local_parse(ask)[0]
+        return AIMessage(content=json.dumps(out))
+
+_llm = None
+_llm_http = None        # the pooled client the configured model was built on
+
+def get_llm():
+    global _llm, _llm_http
+    if _llm_http is not None and _llm_http.is_closed:
+        # upstream.aclose() ran (e.g. a lifespan restart): rebuild on a fresh pooled client
+        _llm = _llm_http = None
+    if _llm is None:
+        if settings.llm_fake:
+            _llm = FakeLLM()
+        elif settings.openai_api_key:
+            from langchain_openai import ChatOpenAI
+            _llm_http = upstream.client("llm")
+            _llm = ChatOpenAI(model=LLM_MODEL, temperature=0, openai_api_key=settings.openai_api_key,
+                              base_url=settings.openai_base_url, timeout=settings.llm_timeout_s, http_async_client=_llm_http)
+    return _llm
+
+def set_llm(llm):
+    """Swap the model (tests, benchmarks); None goes back to the configured one."""
+    global _llm, _llm_http
+    _llm, _llm_http = llm, None
+
+def _clean(raw: Dict) -> Dict:
+    # keep only well-formed fields so a sloppy completion can't break plan building
+    out: Dict = {}
+    if raw.get("budget_tier") in BUDGET:
+        out["budget_tier"] = raw["budget_tier"]
+    if isinstance(raw.get("interests"), list):
+        out["interests"] = [str(i).strip().lower() for i in raw["interests"] if str(i).strip()]
+    for field in ("mobility", "dietary"):
+        if isinstance(raw.get(field), str) and raw[field].strip():
+            out[field] = raw[field].strip().lower()
+    return out
+
+async def _llm_parse(ask: str) -> Dict | None:
+    llm = get_llm()
+    if llm is None:
+        return None
+    try:
+        with metrics.stage("llm"):
+            out = (await llm.ainvoke([SystemMessage(content=SYSTEM_PROMPT), HumanMessage(content=ask)])).content
+        return _clean(json.loads(out))
+    except Exception as e:
+        logger.warning("LLM parse failed: %s", e)
+        return None
+
+# ---------- Tier 2: persisted LLM parses ----------
+
+_parse_lru = TTLCache(4096, 7 * 86400)
+_parse_inflight: Dict[str, asyncio.Future] = {}
+metrics.track_cache("ask_parse", _parse_lru)
+
+def normalize_ask(ask: str) -> str:
+    return " ".join(_tokens(ask))
+
+def _ask_key(norm: str) -> str:
+    return hashlib.sha256(f"{LLM_MODEL}|{PROMPT_VERSION}|{norm}".encode()).hexdigest()
+
+async def _cached_llm_parse(ask: str, norm: str) -> Dict | None:
+    if get_llm() is None:
+        metrics.count("ask_parses_total", source="local_fallback")
+        return None
+    key = _ask_key(norm)
+    hit = _parse_lru.get(key)
+    if hit is not None:
+        metrics.count("ask_parses_total", source="memory")
+        return hit
+    try:
+        async with AsyncSessionLocal() as db:
+            row = await db.get(AskParse, key)
+    except Exception as e:
+        logger.warning("ask parse cache read failed: %s", e)
+        row = None
+    if row is not None:
+        metrics.count("ask_parses_total", source="db")
+        _parse_lru.set(key, row.result_json)
+        return row.result_json
+    result = await _llm_parse(ask)
+    metrics.count("ask_parses_total", source="llm" if result is not None else "local_fallback")
+    if result is None:
+        return None
+    _parse_lru.set(key, result)
+    try:
+        async with write_lock(), AsyncSessionLocal() as db:
+            await db.merge(AskParse(key=key, ask=norm, result_json=result))
+            await db.commit()
+    except Exception as e:
+        logger.warning("ask parse cache write failed: %s", e)
+    return result
+
+async def parse_free_text(ask: str) -> Dict:
+    """Local keywords when they explain the ask; otherwise a cached (or fresh) LLM parse,
+    with local findings filling whatever the LLM left out unless the ask has a negation.
+    Without an LLM, the local findings minus anything negated or conflicting."""
+    if not ask or not ask.strip():
+        return {}
+    local, confidence, negated = _scan(ask)
+    if confidence >= settings.parse_local_min_coverage:
+        metrics.count("ask_parses_total", source="local")
+        return local
+    norm = normalize_ask(ask)
+    fut = _parse_inflight.get(norm)
+    if fut is None:
+        fut = asyncio.ensure_future(_cached_llm_parse(ask, norm))
+        _parse_inflight[norm] = fut
+        fut.add_done_callback(lambda _: _parse_inflight.pop(norm, None))
+    llm = await asyncio.shield(fut)
+    if not llm:
+        return local
+    if negated:
+        # the LLM read the negation; keyword hits from the same ask could contradict it
+        return {k: v for k, v in llm.items() if v}
+    return {**local, **{k: v for k, v in llm.items() if v}}
@@ -0,0 +1,131 @@
+from __future__ import annotations
+from typing import Dict, FrozenSet, Iterable, List, Tuple
+from sqlalchemy import func, select, update
+
+from . import metrics
+from .cache import TTLCache
+from .candidates import CandidateColumns, select as select_candidates
+from .config import settings
+from .models import City, POI, Restaurant
+from .tagindex import tagged
+
+PRICE_TIERS = {"$", "$$", "$$$"}
+
+# (card, lowercased tag set). Cards are built once per city and shared across requests:
+# treat them as read-only and copy before changing anything. price_tier is None where
+# the row's own tier was invalid (the caller fills in the requested tier).
+Entry = Tuple[Dict, FrozenSet[str]]
+
+def _split_tags(tags: str | None) -> List[str]:
+    return [t.strip() for t in (tags or "").split(",") if t.strip()]
+
+def poi_entry(name, address, lat, lon, tags, price_tier, duration, wheelchair, child) -> Entry:
+    taglist = _split_tags(tags)
+    card = {
+        "title": name,
+        "address": address,
+        "geo": (lat, lon),
+        "price_tier": price_tier if price_tier in PRICE_TIERS else None,
+        "duration_minutes": duration,
+        "tags": taglist,
+        "wheelchair_friendly": bool(wheelchair),
+        "child_friendly": bool(child),
+    }
+    return card, frozenset(t.lower() for t in taglist)
+
+def restaurant_entry(name, address, lat, lon, tags, price_tier) -> Entry:
+    tagset = frozenset(t.lower() for t in _split_tags(tags))
+    card = {
+        "title": name, "address": address, "geo": (lat, lon),
+        "price_tier": price_tier if price_tier in PRICE_TIERS else None,
+        "tags": sorted(tagset) or ["restaurant"],
+    }
+    return card, tagset
+
+_KINDS = {
+    "pois": (POI, (POI.name, POI.address, POI.lat, POI.lon, POI.tags, POI.price_tier,
+                   POI.duration_minutes, POI.wheelchair_friendly, POI.child_friendly), poi_entry),
+    "restaurants": (Restaurant, (Restaurant.name, Restaurant.address, Restaurant.lat, Restaurant.lon,
+                                 Restaurant.tags, Restaurant.price_tier), restaurant_entry),
+}
+
+def entry_from_row(kind: str, row) -> Entry:
+    _, cols, make = _KINDS[kind]
+    return make(*(getattr(row, c.key) for c in cols))
+
+class CityPool:
+    """Every place of one kind in one city, prebuilt as cards plus a columnar copy
+    (candidates.CandidateColumns) so filtering and ranking a request are array ops."""
+
+    def __init__(self, version: int, entries: List[Entry]):
+        self.version = version
+        self.entries = entries
+        self.cols = CandidateColumns([c for c, _ in entries], [t for _, t in entries])
+
+    def select(self, lat: float | None = None, lon: float | None = None, **filters) -> List[Dict]:
+        """Shared cards (copy before changing them); see candidates.select() for the filters."""
+        return select_candidates(self.entries, self.cols, lat, lon, **filters)
+
+# keyed by version so a write anywhere turns the next lookup into a miss; _latest lets
+# invalidate() drop a superseded pool instead of waiting for it to age out
+_pools = TTLCache(settings.pool_cache_cities * 2, settings.pool_cache_ttl_s)   # (kind, city_id, version) -> CityPool
+_latest: Dict[Tuple[str, int], int] = {}
+_oversized = TTLCache(settings.pool_cache_cities * 2, settings.pool_cache_ttl_s)   # same keys, not worth pooling
+metrics.track_cache("city_pool", _pools)
+
+async def city_pool(db, kind: str, city_id: int) -> CityPool | None:
+    """The city's pool, or None when it has more than settings.pool_max_rows places (query_places)."""
+    # one PK lookup per request keeps every worker process honest about other processes' writes
+    version = (await db.execute(select(City.places_version).where(City.id == city_id))).scalar() or 0
+    pool = _pools.get((kind, city_id, version))
+    if pool is not None:
+        return pool
+    if (kind, city_id, version) in _oversized:
+        return None
+    model, cols, make = _KINDS[kind]
+    n = (await db.execute(select(func.count()).select_from(model).where(model.city_id == city_id))).scalar()
+    if n > settings.pool_max_rows:
+        _oversized.set((kind, city_id, version), True)
+        return None
+    rows = (await db.execute(select(*cols).where(model.city_id == city_id))).all()
+    pool = CityPool(version, [make(*r) for r in rows])
+    stale = _latest.get((kind, city_id))
+    if stale is not None and stale != version:
+        _pools.pop((kind, city_id, stale))
+    _latest[(kind, city_id)] = version
+    _pools.set((kind, city_id, version), pool)
+    return pool
+
+def sql_filters(kind: str, interests: Iterable[str] = (), mobility: str | None = None) -> list:
+    """WHERE clauses matching CandidateColumns.mask(), for reads that skip the pools."""
+    model = _KINDS[kind][0]
+    where = []
+    wants = [i for i in interests or [] if i and i.strip()]
+    if wants:
+        where.append(tagged(kind, wants))
+    if kind == "pois" and mobility == "wheelchair":
+        where.append(model.wheelchair_friendly == 1)
+    elif kind == "pois" and mobility == "no-long-hikes":
+        where.append(model.duration_minutes <= 120)
+    return where
+
+async def query_places(db, kind: str, city_id: int, interests: Iterable[str] = (), mobility: str | None = None) -> CityPool:
+    """Only the city's rows that pass the filters, as a throwaway pool."""
+    model, cols, make = _KINDS[kind]
+    rows = (await db.execute(select(*cols).where(model.city_id == city_id, *sql_filters(kind, interests, mobility)))).all()
+    return CityPool(-1, [make(*r) for r in rows])
+
+def bump_versions(city_ids: Iterable[int]):
+    """UPDATE for writers to run in the same transaction as their place inserts."""
+    ids = sorted({c for c in city_ids if c is not None})
+    return update(City).where(City.id.in_(ids)).values(places_version=City.places_version + 1)
+
+def invalidate(city_ids: Iterable[int]):
+    for cid in city_ids:
+        for kind in _KINDS:
+            version = _latest.pop((kind, cid), None)
+            if version is not None:
+                _pools.pop((kind, cid, version))
+
+def pool_cache_stats() -> dict:
+    return _pools.stats()
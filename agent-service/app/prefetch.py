@@ -0,0 +1,168 @@
+# Predictive cache warming. Every settings.prefetch_every_s the API scans bookings starting
+# soon and the cities planned most lately, and pulls their geocode, forecast, OSM places and
+# candidate pools into the caches before the first request for them arrives. Each pass spends
+# at most settings.prefetch_budget upstream calls.  One pass by hand:  python -m app.prefetch
+from __future__ import annotations
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Dict, List
+import asyncio
+import logging
+import time
+from sqlalchemy import func, select
+
+from .cache import TTLCache
+from .cities import find_city_id
+from .config import settings
+from .db import AsyncSessionLocal
+from .models import Booking, PlanRun
+from .utils import normalize_location, utcnow
+from .weather import daily_weather, geocode_city, geocode_cache_stats, forecast_cache_stats
+from . import pools, upstream
+
+logger = logging.getLogger(__name__)
+
+FORECAST_DAYS = 16          # Open-Meteo's forecast range; later trips are warmed nearer the date
+POPULAR_DAYS = 7            # forecast window warmed for popular cities with no booking
+TARGET_COST = 3             # least a cold target costs: geocode, forecast, Overpass (more with retries/hedges)
+
+@dataclass
+class Target:
+    location: str
+    start: date
+    end: date
+    reason: str             # "booking" | "popular"
+    demand: int             # bookings / recent runs behind it
+
+async def targets(db, today: date) -> List[Target]:
+    """Upcoming booking windows (soonest first), then popular cities not already covered."""
+    n = func.count().label("n")
+    upcoming = (await db.execute(
+        select(Booking.location, Booking.start_date, Booking.end_date, n)
+        .where(Booking.start_date >= today, Booking.start_date <= today + timedelta(days=settings.prefetch_horizon_days))
+        .group_by(Booking.location, Booking.start_date, Booking.end_date)
+        .order_by(Booking.start_date, n.desc())
+    )).all()
+    since = utcnow() - timedelta(days=settings.prefetch_popular_window_days)
+    popular = (await db.execute(
+        select(Booking.location, n).join(PlanRun, PlanRun.booking_id == Booking.id)
+        .where(PlanRun.created_at >= since)
+        .group_by(Booking.location).order_by(n.desc()).limit(settings.prefetch_popular_cities * 4)
+    )).all()
+
+    out: Dict[tuple, Target] = {}
+    for loc, start, end, count in upcoming:
+        key = (normalize_location(loc), start, end)
+        if key in out:
+            out[key].demand += count
+        else:
+            out[key] = Target(loc, start, end, "booking", count)
+    covered = {k[0] for k in out}
+    by_city: Dict[str, Target] = {}
+    for loc, count in popular:
+        key = normalize_location(loc)
+        if key in covered:
+            continue
+        if key in by_city:
+            by_city[key].demand += count
+        else:
+            by_city[key] = Target(loc, today, today + timedelta(days=POPULAR_DAYS - 1), "popular", count)
+    ranked = sorted(by_city.values(), key=lambda t: -t.demand)[: settings.prefetch_popular_cities]
+    return list(out.values()) + ranked
+
+async def warm(t: Target, today: date):
+    from .agent import sync_osm_places
+    coords = await geocode_city(t.location)
+    if coords is None:
+        return
+    last = today + timedelta(days=FORECAST_DAYS - 1)
+    if t.start <= last:
+        await daily_weather(*coords, max(t.start, today), min(t.end, last))
+    async with AsyncSessionLocal() as db:
+        city_id = await find_city_id(db, t.location)
+        pool = await pools.city_pool(db, "pois", city_id) if city_id is not None else None
+        if city_id is None or (pool is not None and not pool.entries):
+            # never planned here: fetch the neighbourhood now (which stores the city)
+            await sync_osm_places(t.location, *coords)
+            city_id = await find_city_id(db, t.location)
+        if city_id is None:
+            return
+        for kind in ("pois", "restaurants"):
+            await pools.city_pool(db, kind, city_id)
+
+# ---------- Warm-hit accounting ----------
+
+_warmed = TTLCache(8192, 3600.0)     # normalized location -> warmed in a recent pass
+_seen = {"requests": 0, "warm_hits": 0}
+_last_pass: Dict = {}
+
+def observe(location: str):
+    """Called once per plan: was its city warmed ahead of it?"""
+    _seen["requests"] += 1
+    if normalize_location(location) in _warmed:
+        _seen["warm_hits"] += 1
+
+def prefetch_stats() -> Dict:
+    req = _seen["requests"]
+    return {
+        "requests": req, "warm_hits": _seen["warm_hits"],
+        "warm_hit_ratio": round(_seen["warm_hits"] / req, 4) if req else 0.0,
+        "last_pass": dict(_last_pass),
+        "caches": {"geocode": geocode_cache_stats(), "forecast": forecast_cache_stats(), "pools": pools.pool_cache_stats()},
+        "upstream": upstream.upstream_stats(),
+    }
+
+async def prefetch_pass() -> Dict:
+    today = date.today()
+    t0 = time.monotonic()
+    async with AsyncSessionLocal() as db:
+        todo = await targets(db, today)
+    warmed = failed = 0
+    worst = TARGET_COST
+    with upstream.metered() as box:       # every real upstream call: retries, hedges, failovers
+        for t in todo:
+            # the next target may cost as much as the dearest one so far
+            if box[0] + worst > settings.prefetch_budget:
+                break
+            before = box[0]
+            try:
+                await warm(t, today)
+                warmed += 1
+                _warmed.set(normalize_location(t.location), True, ttl=max(settings.prefetch_every_s * 2, 3600.0))
+            except Exception as e:
+                failed += 1
+                logger.warning("prefetch of %s failed: %s", t.location, e)
+            worst = max(worst, box[0] - before)
+    spent = box[0]
+    _last_pass.clear()
+    _last_pass.update(at=utcnow().isoformat(timespec="seconds"), targets=len(todo), warmed=warmed, failed=failed,
+                      skipped=len(todo) - warmed - failed, upstream_calls=spent,
+                      seconds=round(time.monotonic() - t0, 2))
+    return dict(_last_pass)
+
+async def prefetch_loop(stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            out = await prefetch_pass()
+            if out["targets"]:
+                logger.info("prefetch: %s", out)
+        except Exception as e:
+            logger.warning("prefetch pass failed: %s", e)
+        try:
+            await asyncio.wait_for(stop.wait(), settings.prefetch_every_s)
+        except asyncio.TimeoutError:
+            pass
+
+def main():
+    from .migrate import ensure_schema
+    ensure_schema()
+
+    async def once():
+        try:
+            return await prefetch_pass()
+        finally:
+            await upstream.aclose()
+    print(f"✅ prefetch: {asyncio.run(once())}")
+
+if __name__ == "__main__":
+    main()
@@ -1,57 +1,122 @@
 from typing import List, Dict, Tuple
-import httpx
+import asyncio
+import hashlib
+import re
+import numpy as np
+from .cache import DiskCache
 from .config import settings
-from langchain_community.tools.tavily_search import TavilySearchResults
-
-HTTP_TIMEOUT = 15.0
+from .mirrors import MirrorPool
+from .utils import haversine_km
+from . import metrics, upstream
 
 # ---------- Optional: events via Tavily ----------
 
-def fetch_local_events(city: str, start_iso: str, end_iso: str) -> List[Dict]:
+async def fetch_local_events(city: str, start_iso: str, end_iso: str) -> List[Dict]:
     """Optional Tavily search for events. Returns [] if key missing or any error."""
     if not settings.tavily_api_key:
         return []
     try:
-        tool = TavilySearchResults(api_key=settings.tavily_api_key, max_results=5)
-        hits = tool.invoke({"query": f"events in {city} between {start_iso} and {end_iso}"}) or []
+        r = await upstream.post("tavily", settings.tavily_url, json={
+            "api_key": settings.tavily_api_key, "max_results": 5,
+            "query": f"events in {city} between {start_iso} and {end_iso}",
+        })
+        r.raise_for_status()
+        hits = r.json().get("results") or []
     except Exception:
         return []
     return [{"name": h.get("title", "Event"), "url": h.get("url", ""), "tags": ["event"]} for h in hits]
 
 
-# ---------- Places via OpenStreetMap (Overpass) with mirrors & widening ----------
-
-def _build_overpass_query(lat: float, lon: float, radius_m: int, filters: List[Tuple[str, str]]) -> str:
-    parts: List[str] = []
-    for key, regex in filters:
-        parts.append(f'node(around:{radius_m},{lat},{lon})[{key}~"{regex}"];')
-        parts.append(f'way(around:{radius_m},{lat},{lon})[{key}~"{regex}"];')
-        parts.append(f'relation(around:{radius_m},{lat},{lon})[{key}~"{regex}"];')
-    inner = "\n      ".join(parts)
-    ql = (
-        "[out:json][timeout:25];\n"
-        "(\n"
-        f"      {inner}\n"
-        ");\n"
-        "out center 200;"
-    )
+# ---------- Places via OpenStreetMap (Overpass) with mirrors ----------
+
+def _build_overpass_query(lat: float, lon: float, radii_m: List[int], filters: List[Tuple[str, str]], limit: int = 200) -> str:
+    """One request, one named result set per radius. Each set is output as its `out count`
+    element followed by up to `limit` elements (_split_sets takes them apart again)."""
+    sets: List[str] = []
+    outs: List[str] = []
+    for i, radius_m in enumerate(radii_m):
+        parts: List[str] = []
+        for key, regex in filters:
+            parts.append(f'node(around:{radius_m},{lat},{lon})[{key}~"{regex}"];')
+            parts.append(f'way(around:{radius_m},{lat},{lon})[{key}~"{regex}"];')
+            parts.append(f'relation(around:{radius_m},{lat},{lon})[{key}~"{regex}"];')
+        inner = "\n      ".join(parts)
+        sets.append(f"(\n      {inner}\n)->.r{i};")
+        outs.append(f".r{i} out count;\n.r{i} out center {limit};")
+    ql = "[out:json][timeout:25];\n" + "\n".join(sets) + "\n" + "\n".join(outs)
     return ql
 
-def _overpass_query_any(lat: float, lon: float, radius_km: float, filters: List[Tuple[str, str]]) -> List[Dict]:
-    """Try multiple mirrors; if all fail/empty, return []."""
-    radius_m = int(radius_km * 1000)
-    ql = _build_overpass_query(lat, lon, radius_m, filters)
-    for url in settings.overpass_endpoints:
-        try:
-            r = httpx.post(url, data={"data": ql}, timeout=HTTP_TIMEOUT)
-            r.raise_for_status()
-            data = r.json()
-            elements = data.get("elements", [])
-            if elements:
-                return elements
-        except Exception:
-            continue
-    return []
+def _split_sets(elements: List[Dict]) -> List[Tuple[int, List[Dict]]]:
+    """(elements in the set, elements sent) per result set, cut at the `out count` markers."""
+    out: List[Tuple[int, List[Dict]]] = []
+    for e in elements:
+        if e.get("type") == "count":
+            out.append((int((e.get("tags") or {}).get("total", 0)), []))
+        elif out:
+            out[-1][1].append(e)
+    return out or [(len(elements), elements)]
+
+_OVERPASS_CACHE_VERSION = "v1"
+
+overpass_cache = DiskCache(
+    settings.overpass_cache_dir,
+    max_bytes=settings.overpass_cache_max_mb * 1024 * 1024,
+    ttl=settings.overpass_cache_ttl_days * 86400,
+)
+metrics.track_cache("overpass_disk", overpass_cache)
+_overpass_inflight: Dict[str, asyncio.Future] = {}
+
+overpass_mirrors = MirrorPool(
+    settings.overpass_endpoints,
+    hedge_after_s=settings.overpass_hedge_after_s,
+    breaker_failures=settings.overpass_breaker_failures,
+    breaker_cooldown_s=settings.overpass_breaker_cooldown_s,
+)
+
+def _overpass_cache_key(ql: str) -> str:
+    # the mirror URL is deliberately not part of the key: every mirror serves the same data
+    norm = " ".join(ql.split())
+    return hashlib.sha256(f"{_OVERPASS_CACHE_VERSION}|out=json|{norm}".encode("utf-8")).hexdigest()
+
+async def _overpass_query_any(lat: float, lon: float, radii_km: List[float], filters: List[Tuple[str, str]], limit: int = 200) -> List[Dict]:
+    """Disk cache first; concurrent identical queries share one upstream call."""
+    ql = _build_overpass_query(lat, lon, [int(r * 1000) for r in radii_km], filters, limit)
+    key = _overpass_cache_key(ql)
+    cached = await asyncio.to_thread(overpass_cache.get, key)
+    if cached is not None:
+        return cached
+    fut = _overpass_inflight.get(key)
+    if fut is None:
+        fut = asyncio.ensure_future(_overpass_fetch(ql, key))
+        _overpass_inflight[key] = fut
+        fut.add_done_callback(lambda _: _overpass_inflight.pop(key, None))
+    return await asyncio.shield(fut)
+
+async def _overpass_fetch(ql: str, key: str) -> List[Dict]:
+    with metrics.stage("overpass"):
+        elements = await _overpass_post_any(ql)
+    if elements:   # empty may just mean every mirror failed; don't pin that
+        await asyncio.to_thread(overpass_cache.set, key, elements)
+    return elements
+
+async def _overpass_post_any(ql: str) -> List[Dict]:
+    """Healthiest mirror first, hedged onto the next; [] if every mirror fails/empty."""
+    answered: List[str] = []
+
+    async def send(url: str) -> List[Dict]:
+        r = await upstream.post("overpass", url, data={"data": ql})
+        r.raise_for_status()
+        elements = r.json().get("elements", [])
+        if elements:
+            answered.append(url)
+        return elements
+    ranked = overpass_mirrors.ranked()
+    elements = await overpass_mirrors.query(send)
+    mirror = answered[0] if elements and answered else None
+    metrics.count("overpass_answers_total", mirror=mirror or "none",
+                  fallback=str(bool(mirror) and mirror != ranked[0]).lower())
+    metrics.annotate("overpass", mirror or "none")
+    return elements
 
 # Broad but relevant categories
 POI_FILTERS = [
@@ -65,27 +130,52 @@ RESTO_FILTERS = [
     ("shop", "coffee|tea|confectionery"),
 ]
 
-def fetch_osm_pois(lat: float, lon: float, radius_km: float, max_radius_km: float) -> List[Dict]:
-    """Attractions/parks/museums etc. Widens radius up to max if empty."""
-    cur = radius_km
-    while cur <= max_radius_km:
-        elements = _overpass_query_any(lat, lon, cur, POI_FILTERS)
-        pois = _elements_to_pois(elements)
-        if pois:
-            return _dedup_by_title(pois)[: settings.max_pois]
-        cur += max(1.5, cur * 0.5)  # widen progressively
-    return []
-
-def fetch_osm_restaurants(lat: float, lon: float, radius_km: float, max_radius_km: float) -> List[Dict]:
-    """Restaurants & cafés; widens radius up to max if empty."""
-    cur = radius_km
-    while cur <= max_radius_km:
-        elements = _overpass_query_any(lat, lon, cur, RESTO_FILTERS)
-        restos = _elements_to_restos(elements)
-        if restos:
-            return _dedup_by_title(restos)[: settings.max_restaurants]
-        cur += max(1.5, cur * 0.5)
-    return []
+# Overpass returns elements in id order, not by distance, and has no distance sort: a set that
+# fills the limit is an arbitrary slice of its circle. So the one request carries two sets, the
+# full max radius and settings.radius_km around the centre. Unless a city is dense enough to
+# fill even the small circle, the nearest places are all there for local nearest-first ranking.
+COMBINED_LIMIT = 1500
+
+def _matches(tags: Dict, filters: List[Tuple[str, str]]) -> bool:
+    # unanchored, like Overpass's [key~"regex"]: 'coffee;tea' matches "coffee|tea"
+    return any(tags.get(k) and re.search(rx, tags[k]) for k, rx in filters)
+
+def _nearest_first(items: List[Dict], lat: float, lon: float) -> List[Dict]:
+    if not items:
+        return items
+    geo = np.array([it["geo"] for it in items], dtype=float)
+    order = np.argsort(haversine_km(lat, lon, geo[:, 0], geo[:, 1]), kind="stable")
+    return [items[i] for i in order]
+
+async def fetch_osm_places(lat: float, lon: float, max_radius_km: float) -> Tuple[List[Dict], List[Dict]]:
+    """One Overpass round-trip for POIs + restaurants (near and max radius sets, merged),
+    split and ranked nearest-first locally."""
+    radii = sorted({settings.radius_km, max_radius_km})
+    elements: List[Dict] = []
+    seen = set()
+    for radius, (total, els) in zip(radii, _split_sets(
+            await _overpass_query_any(lat, lon, radii, POI_FILTERS + RESTO_FILTERS, COMBINED_LIMIT))):
+        if total > len(els):
+            metrics.count("overpass_truncated_total", radius_km=f"{radius:g}")
+        for e in els:
+            if (e.get("type"), e.get("id")) not in seen:
+                seen.add((e.get("type"), e.get("id")))
+                elements.append(e)
+    poi_els = [e for e in elements if _matches(e.get("tags") or {}, POI_FILTERS)]
+    resto_els = [e for e in elements if _matches(e.get("tags") or {}, RESTO_FILTERS)]
+    pois = _dedup_by_title(_nearest_first(_elements_to_pois(poi_els), lat, lon))
+    restos = _dedup_by_title(_nearest_first(_elements_to_restos(resto_els), lat, lon))
+    return pois[: settings.max_pois], restos[: settings.max_restaurants]
+
+# Both wrappers issue the identical combined query, so when pick_activities and
+# pick_restaurants miss the DB together they share a single upstream call.
+async def fetch_osm_pois(lat: float, lon: float, max_radius_km: float) -> List[Dict]:
+    """Attractions/parks/museums etc., nearest first."""
+    return (await fetch_osm_places(lat, lon, max_radius_km))[0]
+
+async def fetch_osm_restaurants(lat: float, lon: float, max_radius_km: float) -> List[Dict]:
+    """Restaurants & cafés, nearest first."""
+    return (await fetch_osm_places(lat, lon, max_radius_km))[1]
 
 def _elements_to_pois(elements: List[Dict]) -> List[Dict]:
     out = []
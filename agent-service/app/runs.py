@@ -0,0 +1,265 @@
+# Plan runs are logged write-behind: the request gets its run id at once and a background
+# writer stores booking/preference/run rows in batched transactions, so response latency
+# doesn't wait on (or queue behind) database writes.
+from __future__ import annotations
+from datetime import timedelta
+from typing import List, Sequence, Tuple
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+from .config import settings
+from .db import AsyncSessionLocal, SessionLocal, write_lock
+from .models import Booking, Preference, PlanRun, RunIdNode
+from .schemas import AgentRequest, PlanResponse
+from .utils import utcnow
+from . import memo, metrics
+
+logger = logging.getLogger(__name__)
+
+Item = Tuple[AgentRequest, str, PlanResponse]
+
+# ---------- Run ids ----------
+
+# ms since 2025-01-01 (40 bits, ~35 years) | node (6 bits) | sequence (7 bits): time-ordered,
+# unique across processes with distinct nodes, and within 2^53 so JSON clients read it exactly.
+# Each process writing runs (API processes, job workers) leases its node from run_id_nodes and
+# renews it while running, so no two live processes share one.
+EPOCH_MS = 1735689600000
+NODE_BITS, SEQ_BITS = 6, 7
+_holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+_node: int | None = None
+_lease_until = 0.0            # monotonic; renewed well before the row's expires_at
+_id_lock = threading.Lock()    # minting; only ever held briefly, since new_run_ids runs on the event loop
+_lease_lock = threading.Lock()  # one lease round-trip at a time, taken without _id_lock held
+_last_ms, _seq = 0, 0
+
+def _lease_node(current: int | None) -> int:
+    now = utcnow()
+    until = now + timedelta(seconds=settings.run_id_node_lease_s)
+    with SessionLocal() as db:
+        if current is not None:
+            res = db.execute(update(RunIdNode).where(RunIdNode.node == current, RunIdNode.holder == _holder)
+                             .values(expires_at=until))
+            db.commit()
+            if res.rowcount == 1:
+                return current
+            logger.warning("run id node %d lease was lost; leasing another", current)
+        taken = dict(db.execute(select(RunIdNode.node, RunIdNode.expires_at)).all())
+        for node in range(1 << NODE_BITS):
+            if node not in taken:
+                db.add(RunIdNode(node=node, holder=_holder, expires_at=until))
+                try:
+                    db.commit()
+                    return node
+                except IntegrityError:         # another process took it first
+                    db.rollback()
+            elif taken[node] < now:
+                res = db.execute(update(RunIdNode).where(RunIdNode.node == node, RunIdNode.expires_at < now)
+                                 .values(holder=_holder, expires_at=until))
+                db.commit()
+                if res.rowcount == 1:
+                    return node
+    raise RuntimeError(f"all {1 << NODE_BITS} run id nodes are leased; too many processes write plan runs")
+
+def lease_node() -> int:
+    """Lease (or renew) this process's node. Blocking (up to the SQLite busy timeout): call it
+    off the event loop. Minting carries on under the current lease meanwhile."""
+    global _node, _lease_until
+    with _lease_lock:
+        node = _lease_node(_node)
+        with _id_lock:
+            _node = node
+            _lease_until = time.monotonic() + settings.run_id_node_lease_s * 0.8
+        return node
+
+def release_node():
+    global _node
+    with _lease_lock:
+        with _id_lock:
+            node, _node = _node, None
+        if node is None:
+            return
+        try:
+            with SessionLocal() as db:
+                db.execute(delete(RunIdNode).where(RunIdNode.node == node, RunIdNode.holder == _holder))
+                db.commit()
+        except Exception as e:
+            logger.warning("run id node release failed: %s", e)
+
+async def node_lease_loop(stop: asyncio.Event):
+    """Renew the node lease a few times per lease period until `stop` is set."""
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), settings.run_id_node_lease_s / 4)
+        except asyncio.TimeoutError:
+            pass
+        if stop.is_set():
+            break
+        try:
+            await asyncio.to_thread(lease_node)
+        except Exception as e:
+            logger.warning("run id node renewal failed: %s", e)
+
+def _leased() -> bool:
+    return _node is not None and time.monotonic() <= _lease_until
+
+async def new_run_ids(n: int = 1) -> List[int]:
+    if not _leased():
+        # first use, or renewals kept failing: never mint under a lease another process may hold
+        await asyncio.to_thread(lease_node)
+    return _mint(n)
+
+def _mint(n: int) -> List[int]:
+    global _last_ms, _seq
+    out = []
+    with _id_lock:
+        if not _leased():
+            raise RuntimeError("run id node lease expired")
+        while len(out) < n:
+            ms = max(int(time.time() * 1000) - EPOCH_MS, _last_ms)   # never step back with the clock
+            if ms == _last_ms:
+                _seq += 1
+                if _seq >> SEQ_BITS:                                 # this ms is used up
+                    time.sleep(0.0005)
+                    continue
+            else:
+                _last_ms, _seq = ms, 0
+            out.append((ms << (NODE_BITS + SEQ_BITS)) | (_node << SEQ_BITS) | _seq)
+    return out
+
+# ---------- Storage ----------
+
+def _run_rows(items: Sequence[Item], run_ids: Sequence[int]):
+    expires_at = memo.expiry()
+    out = []
+    for (req, key, result), run_id in zip(items, run_ids):
+        booking = Booking(start_date=req.booking.start_date, end_date=req.booking.end_date,
+                          location=req.booking.location, party_type=req.booking.party_type)
+        pref = Preference(budget_tier=req.preferences.budget_tier, interests=",".join(req.preferences.interests),
+                          mobility=req.preferences.mobility or None, dietary=req.preferences.dietary or None)
+        run = PlanRun(id=run_id, user_query=req.ask or "", weather_summary=result.weather_summary,
+                      result_json=result.model_dump(), request_key=key, expires_at=expires_at)
+        out.append((booking, pref, run))
+    return out
+
+async def persist_runs(db, items: List[Item], run_ids: Sequence[int] | None = None) -> List[int]:
+    """Store (request, plan key, result) triples now; one batched INSERT per table. Returns run ids."""
+    run_ids = list(run_ids) if run_ids is not None else await new_run_ids(len(items))
+    rows = _run_rows(items, run_ids)
+    db.add_all([b for b, _, _ in rows] + [p for _, p, _ in rows])
+    await db.flush()
+    for booking, pref, run in rows:
+        run.booking_id, run.preference_id = booking.id, pref.id
+    db.add_all([run for _, _, run in rows])
+    await db.commit()
+    return run_ids
+
+class RunWriter:
+    """Bounded queue of runs waiting to be stored, drained by one task in batches. Queued runs
+    are visible to the plan memo right away (memo.hold); a full queue makes callers wait."""
+
+    def __init__(self):
+        self.queue: asyncio.Queue | None = None
+        self.task: asyncio.Task | None = None
+        self.written = self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def start(self):
+        self.queue = asyncio.Queue(maxsize=settings.run_queue_max)
+        self.task = asyncio.ensure_future(self._loop())
+
+    async def submit(self, items: List[Item]) -> List[int]:
+        """Run ids for `items`, which are stored shortly after (immediately if the writer is off)."""
+        run_ids = await new_run_ids(len(items))
+        if not self.running:
+            async with AsyncSessionLocal() as db:
+                return await persist_runs(db, items, run_ids)
+        for item, run_id in zip(items, run_ids):
+            req, key, result = item
+            run = PlanRun(id=run_id, request_key=key, expires_at=memo.expiry())
+            run.result = result.model_dump()
+            memo.hold(key, run)
+            await self.queue.put((item, run_id))
+        return run_ids
+
+    async def _loop(self):
+        while True:
+            batch = [await self.queue.get()]
+            deadline = time.monotonic() + settings.run_flush_interval_s
+            while len(batch) < settings.run_flush_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush(batch)
+            for _ in batch:
+                self.queue.task_done()
+
+    async def _flush(self, batch):
+        items, run_ids = [i for i, _ in batch], [r for _, r in batch]
+        t0 = time.perf_counter()
+        for attempt in range(3):
+            try:
+                async with write_lock(), AsyncSessionLocal() as db:
+                    await persist_runs(db, items, run_ids)
+                self.written += len(batch)
+                metrics.count("run_writes_total", len(batch), result="written")
+                break
+            except IntegrityError as e:
+                # retrying the same rows can't help; store the batch run by run so only the offenders are lost
+                logger.warning("run write of %d hit a constraint, writing one by one: %s", len(batch), e)
+                await self._flush_each(items, run_ids)
+                break
+            except Exception as e:
+                logger.warning("run write of %d failed (attempt %d): %s", len(batch), attempt + 1, e)
+                metrics.count("run_writes_total", len(batch), result="retried")
+                await asyncio.sleep(0.2 * 2 ** attempt)
+        else:
+            self.failed += len(batch)
+            metrics.count("run_writes_total", len(batch), result="dropped")
+            logger.error("dropped %d plan runs after repeated write failures", len(batch))
+        metrics.observe("run_flush_seconds", time.perf_counter() - t0)
+        memo.release((key, run_id) for (_, key, _), run_id in zip(items, run_ids))
+
+    async def _flush_each(self, items, run_ids):
+        for item, run_id in zip(items, run_ids):
+            try:
+                async with write_lock(), AsyncSessionLocal() as db:
+                    await persist_runs(db, [item], [run_id])
+                self.written += 1
+                metrics.count("run_writes_total", result="written")
+            except Exception as e:
+                self.failed += 1
+                metrics.count("run_writes_total", result="dropped")
+                logger.error("dropped plan run %d: %s", run_id, e)
+
+    async def aclose(self):
+        """Store everything still queued, then stop."""
+        if not self.running:
+            return
+        await self.queue.join()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    def stats(self) -> dict:
+        return {"queued": self.queue.qsize() if self.running else 0, "written": self.written, "failed": self.failed}
+
+writer = RunWriter()
+metrics.gauge("run_queue_depth", lambda: writer.queue.qsize() if writer.running else 0)
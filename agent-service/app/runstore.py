@@ -0,0 +1,173 @@
+# Compact plan run storage. Fresh runs keep their PlanResponse in result_json; once older than
+# run_compact_after_days the retention job rewrites them as a zlib-compressed skeleton whose
+# cards are references into plan_cards (content-addressed, so a restaurant that shows up in a
+# thousand runs is stored once). hydrate() puts the full PlanResponse dict back on run.result.
+#
+#   python -m app.runstore [--compact-after-days N] [--purge-after-days N]
+from __future__ import annotations
+from datetime import timedelta
+from typing import Dict, Iterable, List, Tuple
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import zlib
+from sqlalchemy import bindparam, delete, select, update
+
+from .bulk import upsert_batches, dialect_of
+from .config import settings
+from .models import Booking, PlanCard, PlanJob, PlanRun, Preference
+from .utils import utcnow
+
+logger = logging.getLogger(__name__)
+
+FORMAT = 1
+BLOCKS = ("morning", "afternoon", "evening")
+
+# ---------- Encoding ----------
+
+def card_key(card: Dict) -> str:
+    blob = json.dumps(card, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(blob.encode(), digest_size=16).hexdigest()
+
+def encode(result: Dict) -> Tuple[bytes, Dict[str, Dict]]:
+    """(blob, {card key: card}): every card in the itinerary and restaurant list becomes its key."""
+    cards: Dict[str, Dict] = {}
+
+    def ref(card: Dict) -> str:
+        k = card_key(card)
+        cards.setdefault(k, card)
+        return k
+
+    skeleton = {
+        **{k: v for k, v in result.items() if k not in ("itinerary", "restaurants")},
+        "v": FORMAT,
+        "restaurants": [ref(r) for r in result.get("restaurants") or []],
+        "itinerary": [{"date": d["date"], "blocks": {b: [ref(c) for c in d["blocks"].get(b) or []] for b in BLOCKS}}
+                      for d in result.get("itinerary") or []],
+    }
+    blob = zlib.compress(json.dumps(skeleton, separators=(",", ":"), default=str).encode(), 9)
+    return blob, cards
+
+def card_keys(blob: bytes) -> List[str]:
+    skeleton = json.loads(zlib.decompress(blob))
+    return skeleton["restaurants"] + [k for d in skeleton["itinerary"] for b in BLOCKS for k in d["blocks"][b]]
+
+def decode(blob: bytes, cards: Dict[str, Dict]) -> Dict:
+    skeleton = json.loads(zlib.decompress(blob))
+    skeleton.pop("v", None)
+    skeleton["restaurants"] = [cards[k] for k in skeleton["restaurants"]]
+    for d in skeleton["itinerary"]:
+        d["blocks"] = {b: [cards[k] for k in d["blocks"][b]] for b in BLOCKS}
+    return skeleton
+
+async def hydrate(db, runs: Iterable[PlanRun]) -> None:
+    """Set run.result (the PlanResponse dict) on each run; compact ones share one card query."""
+    runs = [r for r in runs if r is not None]
+    compact = [r for r in runs if r.result_blob is not None]
+    cards: Dict[str, Dict] = {}
+    keys = sorted({k for r in compact for k in card_keys(r.result_blob)})
+    for i in range(0, len(keys), 500):
+        rows = await db.execute(select(PlanCard.key, PlanCard.card).where(PlanCard.key.in_(keys[i : i + 500])))
+        cards.update(rows.tuples().all())
+    for r in runs:
+        r.result = decode(r.result_blob, cards) if r.result_blob is not None else r.result_json
+
+# ---------- Retention ----------
+
+async def compact(db, older_than_days: float, batch: int = 200) -> Dict[str, int]:
+    """Rewrite full-JSON runs created before the cutoff in the compact format, oldest first."""
+    cutoff = utcnow() - timedelta(days=older_than_days)
+    stats = {"runs": 0, "bytes_before": 0, "bytes_after": 0, "cards": 0}
+    dialect = dialect_of(db)
+    while True:
+        runs = (await db.execute(
+            select(PlanRun.id, PlanRun.result_json, PlanRun.created_at)
+            .where(PlanRun.result_blob.is_(None), PlanRun.created_at < cutoff)
+            .order_by(PlanRun.id).limit(batch)
+        )).all()
+        if not runs:
+            return stats
+        updates, cards = [], {}
+        for run_id, result, created_at in runs:
+            blob, run_cards = encode(result)
+            for k, card in run_cards.items():
+                seen = cards.get(k)
+                cards[k] = {"key": k, "card": card, "last_seen": max(created_at, seen["last_seen"]) if seen else created_at}
+            updates.append({"b_id": run_id, "b_blob": blob})
+            stats["bytes_before"] += len(json.dumps(result, separators=(",", ":"), default=str))
+            stats["bytes_after"] += len(blob)
+        # runs go oldest first, so a batch's last_seen never moves a card's backwards
+        for stmt, chunk in upsert_batches(PlanCard, list(cards.values()), dialect, key=("key",), update=True):
+            await db.execute(stmt, chunk)
+        await db.execute(
+            update(PlanRun.__table__).where(PlanRun.__table__.c.id == bindparam("b_id"))
+            .values(result_blob=bindparam("b_blob"), result_json={}), updates)
+        await db.commit()
+        stats["runs"] += len(runs)
+        stats["cards"] += len(cards)
+
+async def purge(db, older_than_days: float) -> Dict[str, int]:
+    """Delete runs (with their booking/preference rows and finished jobs) created before the
+    cutoff, then every card no remaining run can reference."""
+    cutoff = utcnow() - timedelta(days=older_than_days)
+    old = (await db.execute(
+        select(PlanRun.id, PlanRun.booking_id, PlanRun.preference_id).where(PlanRun.created_at < cutoff)
+    )).all()
+    for i in range(0, len(old), 500):
+        chunk = old[i : i + 500]
+        ids = [r.id for r in chunk]
+        await db.execute(delete(PlanJob).where(PlanJob.run_id.in_(ids)))
+        await db.execute(delete(PlanRun).where(PlanRun.id.in_(ids)))
+        await db.execute(delete(Booking).where(Booking.id.in_([r.booking_id for r in chunk])))
+        await db.execute(delete(Preference).where(Preference.id.in_([r.preference_id for r in chunk])))
+    # a card's last_seen is its newest run, so older cards belong only to purged runs
+    cards = await db.execute(delete(PlanCard).where(PlanCard.last_seen < cutoff))
+    await db.commit()
+    return {"runs": len(old), "cards": cards.rowcount}
+
+async def retention_pass() -> Dict[str, Dict[str, int]]:
+    from .db import AsyncSessionLocal
+    out = {}
+    async with AsyncSessionLocal() as db:
+        if settings.run_purge_after_days > 0:
+            out["purged"] = await purge(db, settings.run_purge_after_days)
+        if settings.run_compact_after_days >= 0:
+            out["compacted"] = await compact(db, settings.run_compact_after_days)
+    return out
+
+async def retention_loop(stop: asyncio.Event):
+    """Run retention_pass() every run_retention_every_s until `stop` is set."""
+    while not stop.is_set():
+        try:
+            out = await retention_pass()
+            if any(v.get("runs") for v in out.values()):
+                logger.info("plan run retention: %s", out)
+        except Exception as e:
+            logger.warning("plan run retention failed: %s", e)
+        try:
+            await asyncio.wait_for(stop.wait(), settings.run_retention_every_s)
+        except asyncio.TimeoutError:
+            pass
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Compact (and optionally purge) old plan runs.")
+    ap.add_argument("--compact-after-days", type=float, default=settings.run_compact_after_days)
+    ap.add_argument("--purge-after-days", type=float, default=settings.run_purge_after_days, help="0 keeps runs forever")
+    args = ap.parse_args(argv)
+    settings.run_compact_after_days, settings.run_purge_after_days = args.compact_after_days, args.purge_after_days
+    from .migrate import ensure_schema
+    ensure_schema()
+    out = asyncio.run(retention_pass())
+    c = out.get("compacted", {})
+    if c.get("runs"):
+        print(f"✅ compacted {c['runs']} runs: {c['bytes_before']:,} -> {c['bytes_after']:,} bytes "
+              f"(+ {c['cards']} card upserts)")
+    if "purged" in out:
+        print(f"✅ purged {out['purged']['runs']} runs, {out['purged']['cards']} cards")
+    if not c.get("runs") and "purged" not in out:
+        print("✅ nothing to do")
+
+if __name__ == "__main__":
+    main()
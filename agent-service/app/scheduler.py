@@ -0,0 +1,180 @@
+from __future__ import annotations
+from datetime import date
+from typing import Dict, List, Sequence
+import math
+import random
+import numpy as np
+
+
+# minutes of sightseeing each block can hold; lunch opens the afternoon, dinner the evening
+MORNING_MIN = 180
+AFTERNOON_MIN = 240
+MEAL_MIN = 75
+DAY_ACTIVITY_MIN = MORNING_MIN + AFTERNOON_MIN - MEAL_MIN
+LLOYD_ROUNDS = 4
+
+def meal_card(r: Dict) -> Dict:
+    """A restaurant card in ActivityCard shape, for a meal slot."""
+    return {
+        "title": r.get("title", "Restaurant"),
+        "address": r.get("address", ""),
+        "geo": r.get("geo", (0.0, 0.0)),
+        "price_tier": r.get("price_tier", "$$"),
+        "duration_minutes": MEAL_MIN,
+        "tags": r.get("tags", ["restaurant"]),
+        "wheelchair_friendly": True,
+        "child_friendly": True,
+    }
+
+def _plane(geo: np.ndarray, origin: np.ndarray) -> np.ndarray:
+    # local equirectangular projection (km); plenty for distances inside one metro area
+    out = np.empty_like(geo)
+    out[:, 0] = (geo[:, 0] - origin[0]) * 110.57
+    out[:, 1] = (geo[:, 1] - origin[1]) * 111.32 * np.cos(np.radians(origin[0]))
+    return out
+
+def _sqdist(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # |a|^2 + |b|^2 - 2ab: one matmul instead of an (n, m, 2) temporary
+    d = (a * a).sum(axis=1)[:, None] + (b * b).sum(axis=1)[None, :] - 2.0 * (a @ b.T)
+    return np.maximum(d, 0.0, out=d)
+
+def _clusters(xy: np.ndarray, k: int, rng: random.Random) -> np.ndarray:
+    """k centers: farthest-point seeding from a random start, then a few Lloyd rounds."""
+    seeds = [rng.randrange(len(xy))]
+    nearest = ((xy - xy[seeds[0]]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        seeds.append(int(nearest.argmax()))
+        nearest = np.minimum(nearest, ((xy - xy[seeds[-1]]) ** 2).sum(axis=1))
+    centers = xy[seeds].copy()
+    for _ in range(LLOYD_ROUNDS):
+        label = _sqdist(xy, centers).argmin(axis=1)
+        counts = np.bincount(label, minlength=k)
+        filled = counts > 0
+        for axis in (0, 1):
+            sums = np.bincount(label, weights=xy[:, axis], minlength=k)
+            centers[filled, axis] = sums[filled] / counts[filled]
+    return centers
+
+def _route(xy: np.ndarray) -> List[int]:
+    """Open path through every point: nearest-neighbour from the outermost stop, then 2-opt."""
+    n = len(xy)
+    if n < 3:
+        return list(range(n))
+    # a day has a handful of stops: plain Python beats NumPy's per-call overhead here
+    pts = xy.tolist()
+    d = [[math.dist(p, q) for q in pts] for p in pts]
+    cx, cy = sum(p[0] for p in pts) / n, sum(p[1] for p in pts) / n
+    order = [max(range(n), key=lambda i: (pts[i][0] - cx) ** 2 + (pts[i][1] - cy) ** 2)]
+    free = set(range(n)) - set(order)
+    while free:
+        row = d[order[-1]]
+        nxt = min(free, key=row.__getitem__)
+        order.append(nxt)
+        free.discard(nxt)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(n - 2):
+            for j in range(i + 2, n):
+                a, b, c = order[i], order[i + 1], order[j]
+                if j + 1 < n:
+                    e = order[j + 1]
+                    gain = d[a][b] + d[c][e] - d[a][c] - d[b][e]
+                else:
+                    gain = d[a][b] - d[a][c]
+                if gain > 1e-9:
+                    order[i + 1 : j + 1] = order[i + 1 : j + 1][::-1]
+                    improved = True
+    return order
+
+def _pick_stops(xy: np.ndarray, dur: np.ndarray, n_days: int, rng: random.Random) -> List[List[int]]:
+    """Activity indices per day: each day fills its time budget from its own cluster, nearest
+    to the centre first, then borrows the nearest unused sights; repeats only once all are used."""
+    k = min(n_days, len(xy))
+    centers = _clusters(xy, k, rng)
+    to_center = _sqdist(xy, centers)                       # (n, k)
+    label = to_center.argmin(axis=1)
+    own = to_center[np.arange(len(xy)), label]
+    order = np.lexsort((own, label))                       # grouped by cluster, nearest first
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(label, minlength=k))))
+    members = [order[bounds[c]:bounds[c + 1]].tolist() for c in range(k)]
+    cursor = [0] * k
+    taken = np.zeros(len(xy), dtype=bool)
+    durations = dur.tolist()
+    picks: List[List[int]] = []
+    for di in range(n_days):
+        c = di % k
+        day, booked = [], 0.0
+        while booked < DAY_ACTIVITY_MIN:
+            lst = members[c]
+            while cursor[c] < len(lst) and taken[lst[cursor[c]]]:
+                cursor[c] += 1
+            if cursor[c] < len(lst):
+                i = lst[cursor[c]]
+            else:
+                if taken.all():
+                    taken[:] = False
+                    taken[day] = True
+                blocked = np.where(taken, np.inf, to_center[:, c])
+                i = int(blocked.argmin())
+                if blocked[i] == np.inf:
+                    break
+            taken[i] = True
+            day.append(i)
+            booked += durations[i]
+        picks.append(day)
+    return picks
+
+def _meal_plan(anchors: List, restaurants: List[Dict], preferred: Sequence[bool], origin: np.ndarray) -> List[Dict]:
+    """One restaurant per anchor point, in order: the nearest unused dietary match, else the
+    nearest unused one; restaurants repeat only once every one has been used."""
+    geo = np.array([r["geo"] for r in restaurants], dtype=float)
+    d = _sqdist(_plane(np.array(anchors, dtype=float), origin), _plane(geo, origin))
+    penalty = np.where(np.asarray(preferred, dtype=bool), 0.0, 1e6) if len(preferred) else np.zeros(len(geo))
+    used = np.zeros(len(geo), dtype=bool)
+    out = []
+    for row in d:
+        if used.all():
+            used[:] = False
+        i = int((row + penalty + np.where(used, 1e12, 0.0)).argmin())
+        used[i] = True
+        out.append(meal_card(restaurants[i]))
+    return out
+
+def schedule(days: List[date], activities: List[Dict], restaurants: List[Dict], events: List[Dict],
+             rng: random.Random, preferred_restaurants: Sequence[bool] = ()) -> List[Dict]:
+    """Day plans (DayPlan dicts) for `days`: each day's sights come from one geographic cluster,
+    routed nearest-neighbour + 2-opt and split across morning/afternoon by duration; lunch and
+    dinner go to the nearest suitable restaurant, events (one a day while they last) to evenings."""
+    itinerary = [{"date": d.isoformat(), "blocks": {"morning": [], "afternoon": [], "evening": []}} for d in days]
+    if not days or not (activities or restaurants):
+        return itinerary
+    places = activities or restaurants
+    origin = np.array([p["geo"] for p in places], dtype=float).mean(axis=0)
+
+    routes: List[List[int]] = [[] for _ in days]
+    if activities:
+        xy = _plane(np.array([a["geo"] for a in activities], dtype=float), origin)
+        dur = np.array([a.get("duration_minutes") or 90 for a in activities], dtype=float)
+        routes = [[stops[j] for j in _route(xy[stops])] for stops in _pick_stops(xy, dur, len(days), rng)]
+
+    anchors = []
+    for di, day in enumerate(itinerary):
+        blocks, spent = day["blocks"], 0.0
+        for n, i in enumerate(routes[di]):
+            minutes = activities[i].get("duration_minutes") or 90
+            fits = not blocks["afternoon"] and spent + minutes <= MORNING_MIN
+            blocks["morning" if n == 0 or fits else "afternoon"].append(activities[i])
+            spent += minutes
+        # lunch near where the morning ends, dinner near the day's last sight
+        last = activities[routes[di][-1]]["geo"] if routes[di] else tuple(origin)
+        anchors += [blocks["morning"][-1]["geo"] if blocks["morning"] else last, last]
+
+    meals = _meal_plan(anchors, restaurants, preferred_restaurants, origin) if restaurants else []
+    for di, day in enumerate(itinerary):
+        if meals:
+            day["blocks"]["afternoon"].insert(0, meals[2 * di])
+            day["blocks"]["evening"].append(meals[2 * di + 1])
+        if di < len(events):
+            day["blocks"]["evening"].append(events[di])
+    return itinerary
@@ -56,3 +56,16 @@ class AgentRequest(BaseModel):
 class AgentResponse(BaseModel):
     run_id: int
     output: PlanResponse
+
+class BatchPlanRequest(BaseModel):
+    requests: List[AgentRequest] = Field(min_length=1, max_length=500)
+
+class JobStatus(BaseModel):
+    job_id: int
+    status: Literal["queued", "running", "done", "failed"]
+    priority: int = 0
+    attempts: int = 0
+    run_id: Optional[int] = None
+    error: Optional[str] = None
+    deduplicated: bool = False
+    output: Optional[PlanResponse] = None
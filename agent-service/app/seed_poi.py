@@ -1,9 +1,15 @@
-from .db import engine, SessionLocal
-from .models import Base, POI, Restaurant
+from .bulk import upsert_batches, dialect_of
+from .cities import resolve_city_id_sync
+from .db import SessionLocal
+from .migrate import ensure_schema
+from .models import POI, Restaurant
+from .pools import bump_versions
+from .tagindex import link_places
 
-Base.metadata.create_all(bind=engine)
+ensure_schema()
 db = SessionLocal()
 city = "San Francisco, CA"
+city_id = resolve_city_id_sync(db, city)
 
 sample_pois = [
   dict(name="Exploratorium", address="Pier 15, SF", lat=37.8014, lon=-122.3989,
@@ -26,7 +32,13 @@ sample_rest = [
        tags="gluten-free", price_tier="$$", city=city),
 ]
 
-for p in sample_pois: db.add(POI(**p))
-for r in sample_rest: db.add(Restaurant(**r))
+# upsert on (city_id, name), so re-running the seed leaves the rows as they are
+dialect = dialect_of(db)
+for model, kind, rows in ((POI, "pois", sample_pois), (Restaurant, "restaurants", sample_rest)):
+    rows = [dict(r, city_id=city_id) for r in rows]
+    for stmt, chunk in upsert_batches(model, rows, dialect):
+        db.execute(stmt, chunk)
+    link_places(db, kind, rows)
+db.execute(bump_versions([city_id]))
 db.commit(); db.close()
 print("Seeded sample POIs and Restaurants.")
@@ -2,10 +2,16 @@ from __future__ import annotations
 from dataclasses import dataclass
 from typing import List, Dict
 
-from .db import engine, SessionLocal
-from .models import Base, POI, Restaurant
+from .bulk import upsert_batches, dialect_of
+from .cities import resolve_city_id_sync
+from .db import SessionLocal
+from .migrate import ensure_schema
+from .models import POI, Restaurant
+from .pools import bump_versions
+from .tagindex import link_places
+from .weather import prime_geocode_cache
 
-Base.metadata.create_all(bind=engine)
+ensure_schema()
 
 @dataclass
 class Place:
@@ -149,36 +155,43 @@ CITY_DATA: Dict[str, Dict[str, List[Place]]] = {
 }
 
 def upsert_city(city: str, data: Dict[str, List[Place]], db):
-    # prevent duplicates by (name, city)
-    existing_pois = {(n, c) for n, c in db.query(POI.name, POI.city).all()}
-    existing_rest = {(n, c) for n, c in db.query(Restaurant.name, Restaurant.city).all()}
+    # (city_id, name) is unique; existing rows are left as they are
+    city_id = resolve_city_id_sync(db, city)
+    pois = [dict(
+        name=p.name, address=p.address, lat=p.lat, lon=p.lon,
+        tags=p.tags, price_tier=p.price, duration_minutes=p.duration,
+        wheelchair_friendly=p.wheelchair, child_friendly=p.child, city=city, city_id=city_id
+    ) for p in data.get("pois", [])]
+    restaurants = [dict(
+        name=r.name, address=r.address, lat=r.lat, lon=r.lon,
+        tags=r.tags, price_tier=r.price, city=city, city_id=city_id
+    ) for r in data.get("restaurants", [])]
 
-    for p in data.get("pois", []):
-        key = (p.name, city)
-        if key in existing_pois:
-            continue
-        db.add(POI(
-            name=p.name, address=p.address, lat=p.lat, lon=p.lon,
-            tags=p.tags, price_tier=p.price, duration_minutes=p.duration,
-            wheelchair_friendly=p.wheelchair, child_friendly=p.child, city=city
-        ))
+    dialect = dialect_of(db)
+    for model, rows in ((POI, pois), (Restaurant, restaurants)):
+        for stmt, chunk in upsert_batches(model, rows, dialect):
+            db.execute(stmt, chunk)
+    link_places(db, "pois", pois)
+    link_places(db, "restaurants", restaurants)
+    db.execute(bump_versions([city_id]))
 
-    for r in data.get("restaurants", []):
-        key = (r.name, city)
-        if key in existing_rest:
-            continue
-        db.add(Restaurant(
-            name=r.name, address=r.address, lat=r.lat, lon=r.lon,
-            tags=r.tags, price_tier=r.price, city=city
-        ))
+def city_centers() -> Dict[str, tuple[float, float]]:
+    # centroid of each city's seeded places; close enough for weather + Overpass radius queries
+    out = {}
+    for city, data in CITY_DATA.items():
+        places = data.get("pois", []) + data.get("restaurants", [])
+        if places:
+            out[city] = (sum(p.lat for p in places) / len(places), sum(p.lon for p in places) / len(places))
+    return out
 
 def main():
     db = SessionLocal()
     try:
         for city, data in CITY_DATA.items():
             upsert_city(city, data, db)
+        n = prime_geocode_cache(city_centers(), db)
         db.commit()
-        print(f"✅ Seeded {len(CITY_DATA)} cities (POIs + Restaurants).")
+        print(f"✅ Seeded {len(CITY_DATA)} cities (POIs + Restaurants), warmed {n} geocodes.")
     finally:
         db.close()
 
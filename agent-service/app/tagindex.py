@@ -0,0 +1,65 @@
+# Normalized place tags: every distinct tag is interned once in `tags`, and poi_tags /
+# restaurant_tags link places to them, so interest/dietary filters can run inside SQL.
+# Writers call link_places() right after their upserts, in the same transaction.
+from __future__ import annotations
+from typing import Dict, Iterable, List
+from sqlalchemy import select
+
+from .bulk import CHUNK_ROWS, upsert_batches
+from .models import POI, POITag, Restaurant, RestaurantTag, Tag
+
+# kind -> (place model, link model, link column pointing at the place)
+_LINKS = {
+    "pois": (POI, POITag, "poi_id"),
+    "restaurants": (Restaurant, RestaurantTag, "restaurant_id"),
+}
+
+def split_tags(tags: str | None) -> List[str]:
+    """'Museum, art,,museum' -> ['museum', 'art']"""
+    return list(dict.fromkeys(t.strip().lower()[:100] for t in (tags or "").split(",") if t.strip()))
+
+def _chunks(items: List, n: int = CHUNK_ROWS):
+    for i in range(0, len(items), n):
+        yield items[i : i + n]
+
+def intern_tags(db, names: Iterable[str]) -> Dict[str, int]:
+    """name -> tag id, creating the missing ones."""
+    names = sorted(set(names))
+    dialect = db.get_bind().dialect.name
+    for stmt, chunk in upsert_batches(Tag, [{"name": n} for n in names], dialect, key=("name",)):
+        db.execute(stmt, chunk)
+    ids: Dict[str, int] = {}
+    for chunk in _chunks(names):
+        ids.update((n, i) for i, n in db.execute(select(Tag.id, Tag.name).where(Tag.name.in_(chunk))))
+    return ids
+
+def link_places(db, kind: str, rows: List[Dict]) -> int:
+    """Link freshly upserted place rows (dicts with city_id, name, tags) to their tags. Sync
+    Session; async writers go through `await session.run_sync(link_places, kind, rows)`.
+    Upserts keep the first copy of a place, so existing links never need replacing."""
+    model, link, fk = _LINKS[kind]
+    wanted: Dict[tuple, List[str]] = {}
+    for r in rows:
+        if r.get("city_id") is not None:
+            wanted.setdefault((r["city_id"], r["name"]), split_tags(r.get("tags")))
+    wanted = {k: v for k, v in wanted.items() if v}
+    if not wanted:
+        return 0
+    tag_ids = intern_tags(db, (t for tags in wanted.values() for t in tags))
+    by_city: Dict[int, List[str]] = {}
+    for cid, name in wanted:
+        by_city.setdefault(cid, []).append(name)
+    links = []
+    for cid, names in by_city.items():
+        for chunk in _chunks(names):
+            for pid, name in db.execute(select(model.id, model.name).where(model.city_id == cid, model.name.in_(chunk))):
+                links += [{"tag_id": tag_ids[t], fk: pid} for t in wanted[(cid, name)]]
+    for stmt, chunk in upsert_batches(link, links, db.get_bind().dialect.name, key=("tag_id", fk)):
+        db.execute(stmt, chunk)
+    return len(links)
+
+def tagged(kind: str, tags: Iterable[str]):
+    """WHERE clause: the place carries at least one of `tags`."""
+    model, link, fk = _LINKS[kind]
+    names = sorted({t.strip().lower() for t in tags if t and t.strip()})
+    return model.id.in_(select(getattr(link, fk)).join(Tag, Tag.id == link.tag_id).where(Tag.name.in_(names)))
@@ -0,0 +1,143 @@
+# Shared upstream HTTP: one pooled keep-alive client per upstream (httpx keeps a connection pool
+# per host inside it), so a plan reuses warm connections instead of paying a TCP/TLS handshake
+# per call. Timeouts and retries come from Settings; startup/shutdown is tied to the app lifespan.
+from __future__ import annotations
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, List
+import asyncio
+import logging
+import random
+import time
+import httpx
+
+from . import metrics
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+@dataclass
+class Upstream:
+    name: str
+    timeout: float
+    retries: int = 0           # extra attempts for idempotent calls
+
+def _upstreams() -> Dict[str, Upstream]:
+    s = settings
+    return {u.name: u for u in (
+        Upstream("geocode", s.geocode_timeout_s, s.geocode_retries),
+        Upstream("forecast", s.forecast_timeout_s, s.forecast_retries),
+        Upstream("overpass", s.overpass_timeout_s),
+        Upstream("tavily", s.tavily_timeout_s, s.tavily_retries),
+        Upstream("llm", s.llm_timeout_s),       # the OpenAI SDK retries on its own
+    )}
+
+UPSTREAMS = _upstreams()
+
+class RetryBudget:
+    """Retries may add at most `ratio` of the upstream's traffic (after a small burst), so a
+    failing upstream sees a trickle of retries instead of a multiplied load."""
+
+    def __init__(self, ratio: float, burst: float = 10.0):
+        self.ratio, self.burst = ratio, burst
+        self.tokens = burst
+
+    def on_request(self):
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+def _http2() -> bool:
+    if not settings.http_http2:
+        return False
+    try:
+        import h2  # noqa: F401  (optional: pip install httpx[http2])
+        return True
+    except ImportError:
+        return False
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_metered: ContextVar[List[int] | None] = ContextVar("upstream_metered", default=None)
+_budgets: Dict[str, RetryBudget] = {}
+_stats: Dict[str, Dict[str, int]] = {}
+
+def client(name: str) -> httpx.AsyncClient:
+    c = _clients.get(name)
+    if c is None or c.is_closed:
+        up = UPSTREAMS[name]
+        c = _clients[name] = httpx.AsyncClient(
+            timeout=httpx.Timeout(up.timeout, connect=min(up.timeout, 5.0)),
+            limits=httpx.Limits(max_connections=settings.http_max_connections,
+                                max_keepalive_connections=settings.http_max_keepalive,
+                                keepalive_expiry=settings.http_keepalive_expiry_s),
+            http2=_http2(),
+            headers={"User-Agent": "ai-concierge-agent/1.0"},
+        )
+    return c
+
+async def request(name: str, method: str, url: str, **kw) -> httpx.Response:
+    """One call through the upstream's pooled client. Connection errors, timeouts and
+    429/5xx are retried with full-jitter exponential backoff, within the retry budget."""
+    up = UPSTREAMS[name]
+    budget = _budgets.setdefault(name, RetryBudget(settings.http_retry_budget))
+    stats = _stats.setdefault(name, {"requests": 0, "retries": 0, "errors": 0})
+    budget.on_request()
+    attempt = 0
+    box = _metered.get()
+    while True:
+        stats["requests"] += 1
+        if box is not None:
+            box[0] += 1
+        t0 = time.perf_counter()
+        try:
+            r = await client(name).request(method, url, **kw)
+            metrics.observe("upstream_request_seconds", time.perf_counter() - t0, upstream=name,
+                            outcome=f"{r.status_code // 100}xx")
+            if r.status_code not in RETRY_STATUS:
+                return r
+            failure: Exception | httpx.Response = r
+        except (httpx.TransportError, httpx.TimeoutException) as e:
+            metrics.observe("upstream_request_seconds", time.perf_counter() - t0, upstream=name,
+                            outcome="timeout" if isinstance(e, httpx.TimeoutException) else "error")
+            failure = e
+        stats["errors"] += 1
+        if attempt >= up.retries or not budget.try_spend():
+            if isinstance(failure, httpx.Response):
+                return failure     # caller's raise_for_status() reports it
+            raise failure
+        attempt += 1
+        stats["retries"] += 1
+        await asyncio.sleep(random.uniform(0, settings.http_retry_base_s * 2 ** attempt))
+
+async def get(name: str, url: str, **kw) -> httpx.Response:
+    return await request(name, "GET", url, **kw)
+
+async def post(name: str, url: str, **kw) -> httpx.Response:
+    return await request(name, "POST", url, **kw)
+
+@contextmanager
+def metered():
+    """Counts upstream requests (retries included) made inside the block, and by tasks it
+    starts, in box[0]."""
+    box = [0]
+    token = _metered.set(box)
+    try:
+        yield box
+    finally:
+        _metered.reset(token)
+
+def upstream_stats() -> Dict[str, Dict[str, int]]:
+    return {k: dict(v) for k, v in _stats.items()}
+
+async def aclose():
+    clients = list(_clients.values())
+    _clients.clear()
+    for c in clients:
+        await c.aclose()
@@ -1,5 +1,14 @@
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta, timezone
 from typing import Iterable
+import re
+import unicodedata
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+def utcnow() -> datetime:
+    """Naive UTC, matching how DateTime columns are stored."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 def daterange(d1: date, d2: date):
     cur = d1
@@ -7,6 +16,21 @@ def daterange(d1: date, d2: date):
         yield cur
         cur += timedelta(days=1)
 
+_COUNTRY_SUFFIXES = (", usa", ", us", ", united states", ", united states of america")
+
+def normalize_location(location: str) -> str:
+    """Canonical cache key for a free-text location: 'San  Francisco,CA ' -> 'san francisco, ca'."""
+    s = unicodedata.normalize("NFKD", location or "")
+    s = "".join(ch for ch in s if not unicodedata.combining(ch)).lower()
+    s = re.sub(r"[^\w\s,-]", " ", s)
+    parts = [" ".join(p.split()) for p in s.split(",")]
+    s = ", ".join(p for p in parts if p)
+    for suffix in _COUNTRY_SUFFIXES:
+        if s.endswith(suffix) and s != suffix.lstrip(", "):
+            s = s[: -len(suffix)]
+            break
+    return s
+
 def to_price_tier(budget: str) -> str:
     return budget if budget in {"$", "$$", "$$$"} else "$$"
 
@@ -21,3 +45,10 @@ def mobility_ok(mobility: str | None, wheelchair_flag: int, duration: int) -> bo
     if mobility == "no-long-hikes":
         return duration <= 120
     return True
+
+def haversine_km(lat: float, lon: float, lats, lons) -> np.ndarray:
+    """Great-circle distance from (lat, lon) to every point in lats/lons, vectorized."""
+    la1, lo1 = np.radians(lat), np.radians(lon)
+    la2, lo2 = np.radians(np.asarray(lats, dtype=float)), np.radians(np.asarray(lons, dtype=float))
+    a = np.sin((la2 - la1) / 2) ** 2 + np.cos(la1) * np.cos(la2) * np.sin((lo2 - lo1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
@@ -1,14 +1,32 @@
-from datetime import date
-import httpx
+from datetime import date, timedelta
+from typing import Dict, List
+import asyncio
+import logging
+from sqlalchemy import select
 
-HTTP_TIMEOUT = 8.0
+from .bulk import upsert_batches, dialect_of
+from .cache import TTLCache
+from .config import settings
+from .db import AsyncSessionLocal, write_lock
+from .models import GeocodeCache, ForecastDay
+from .utils import normalize_location, daterange, utcnow as _utcnow
+from . import metrics, upstream
 
-def geocode_city(city: str) -> tuple[float, float]:
+logger = logging.getLogger(__name__)
+
+# ---------- Geocoding: LRU -> geocode_cache table -> Open-Meteo ----------
+
+_geo_lru = TTLCache(settings.geocode_lru_size, settings.geocode_ttl_days * 86400)
+_geo_negative = TTLCache(512, settings.geocode_negative_ttl_s)   # failures never share the positive LRU
+_geo_inflight: Dict[str, asyncio.Future] = {}
+metrics.track_cache("geocode", _geo_lru)
+metrics.track_cache("geocode_negative", _geo_negative)
+
+async def _geocode_remote(city: str) -> tuple[float, float] | None:
     try:
-        r = httpx.get(
-            "https://geocoding-api.open-meteo.com/v1/search",
+        r = await upstream.get(
+            "geocode", settings.geocode_url,
             params={"name": city, "count": 1},
-            timeout=HTTP_TIMEOUT,
         )
         r.raise_for_status()
         data = r.json()
@@ -17,25 +35,211 @@ def geocode_city(city: str) -> tuple[float, float]:
             return float(it["latitude"]), float(it["longitude"])
     except Exception:
         pass
-    return (0.0, 0.0)
+    return None
+
+# Cache rows are written after the answer is already in the LRU, so requests don't wait on
+# the write (under SQLite, on the one write lock); flush_writes() drains them at shutdown.
+_writes: set = set()
+
+def _write_behind(coro):
+    task = asyncio.ensure_future(coro)
+    _writes.add(task)
+    task.add_done_callback(_writes.discard)
+
+async def flush_writes():
+    if _writes:
+        await asyncio.gather(*list(_writes), return_exceptions=True)
+
+async def _store_geocode(key: str, coords: tuple[float, float] | None, ttl_s: float):
+    now = _utcnow()
+    try:
+        async with write_lock(), AsyncSessionLocal() as db:
+            await db.merge(GeocodeCache(
+                key=key, lat=coords[0] if coords else None, lon=coords[1] if coords else None,
+                ok=1 if coords else 0, fetched_at=now, expires_at=now + timedelta(seconds=ttl_s),
+            ))
+            await db.commit()
+    except Exception as e:
+        logger.warning("geocode cache write failed for %r: %s", key, e)
+
+async def _geocode_through(key: str, city: str) -> tuple[float, float] | None:
+    now = _utcnow()
+    row = None
+    try:
+        async with AsyncSessionLocal() as db:
+            row = await db.get(GeocodeCache, key)
+    except Exception as e:
+        logger.warning("geocode cache read failed for %r: %s", key, e)
+    if row is not None and row.expires_at > now:
+        remaining = (row.expires_at - now).total_seconds()
+        if row.ok:
+            coords = (row.lat, row.lon)
+            _geo_lru.set(key, coords, ttl=remaining)
+            return coords
+        _geo_negative.set(key, True, ttl=remaining)
+        return None
+
+    coords = await _geocode_remote(city)
+    if coords is not None:
+        _geo_lru.set(key, coords)
+        _write_behind(_store_geocode(key, coords, settings.geocode_ttl_days * 86400))
+        return coords
+    if row is not None and row.ok:
+        # refresh failed: keep serving the stale coordinate, retry after the negative TTL
+        stale = (row.lat, row.lon)
+        _geo_lru.set(key, stale, ttl=settings.geocode_negative_ttl_s)
+        return stale
+    _geo_negative.set(key, True)
+    _write_behind(_store_geocode(key, None, settings.geocode_negative_ttl_s))
+    return None
+
+async def geocode_city(city: str) -> tuple[float, float] | None:
+    """(lat, lon) for a free-text location, or None if it can't be resolved."""
+    key = normalize_location(city)
+    if not key:
+        return None
+    coords = _geo_lru.get(key)
+    if coords is not None:
+        return coords
+    if key in _geo_negative:
+        return None
+    fut = _geo_inflight.get(key)
+    if fut is None:
+        # collapse concurrent lookups of the same location into one round-trip
+        fut = asyncio.ensure_future(_geocode_through(key, city))
+        _geo_inflight[key] = fut
+        fut.add_done_callback(lambda _: _geo_inflight.pop(key, None))
+    return await asyncio.shield(fut)
+
+def prime_geocode_cache(entries: Dict[str, tuple[float, float]], db) -> int:
+    """Bulk-load known coordinates (e.g. seed cities) into the geocode_cache table (sync session)."""
+    now = _utcnow()
+    expires = now + timedelta(days=settings.geocode_ttl_days)
+    for city, (lat, lon) in entries.items():
+        key = normalize_location(city)
+        db.merge(GeocodeCache(key=key, lat=lat, lon=lon, ok=1, fetched_at=now, expires_at=expires))
+        _geo_lru.set(key, (lat, lon))
+    return len(entries)
+
+def geocode_cache_stats() -> dict:
+    return {"lru": _geo_lru.stats(), "negative": _geo_negative.stats()}
 
-def daily_weather(lat: float, lon: float, start: date, end: date):
+# ---------- Forecast: per (grid cell, day) LRU -> forecast_days table -> Open-Meteo ----------
+
+FORECAST_FIELDS = ("temperature_2m_max", "temperature_2m_min", "precipitation_probability_mean")
+
+# (max lead days, ttl seconds): near-term forecasts change fastest
+_FORECAST_TTL_BY_LEAD = [(1, 3600), (3, 3 * 3600), (7, 6 * 3600)]
+_FORECAST_TTL_FAR = 12 * 3600
+_FORECAST_TTL_PAST = 30 * 86400   # observed days don't change
+
+_fc_lru = TTLCache(settings.forecast_lru_size, _FORECAST_TTL_FAR)
+metrics.track_cache("forecast_day", _fc_lru)
+
+def _grid_cell(lat: float, lon: float) -> tuple[int, int]:
+    g = settings.forecast_grid_deg
+    return round(lat / g), round(lon / g)
+
+def _forecast_ttl(day: date, today: date) -> float:
+    lead = (day - today).days
+    if lead < 0:
+        return _FORECAST_TTL_PAST
+    for max_lead, ttl in _FORECAST_TTL_BY_LEAD:
+        if lead <= max_lead:
+            return ttl
+    return _FORECAST_TTL_FAR
+
+async def _fetch_forecast(cell: tuple[int, int], start: date, end: date) -> Dict[date, tuple]:
+    # query the cell center so every lookup in the cell sees the same numbers
+    g = settings.forecast_grid_deg
     try:
-        r = httpx.get(
-            "https://api.open-meteo.com/v1/forecast",
+        r = await upstream.get(
+            "forecast", settings.forecast_url,
             params={
-                "latitude": lat, "longitude": lon,
+                "latitude": round(cell[0] * g, 4), "longitude": round(cell[1] * g, 4),
                 "start_date": start.isoformat(),
                 "end_date": end.isoformat(),
-                "daily": "temperature_2m_max,temperature_2m_min,precipitation_probability_mean",
+                "daily": ",".join(FORECAST_FIELDS),
                 "timezone": "auto",
             },
-            timeout=HTTP_TIMEOUT,
         )
         r.raise_for_status()
-        return r.json().get("daily", {})
+        daily = r.json().get("daily", {})
     except Exception:
         return {}
+    cols = [daily.get(f) or [] for f in FORECAST_FIELDS]
+    out = {}
+    for i, d in enumerate(daily.get("time") or []):
+        out[date.fromisoformat(d)] = tuple(c[i] if i < len(c) else None for c in cols)
+    return out
+
+async def _load_forecast_rows(cell: tuple[int, int], start: date, end: date) -> Dict[date, tuple]:
+    try:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(select(ForecastDay).where(
+                ForecastDay.grid_y == cell[0], ForecastDay.grid_x == cell[1],
+                ForecastDay.day >= start, ForecastDay.day <= end,
+                ForecastDay.expires_at > _utcnow(),
+            ))).scalars().all()
+    except Exception as e:
+        logger.warning("forecast cache read failed for %s: %s", cell, e)
+        return {}
+    now = _utcnow()
+    out = {}
+    for r in rows:
+        vals = tuple(getattr(r, f) for f in FORECAST_FIELDS)
+        _fc_lru.set((cell, r.day), vals, ttl=(r.expires_at - now).total_seconds())
+        out[r.day] = vals
+    return out
+
+async def _store_forecast_rows(cell: tuple[int, int], days: Dict[date, tuple]):
+    now = _utcnow()
+    today = now.date()
+    rows = []
+    for d, vals in days.items():
+        ttl = _forecast_ttl(d, today)
+        _fc_lru.set((cell, d), vals, ttl=ttl)
+        rows.append(dict(grid_y=cell[0], grid_x=cell[1], day=d, **dict(zip(FORECAST_FIELDS, vals)),
+                         fetched_at=now, expires_at=now + timedelta(seconds=ttl)))
+    try:
+        # native upsert: requests for neighbouring cities can store the same cell concurrently
+        async with write_lock(), AsyncSessionLocal() as db:
+            for stmt, chunk in upsert_batches(ForecastDay, rows, dialect_of(db),
+                                              key=("grid_y", "grid_x", "day"), update=True):
+                await db.execute(stmt, chunk)
+            await db.commit()
+    except Exception as e:
+        logger.warning("forecast cache write failed for %s: %s", cell, e)
+
+async def daily_weather(lat: float, lon: float, start: date, end: date):
+    """Open-Meteo style `daily` dict for [start, end], assembled from cached days;
+    only the missing sub-range is fetched."""
+    cell = _grid_cell(lat, lon)
+    days: List[date] = list(daterange(start, end))
+    found: Dict[date, tuple] = {}
+    for d in days:
+        vals = _fc_lru.get((cell, d))
+        if vals is not None:
+            found[d] = vals
+    missing = [d for d in days if d not in found]
+    if missing:
+        found.update(await _load_forecast_rows(cell, missing[0], missing[-1]))
+        missing = [d for d in days if d not in found]
+    if missing:
+        fetched = await _fetch_forecast(cell, missing[0], missing[-1])
+        if fetched:
+            _write_behind(_store_forecast_rows(cell, fetched))
+            found.update(fetched)
+    have = [d for d in days if d in found]
+    if not have:
+        return {}
+    daily = {"time": [d.isoformat() for d in have]}
+    for i, f in enumerate(FORECAST_FIELDS):
+        daily[f] = [found[d][i] for d in have]
+    return daily
+
+def forecast_cache_stats() -> dict:
+    return {"lru": _fc_lru.stats()}
 
 def summarize_weather(daily) -> str:
     if not daily:
@@ -0,0 +1,90 @@
+"""Machine-readable benchmark baselines: save a run's rows as JSON, later compare a new run
+against them and report every metric that got worse by more than the tolerance.
+
+Rows are matched on their key fields (e.g. backend + scenario + concurrency). Metric names
+decide the direction: throughput (*_per_s) regresses downward, everything else (latencies,
+error counts) upward.
+"""
+from __future__ import annotations
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Sequence
+import json
+import os
+import platform
+
+HERE = os.path.join(os.path.dirname(__file__), "baselines")
+
+def default_path(bench: str) -> str:
+    return os.path.join(HERE, f"{bench}.json")
+
+def _higher_is_better(metric: str) -> bool:
+    return metric.endswith("_per_s")
+
+def save(path: str, bench: str, rows: List[Dict], keys: Sequence[str], metrics: Sequence[str]):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    doc = {
+        "bench": bench, "keys": list(keys), "metrics": list(metrics),
+        "recorded_at": datetime.now(timezone.utc).replace(microsecond=0).isoformat(),
+        "host": {"python": platform.python_version(), "machine": platform.machine(),
+                 "system": platform.system(), "cpus": os.cpu_count()},
+        "rows": rows,
+    }
+    with open(path, "w") as f:
+        json.dump(doc, f, indent=1)
+        f.write("\n")
+
+def load(path: str) -> Dict:
+    with open(path) as f:
+        return json.load(f)
+
+def compare(path: str, rows: Iterable[Dict], tolerance: float = 0.25) -> List[Dict]:
+    """Regressions against the saved baseline: one dict per (row, metric) worse than `tolerance`
+    (0.25 = 25%). Rows or metrics the baseline doesn't have are skipped."""
+    doc = load(path)
+    keys, metrics = doc["keys"], doc["metrics"]
+    base = {tuple(r.get(k) for k in keys): r for r in doc["rows"]}
+    out = []
+    for row in rows:
+        ref = base.get(tuple(row.get(k) for k in keys))
+        if ref is None:
+            continue
+        for m in metrics:
+            old, new = ref.get(m), row.get(m)
+            if old is None or new is None:
+                continue
+            if not old:
+                # e.g. errors: anything above a clean baseline counts
+                change, worse = None, (new > 0 and not _higher_is_better(m)) * float("inf")
+            else:
+                change = (new - old) / old
+                worse = -change if _higher_is_better(m) else change
+            if worse > tolerance:
+                out.append({**{k: row.get(k) for k in keys}, "metric": m, "baseline": old, "now": new,
+                            "change_pct": None if change is None else round(change * 100, 1)})
+    return out
+
+def add_args(ap, bench: str):
+    ap.add_argument("--save-baseline", nargs="?", const=default_path(bench), metavar="PATH",
+                    help=f"write the results as the baseline (default bench/baselines/{bench}.json)")
+    ap.add_argument("--check-baseline", nargs="?", const=default_path(bench), metavar="PATH",
+                    help="compare against a saved baseline; exit status 1 on a regression")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before --check-baseline fails")
+
+def handle(args, bench: str, rows: List[Dict], keys: Sequence[str], metrics: Sequence[str]) -> int:
+    """--save-baseline / --check-baseline for a finished run; returns the exit status."""
+    if args.save_baseline:
+        # a failing run isn't a reference: later runs that fail as much would pass the check
+        clean = [r for r in rows if not r.get("errors")]
+        for r in rows:
+            if r.get("errors"):
+                print("not saved, had errors: " + json.dumps({k: r.get(k) for k in (*keys, "errors")}))
+        save(args.save_baseline, bench, clean, keys, metrics)
+        print(f"baseline written to {args.save_baseline}")
+    if args.check_baseline:
+        bad = compare(args.check_baseline, rows, args.tolerance)
+        for b in bad:
+            print("REGRESSION " + json.dumps(b))
+        if bad:
+            return 1
+        print(f"no regressions against {args.check_baseline} (tolerance {args.tolerance:.0%})")
+    return 0
@@ -0,0 +1,81 @@
+"""Candidate filtering benchmark: interests + mobility filter, nearest-first and soft dietary
+ranking over one city pool, per-item (dict loop) against the columnar engine in app.candidates.
+
+    python -m bench.bench_filtering [--runs 30] [--json]
+"""
+from __future__ import annotations
+import argparse
+import json
+import random
+import statistics
+import time
+
+from app.candidates import CandidateColumns, select
+from app.utils import haversine_km, interest_match, mobility_ok
+
+SIZES = [1_000, 10_000, 50_000, 100_000]
+TAGS = ["museum", "gallery", "park", "garden", "viewpoint", "theatre", "zoo", "art", "history",
+        "science", "beach", "market", "library", "attraction", "playground", "kid-friendly"]
+DIETS = ["vegan", "vegetarian", "halal", "kosher", "gluten-free", "pizza", "sushi", "cafe"]
+QUERY = {"lat": 45.52, "lon": -122.67, "interests": ["museum", "art", "history"],
+         "mobility": "no-long-hikes", "dietary": "vegan"}
+
+def synthetic_entries(n: int, vocab, seed: int = 1):
+    rng = random.Random(seed)
+    out = []
+    for i in range(n):
+        tags = rng.sample(vocab, k=rng.randint(1, 4))
+        card = {"title": f"place-{i}", "address": "", "geo": (45.52 + rng.uniform(-0.2, 0.2), -122.67 + rng.uniform(-0.3, 0.3)),
+                "price_tier": None, "duration_minutes": rng.choice([45, 60, 90, 120, 150, 180]), "tags": tags,
+                "wheelchair_friendly": rng.random() < 0.6, "child_friendly": True}
+        out.append((card, frozenset(tags)))
+    return out
+
+def per_item(entries, lat, lon, interests, mobility, dietary):
+    # the previous path: rank by distance, then test every card in Python, then sort for dietary
+    d = haversine_km(lat, lon, [c["geo"][0] for c, _ in entries], [c["geo"][1] for c, _ in entries])
+    ranked = [entries[i] for i in d.argsort(kind="stable")]
+    out = [c for c, _ in ranked if interest_match(",".join(c["tags"]), interests)
+           and mobility_ok(mobility, c["wheelchair_friendly"], c["duration_minutes"])]
+    return sorted(out, key=lambda c: (dietary in {t.lower() for t in c["tags"]}, -len(c["tags"])), reverse=True)
+
+def _timed(fn, runs):
+    fn()
+    times = []
+    for _ in range(runs):
+        t = time.perf_counter()
+        out = fn()
+        times.append((time.perf_counter() - t) * 1000)
+    return out, statistics.median(times)
+
+def run(runs: int):
+    rows = []
+    for n in SIZES:
+        entries = synthetic_entries(n, TAGS + DIETS)
+        t = time.perf_counter()
+        cols = CandidateColumns([c for c, _ in entries], [t for _, t in entries])
+        build_ms = (time.perf_counter() - t) * 1000
+        legacy, legacy_ms = _timed(lambda: per_item(entries, **QUERY), runs)
+        fast, fast_ms = _timed(lambda: select(entries, cols, **QUERY), runs)
+        rows.append({"candidates": n, "kept": len(fast), "same_result": [c["title"] for c in fast] == [c["title"] for c in legacy],
+                     "per_item_ms": round(legacy_ms, 3), "columnar_ms": round(fast_ms, 3),
+                     "speedup": round(legacy_ms / fast_ms, 1), "build_ms": round(build_ms, 1)})
+    return rows
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--runs", type=int, default=30)
+    ap.add_argument("--json", action="store_true", help="one JSON object per size instead of a table")
+    args = ap.parse_args(argv)
+    rows = run(args.runs)
+    if args.json:
+        for r in rows:
+            print(json.dumps({"bench": "filtering", **r}))
+        return
+    print(f"{'cands':>7} {'kept':>6} {'same':>5} {'per-item ms':>12} {'columnar ms':>12} {'speedup':>8} {'build ms':>9}")
+    for r in rows:
+        print(f"{r['candidates']:>7} {r['kept']:>6} {str(r['same_result']):>5} {r['per_item_ms']:>12} "
+              f"{r['columnar_ms']:>12} {r['speedup']:>8} {r['build_ms']:>9}")
+
+if __name__ == "__main__":
+    main()
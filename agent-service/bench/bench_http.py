@@ -0,0 +1,129 @@
+"""Upstream HTTP benchmark against a local stub server: a new client per call (the old
+one-off pattern) versus the pooled keep-alive clients in app.upstream. The stub counts the
+connections it accepts and can charge a simulated round trip for each new one.
+
+    python -m bench.bench_http [--requests 200] [--concurrency 8] [--rtt-ms 20] [--tls] [--json]
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import ssl
+import statistics
+import subprocess
+import tempfile
+import time
+
+BODY = json.dumps({"results": [{"latitude": 45.52, "longitude": -122.68}]}).encode()
+
+class Stub:
+    """Minimal HTTP/1.1 keep-alive server. A new connection waits `rtt` per handshake round
+    trip (1 for TCP, +1 for TLS) before its first response."""
+
+    def __init__(self, rtt: float, tls: ssl.SSLContext | None):
+        self.rtt, self.tls = rtt, tls
+        self.connections = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        await asyncio.sleep(self.rtt * (2 if self.tls else 1))
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":")[1])
+                if length:
+                    await reader.readexactly(length)
+                await asyncio.sleep(self.rtt / 2)      # request/response round trip
+                writer.write(b"HTTP/1.1 200 OK\r\ncontent-type: application/json\r\n"
+                             b"content-length: %d\r\n\r\n%s" % (len(BODY), BODY))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+def _self_signed(tmp: str) -> tuple[str, str]:
+    cert, key = os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+                    "-addext", "subjectAltName=IP:127.0.0.1,DNS:localhost", "-keyout", key, "-out", cert],
+                   check=True, capture_output=True)
+    return cert, key
+
+async def _drive(call, n: int, concurrency: int):
+    sem = asyncio.Semaphore(concurrency)
+    times = []
+
+    async def one():
+        async with sem:
+            t = time.perf_counter()
+            r = await call()
+            r.raise_for_status()
+            times.append((time.perf_counter() - t) * 1000)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(n)])
+    return times, time.perf_counter() - t0
+
+async def run(n: int, concurrency: int, rtt_ms: float, tls: bool):
+    import httpx
+    from app import upstream
+    tmp = tempfile.mkdtemp()
+    ctx = None
+    if tls:
+        cert, key = _self_signed(tmp)
+        ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ctx.load_cert_chain(cert, key)
+        os.environ["SSL_CERT_FILE"] = cert     # trusted by every httpx client created from here on
+    stub = Stub(rtt_ms / 1000, ctx)
+    server = await asyncio.start_server(stub.handle, "127.0.0.1", 0, ssl=ctx)
+    url = f"{'https' if tls else 'http'}://127.0.0.1:{server.sockets[0].getsockname()[1]}/v1/search"
+
+    async def per_call():
+        async with httpx.AsyncClient(timeout=8.0) as c:
+            return await c.get(url, params={"name": "Portland"})
+
+    async def pooled():
+        return await upstream.get("geocode", url, params={"name": "Portland"})
+
+    rows = []
+    try:
+        for mode, call in (("per-call client", per_call), ("pooled", pooled)):
+            await call()          # warm-up (creates the pooled client)
+            stub.connections = 0
+            times, wall = await _drive(call, n, concurrency)
+            rows.append({"mode": mode, "requests": n, "concurrency": concurrency, "rtt_ms": rtt_ms, "tls": tls,
+                         "connections": stub.connections,
+                         "ms_median": round(statistics.median(times), 2),
+                         "ms_p95": round(sorted(times)[int(0.95 * (len(times) - 1))], 2),
+                         "req_per_s": round(n / wall, 1)})
+    finally:
+        await upstream.aclose()
+        server.close()
+        await server.wait_closed()
+        shutil.rmtree(tmp, ignore_errors=True)
+    return rows
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--rtt-ms", type=float, default=20.0, help="simulated network round trip")
+    ap.add_argument("--tls", action="store_true", help="serve HTTPS with a throwaway self-signed cert (needs openssl)")
+    ap.add_argument("--json", action="store_true", help="one JSON object per mode instead of a table")
+    args = ap.parse_args(argv)
+    rows = asyncio.run(run(args.requests, args.concurrency, args.rtt_ms, args.tls))
+    if args.json:
+        for r in rows:
+            print(json.dumps({"bench": "http", **r}))
+        return
+    print(f"{'mode':<16} {'reqs':>5} {'conns':>6} {'median ms':>10} {'p95 ms':>8} {'req/s':>8}")
+    for r in rows:
+        print(f"{r['mode']:<16} {r['requests']:>5} {r['connections']:>6} {r['ms_median']:>10} {r['ms_p95']:>8} {r['req_per_s']:>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Load test for POST /agent/plan: starts bench.stubs and an agent server (uvicorn, one process
+per database backend), then drives it at increasing concurrency and reports p50/p95/p99 and
+requests/sec per scenario:
+
+- cold:   a city nobody planned yet per request (geocode, forecast, Overpass, place writes)
+- fresh:  known cities with Cache-Control: no-cache (the whole pipeline on warm caches + run writes)
+- cached: repeats of planned requests (memoized runs)
+
+    python -m bench.bench_load [--concurrency 1,4,16,64] [--requests 200] [--scenario cold,fresh,cached]
+                               [--db sqlite] [--db mysql+pymysql://user:pw@localhost/bench] [--latency-ms 30]
+                               [--url http://host:port --label prod-like] [--json]
+                               [--save-baseline [PATH]] [--check-baseline [PATH]]
+
+A MySQL backend needs an empty database the agent may create tables in; --url drives a server
+you started yourself (point its upstreams at `python -m bench.stubs`).
+"""
+from __future__ import annotations
+from datetime import date, timedelta
+from itertools import count
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench import baseline
+from bench.stubs import CITIES, add_profile_args, agent_env, stubs_from_args
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("cold", "fresh", "cached")
+KEYS = ("backend", "scenario", "concurrency")
+METRICS = ("ms_p50", "ms_p95", "ms_p99", "req_per_s", "errors")
+
+INTERESTS = [["museum", "gallery"], ["park", "garden"], ["theatre"], ["viewpoint", "attraction"], []]
+ASKS = [None, "museums and parks, vegan food", "cheap eats and galleries, wheelchair accessible",
+        "something fun for the kids, nothing fancy"]      # the last one goes past the local parser
+
+_cold = count()
+
+def plan_request(i: int, city: str | None = None) -> dict:
+    """The i-th request of a deterministic mix over the stubbed cities, 2-7 day trips."""
+    names = list(CITIES)
+    start = date.today() + timedelta(days=2 + i % 5)
+    return {
+        "booking": {"start_date": start.isoformat(), "end_date": (start + timedelta(days=1 + i % 6)).isoformat(),
+                    "location": city or names[i % len(names)].title(), "party_type": ("couple", "family", "friends")[i % 3]},
+        "preferences": {"budget_tier": ("$", "$$", "$$$")[i % 3], "interests": INTERESTS[i % len(INTERESTS)],
+                        "mobility": "wheelchair" if i % 7 == 0 else None, "dietary": "vegan" if i % 4 == 0 else None},
+        "ask": ASKS[i % len(ASKS)],
+    }
+
+def _request_for(scenario: str, i: int) -> tuple[dict, dict]:
+    if scenario == "cold":
+        return plan_request(i, f"Loadtown {next(_cold)}, ZZ"), {"Cache-Control": "no-cache"}
+    if scenario == "fresh":
+        return plan_request(i), {"Cache-Control": "no-cache"}
+    return plan_request(i % 24), {}
+
+def _pct(sorted_ms, q: float) -> float:
+    return round(sorted_ms[min(len(sorted_ms) - 1, int(q * len(sorted_ms)))], 2) if sorted_ms else 0.0
+
+async def drive(base: str, scenario: str, n: int, concurrency: int) -> dict:
+    sem = asyncio.Semaphore(concurrency)
+    times, errors = [], 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base, timeout=120.0, limits=limits) as client:
+        if scenario == "cached":
+            for i in range(24):           # plan every request once so the timed ones are memo hits
+                await client.post("/agent/plan", json=plan_request(i))
+
+        async def one(i: int):
+            nonlocal errors
+            body, headers = _request_for(scenario, i)
+            async with sem:
+                t = time.perf_counter()
+                try:
+                    r = await client.post("/agent/plan", json=body, headers=headers)
+                    ok = r.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                ms = (time.perf_counter() - t) * 1000
+            if ok:
+                times.append(ms)
+            else:
+                errors += 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*[one(i) for i in range(n)])
+        wall = time.perf_counter() - t0
+    times.sort()
+    return {"scenario": scenario, "concurrency": concurrency, "requests": n, "errors": errors,
+            "ms_p50": _pct(times, 0.50), "ms_p95": _pct(times, 0.95), "ms_p99": _pct(times, 0.99),
+            "req_per_s": round(len(times) / wall, 1)}
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_agent(env: dict, workdir: str) -> tuple[subprocess.Popen, str, str]:
+    port = _free_port()
+    log = os.path.join(workdir, "agent.log")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=HERE, env={**os.environ, **env}, stdout=open(log, "w"), stderr=subprocess.STDOUT,
+    )
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            break
+        try:
+            if httpx.get(f"{base}/health", timeout=1.0).status_code == 200:
+                return proc, base, log
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proc.kill()
+    with open(log) as f:
+        raise RuntimeError(f"agent server didn't come up:\n{f.read()[-2000:]}")
+
+def stop_agent(proc: subprocess.Popen):
+    proc.terminate()
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+def backend_name(db: str) -> str:
+    return "sqlite" if db == "sqlite" else db.split(":", 1)[0].split("+", 1)[0]
+
+async def run_levels(base: str, backend: str, scenarios, levels, n: int, progress) -> list:
+    rows = []
+    for scenario in scenarios:
+        for c in levels:
+            row = {"backend": backend, **await drive(base, scenario, max(n, c), c)}
+            progress(row)
+            rows.append(row)
+    return rows
+
+def run(args, progress) -> list:
+    levels = [int(c) for c in args.concurrency.split(",")]
+    scenarios = [s for s in args.scenario.split(",") if s]
+    if args.url:
+        return asyncio.run(run_levels(args.url.rstrip("/"), args.label, scenarios, levels, args.requests, progress))
+    stubs = stubs_from_args(args).start_thread()
+    rows = []
+    try:
+        for db in args.db or ["sqlite"]:
+            workdir = tempfile.mkdtemp(prefix="bench-load-")
+            proc, base, _ = start_agent(agent_env(stubs, workdir, None if db == "sqlite" else db), workdir)
+            try:
+                rows += asyncio.run(run_levels(base, backend_name(db), scenarios, levels, args.requests, progress))
+            finally:
+                stop_agent(proc)
+                shutil.rmtree(workdir, ignore_errors=True)
+    finally:
+        stubs.stop_thread()
+    return rows
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--concurrency", default="1,4,16,64", help="comma-separated levels, run in order")
+    ap.add_argument("--requests", type=int, default=200, help="timed requests per scenario and level")
+    ap.add_argument("--scenario", default=",".join(SCENARIOS))
+    ap.add_argument("--db", action="append", metavar="sqlite|URL",
+                    help="backend to start the agent on (repeatable): sqlite (throwaway file) or a SQLAlchemy URL")
+    ap.add_argument("--url", help="drive an already running agent instead of starting one")
+    ap.add_argument("--label", default="external", help="backend name for --url results")
+    ap.add_argument("--json", action="store_true", help="one JSON object per row instead of a table")
+    add_profile_args(ap)
+    baseline.add_args(ap, "load")
+    args = ap.parse_args(argv)
+
+    if args.json:
+        progress = lambda r: print(json.dumps({"bench": "load", **r}), flush=True)
+    else:
+        print(f"{'backend':<8} {'scenario':<8} {'conc':>5} {'reqs':>5} {'errs':>5} {'p50 ms':>9} {'p95 ms':>9} "
+              f"{'p99 ms':>9} {'req/s':>8}")
+        progress = lambda r: print(f"{r['backend']:<8} {r['scenario']:<8} {r['concurrency']:>5} {r['requests']:>5} "
+                                   f"{r['errors']:>5} {r['ms_p50']:>9} {r['ms_p95']:>9} {r['ms_p99']:>9} "
+                                   f"{r['req_per_s']:>8}", flush=True)
+    rows = run(args, progress)
+    sys.exit(baseline.handle(args, "load", rows, KEYS, METRICS))
+
+if __name__ == "__main__":
+    main()
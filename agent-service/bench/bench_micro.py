@@ -0,0 +1,175 @@
+"""Microbenchmarks for the plan pipeline's hot paths, in-process against bench.stubs and a
+throwaway SQLite database (or --database-url):
+
+- Overpass element converters (_elements_to_pois / _elements_to_restos) on canned payloads
+- DB read paths: candidate pool build / hit, SQL-filtered query_places, places_within, memo lookup
+- build_plan cold (new city: geocode, forecast, Overpass and the place writes) and warm
+
+    python -m bench.bench_micro [--runs 30] [--places 1000,10000] [--latency-ms 0] [--json]
+                                [--save-baseline [PATH]] [--check-baseline [PATH]]
+"""
+from __future__ import annotations
+from datetime import date, timedelta
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from bench import baseline
+from bench.stubs import CITIES, add_profile_args, agent_env, overpass_elements, stubs_from_args
+
+ELEMENTS = [150, 1500, 5000]
+KEYS = ("case", "size")
+METRICS = ("ms_median",)      # p95 of a few-ms op is mostly GC and scheduler noise
+
+def _row(case: str, size: int, times) -> dict:
+    return {"case": case, "size": size, "runs": len(times),
+            "ms_median": round(statistics.median(times), 3),
+            "ms_p95": round(sorted(times)[int(0.95 * (len(times) - 1))], 3)}
+
+def _timed(fn, runs: int):
+    fn()
+    times = []
+    for _ in range(runs):
+        t = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t) * 1000)
+    return times
+
+async def _atimed(fn, runs: int, warm: bool = True):
+    if warm:
+        await fn()
+    times = []
+    for _ in range(runs):
+        t = time.perf_counter()
+        await fn()
+        times.append((time.perf_counter() - t) * 1000)
+    return times
+
+def converters(runs: int):
+    from app.retrieval import POI_FILTERS, RESTO_FILTERS, _elements_to_pois, _elements_to_restos, _matches
+    rows = []
+    for n in ELEMENTS:
+        els = overpass_elements(*CITIES["portland"], 15000, n)
+        poi_els = [e for e in els if _matches(e["tags"], POI_FILTERS)]
+        resto_els = [e for e in els if _matches(e["tags"], RESTO_FILTERS)]
+        rows.append(_row("elements_to_pois", n, _timed(lambda: _elements_to_pois(poi_els), runs)))
+        rows.append(_row("elements_to_restos", n, _timed(lambda: _elements_to_restos(resto_els), runs)))
+    return rows
+
+def _request(city: str, days: int = 3, ask: str | None = "museums and parks, vegan food"):
+    from app.schemas import BookingIn, PreferencesIn
+    start = date.today() + timedelta(days=3)
+    return (BookingIn(start_date=start, end_date=start + timedelta(days=days - 1), location=city, party_type="couple"),
+            PreferencesIn(budget_tier="$$", interests=["museum", "park"], dietary="vegan"), ask)
+
+async def db_reads(runs: int, sizes):
+    from sqlalchemy import select
+    from app import pools
+    from app.agent import _cache_osm_into_db
+    from app.cities import resolve_city_id
+    from app.db import AsyncSessionLocal
+    from app.geo import places_within
+    from app.models import City, POI
+    from app.retrieval import POI_FILTERS, RESTO_FILTERS, _elements_to_pois, _elements_to_restos, _matches
+    rows = []
+    for n in sizes:
+        city = f"Microville {n}, ZZ"
+        lat, lon = CITIES["denver"]
+        els = overpass_elements(lat, lon, 15000, n)
+        pois = _elements_to_pois([e for e in els if _matches(e["tags"], POI_FILTERS)])
+        restos = _elements_to_restos([e for e in els if _matches(e["tags"], RESTO_FILTERS)])
+        async with AsyncSessionLocal() as db:
+            await _cache_osm_into_db(city, pois, restos, db)
+            cid = await resolve_city_id(db, city)
+            size = len(pois)
+
+            async def version():
+                await db.execute(select(City.places_version).where(City.id == cid))
+
+            async def build():
+                pools.invalidate([cid])
+                await pools.city_pool(db, "pois", cid)
+
+            rows.append(_row("places_version", size, await _atimed(version, runs)))
+            rows.append(_row("city_pool_build", size, await _atimed(build, runs)))
+            rows.append(_row("city_pool_hit", size, await _atimed(lambda: pools.city_pool(db, "pois", cid), runs)))
+            rows.append(_row("query_places", size, await _atimed(
+                lambda: pools.query_places(db, "pois", cid, interests=["museum", "garden"], mobility="wheelchair"), runs)))
+            rows.append(_row("places_within_5km", size, await _atimed(lambda: places_within(db, POI, lat, lon, 5.0), runs)))
+    return rows
+
+async def plans(runs: int):
+    from app import memo
+    from app.agent import build_plan
+    from app.db import AsyncSessionLocal
+    from app.runs import persist_runs
+    from app.schemas import AgentRequest, PlanResponse
+    rows = []
+    cold = iter(range(10 ** 6))
+
+    async def plan_cold():
+        await build_plan(*_request(f"Coldtown {next(cold)}, ZZ"), AsyncSessionLocal)
+
+    rows.append(_row("build_plan_cold", 3, await _atimed(plan_cold, min(runs, 10), warm=False)))
+    for days in (3, 14):
+        req = _request("Portland, OR", days)
+        rows.append(_row("build_plan_warm", days, await _atimed(lambda: build_plan(*req, AsyncSessionLocal), runs)))
+
+    booking, prefs, ask = _request("Portland, OR")
+    areq = AgentRequest(booking=booking, preferences=prefs, ask=ask)
+    key = memo.plan_key(areq)
+    result = PlanResponse.model_validate(await build_plan(booking, prefs, ask, AsyncSessionLocal, rng=memo.plan_rng(key)))
+    async with AsyncSessionLocal() as db:
+        await persist_runs(db, [(areq, key, result)])
+        rows.append(_row("memo_cached_run", 1, await _atimed(lambda: memo.cached_run(db, key), runs)))
+    return rows
+
+async def run(args, workdir: str):
+    stubs = await stubs_from_args(args).start()
+    os.environ.update(agent_env(stubs, workdir, args.database_url))
+    from app import upstream
+    from app.migrate import ensure_schema
+    ensure_schema()
+    try:
+        rows = converters(args.runs)
+        rows += await db_reads(args.runs, [int(s) for s in args.places.split(",")])
+        rows += await plans(args.runs)
+    finally:
+        await upstream.aclose()
+        await stubs.aclose()
+    return rows
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--runs", type=int, default=30)
+    ap.add_argument("--places", default="1000,10000",
+                    help="Overpass elements per seeded city for the DB read paths (size column = POIs stored)")
+    ap.add_argument("--database-url", help="benchmark against this database instead of a throwaway SQLite file")
+    ap.add_argument("--json", action="store_true", help="one JSON object per case instead of a table")
+    add_profile_args(ap, latency_ms=0.0)
+    baseline.add_args(ap, "micro")
+    args = ap.parse_args(argv)
+    if "app" in sys.modules or any(m.startswith("app.") for m in sys.modules):
+        ap.error("run as python -m bench.bench_micro: settings must be read after the stub environment is set")
+    workdir = tempfile.mkdtemp(prefix="bench-micro-")
+    try:
+        rows = asyncio.run(run(args, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.json:
+        for r in rows:
+            print(json.dumps({"bench": "micro", **r}))
+    else:
+        print(f"{'case':<20} {'size':>6} {'runs':>5} {'median ms':>10} {'p95 ms':>8}")
+        for r in rows:
+            print(f"{r['case']:<20} {r['size']:>6} {r['runs']:>5} {r['ms_median']:>10} {r['ms_p95']:>8}")
+    sys.exit(baseline.handle(args, "micro", rows, KEYS, METRICS))
+
+if __name__ == "__main__":
+    main()
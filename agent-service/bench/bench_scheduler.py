@@ -0,0 +1,96 @@
+"""Itinerary scheduler benchmark: wall time per schedule() call and the resulting walking
+distance per day, against the old shuffle-and-slice itinerary on the same synthetic pools.
+
+    python -m bench.bench_scheduler [--runs 50] [--json]
+"""
+from __future__ import annotations
+from datetime import date, timedelta
+import argparse
+import json
+import math
+import random
+import statistics
+import time
+
+from app.scheduler import schedule
+
+SIZES = [(60, 3), (300, 14), (600, 30), (1000, 45)]   # (candidates, days)
+
+def synthetic_pool(n: int, seed: int = 1):
+    rng = random.Random(seed)
+    # a metro area ~30 x 30 km with a few denser neighbourhoods
+    hubs = [(45.52 + rng.uniform(-0.12, 0.12), -122.67 + rng.uniform(-0.18, 0.18)) for _ in range(6)]
+    acts = []
+    for i in range(n):
+        la, lo = rng.choice(hubs) if rng.random() < 0.7 else (45.52, -122.67)
+        acts.append({"title": f"poi-{i}", "address": "", "geo": (la + rng.gauss(0, 0.02), lo + rng.gauss(0, 0.03)),
+                     "price_tier": "$$", "duration_minutes": rng.choice([45, 60, 90, 120, 150]), "tags": ["museum"],
+                     "wheelchair_friendly": True, "child_friendly": True})
+    rests = [{"title": f"resto-{i}", "address": "", "geo": (45.52 + rng.uniform(-0.12, 0.12), -122.67 + rng.uniform(-0.18, 0.18)),
+              "price_tier": "$$", "tags": ["vegan"] if i % 3 == 0 else ["restaurant"]} for i in range(40)]
+    return acts, rests
+
+def legacy_schedule(days, activities, restaurants, rng):
+    # the previous build_plan itinerary: shuffle a capped pool, 3 items a day, dealt round-robin
+    pool = (activities + [dict(r, duration_minutes=75) for r in restaurants])[:60]
+    rng.shuffle(pool)
+    seq = []
+    while len(seq) < len(days) * 3:
+        seq.extend(rng.sample(pool, k=len(pool)))
+    out = []
+    for i, d in enumerate(days):
+        items = seq[i * 3:(i + 1) * 3]
+        out.append({"date": d.isoformat(), "blocks": {"morning": items[0:1], "afternoon": items[1:2], "evening": items[2:3]}})
+    return out
+
+def _km(a, b):
+    la = math.radians((a[0] + b[0]) / 2)
+    return math.hypot((a[0] - b[0]) * 110.57, (a[1] - b[1]) * 111.32 * math.cos(la))
+
+def km_per_stop(itinerary) -> float:
+    legs, stops = 0.0, 0
+    for day in itinerary:
+        seq = [c["geo"] for block in ("morning", "afternoon", "evening") for c in day["blocks"][block]]
+        legs += sum(_km(a, b) for a, b in zip(seq, seq[1:]))
+        stops += max(len(seq) - 1, 0)
+    return legs / max(stops, 1)
+
+def run(runs: int):
+    rows = []
+    for n, n_days in SIZES:
+        acts, rests = synthetic_pool(n)
+        days = [date(2026, 11, 1) + timedelta(d) for d in range(n_days)]
+        preferred = ["vegan" in r["tags"] for r in rests]
+        for _ in range(3):
+            schedule(days, acts, rests, [], random.Random(0), preferred)
+        times = []
+        for i in range(runs):
+            t = time.perf_counter()
+            it = schedule(days, acts, rests, [], random.Random(i), preferred)
+            times.append((time.perf_counter() - t) * 1000)
+        legacy = legacy_schedule(days, acts, rests, random.Random(0))
+        rows.append({
+            "candidates": n, "days": n_days,
+            "ms_median": round(statistics.median(times), 3), "ms_p95": round(sorted(times)[int(0.95 * (len(times) - 1))], 3),
+            "km_per_leg": round(km_per_stop(it), 2), "legacy_km_per_leg": round(km_per_stop(legacy), 2),
+            "stops_per_day": round(sum(sum(len(v) for v in d["blocks"].values()) for d in it) / n_days, 1),
+        })
+    return rows
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--runs", type=int, default=50)
+    ap.add_argument("--json", action="store_true", help="one JSON object per size instead of a table")
+    args = ap.parse_args(argv)
+    rows = run(args.runs)
+    if args.json:
+        for r in rows:
+            print(json.dumps({"bench": "scheduler", **r}))
+        return
+    print(f"{'cands':>6} {'days':>5} {'median ms':>10} {'p95 ms':>8} {'km/leg':>7} {'legacy km/leg':>14} {'stops/day':>10}")
+    for r in rows:
+        print(f"{r['candidates']:>6} {r['days']:>5} {r['ms_median']:>10} {r['ms_p95']:>8} {r['km_per_leg']:>7} "
+              f"{r['legacy_km_per_leg']:>14} {r['stops_per_day']:>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""Local stand-ins for every upstream a plan touches: Open-Meteo geocoding and forecast, the
+Overpass mirrors, Tavily and OpenAI chat completions. Payloads are canned but deterministic per
+city / coordinate, and each upstream gets its own latency and failure profile.
+
+    python -m bench.stubs [--port 8700] [--latency-ms 30] [--jitter-ms 10] [--fail 0]
+                          [--profile overpass-0=400:0.5 --profile llm=250 ...]
+
+Point the agent at a running stub with the variables printed at startup (see Stubs.env()).
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, urlsplit
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+
+MIRRORS = 3
+
+CITIES = {
+    "portland": (45.5152, -122.6784), "seattle": (47.6062, -122.3321), "denver": (39.7392, -104.9903),
+    "austin": (30.2672, -97.7431), "chicago": (41.8781, -87.6298), "boston": (42.3601, -71.0589),
+    "san francisco": (37.7749, -122.4194), "new york": (40.7128, -74.0060), "miami": (25.7617, -80.1918),
+    "nashville": (36.1627, -86.7816), "phoenix": (33.4484, -112.0740), "atlanta": (33.7490, -84.3880),
+}
+
+POI_KINDS = [("tourism", "museum"), ("tourism", "attraction"), ("tourism", "gallery"), ("tourism", "viewpoint"),
+             ("tourism", "artwork"), ("leisure", "park"), ("leisure", "playground"), ("leisure", "garden"),
+             ("amenity", "library"), ("amenity", "arts_centre"), ("amenity", "theatre")]
+RESTO_KINDS = ["restaurant", "restaurant", "restaurant", "cafe", "fast_food", "bar", "pub", "ice_cream"]
+CUISINES = ["italian", "mexican", "thai", "japanese;sushi", "pizza", "burger", "indian", "vegan",
+            "vegetarian", "coffee_shop", "chinese", "mediterranean", "korean", "french", ""]
+
+def _seed(*parts) -> int:
+    return int.from_bytes(hashlib.blake2b("|".join(map(str, parts)).encode(), digest_size=8).digest(), "big")
+
+# ---------- Canned payloads ----------
+
+def geocode_payload(name: str) -> dict:
+    """Known cities resolve to their coordinates, "nowhere..." to nothing, anything else to a
+    stable point in the continental US."""
+    key = name.split(",")[0].strip().lower()
+    if key.startswith("nowhere"):
+        return {"results": []}
+    lat, lon = CITIES.get(key) or (30 + _seed(key) % 1800 / 100, -120 + _seed(key, "lon") % 4500 / 100)
+    return {"results": [{"name": name, "latitude": lat, "longitude": lon, "country_code": "US"}]}
+
+def forecast_payload(lat: float, lon: float, start: date, end: date) -> dict:
+    days = [start + timedelta(d) for d in range((end - start).days + 1)]
+    rng = [random.Random(_seed(round(lat, 1), round(lon, 1), d)) for d in days]
+    base = 28 - abs(lat - 25) * 0.6
+    return {"latitude": lat, "longitude": lon, "daily": {
+        "time": [d.isoformat() for d in days],
+        "temperature_2m_max": [round(base + r.uniform(-4, 4), 1) for r in rng],
+        "temperature_2m_min": [round(base - 9 + r.uniform(-3, 3), 1) for r in rng],
+        "precipitation_probability_mean": [r.choice([0, 5, 10, 20, 35, 50, 70, 90]) for r in rng],
+    }}
+
+@lru_cache(maxsize=64)
+def overpass_elements(lat: float, lon: float, radius_m: int = 15000, n: int = 800) -> List[dict]:
+    """`n` named elements within the radius, about 40% sights and 60% places to eat, the
+    same set for the same (rounded) centre. Some are ways with only a centre point. Shared:
+    don't modify."""
+    rng = random.Random(_seed(round(lat, 3), round(lon, 3), radius_m))
+    deg = radius_m / 111_000
+    out = []
+    for i in range(n):
+        la = lat + rng.uniform(-deg, deg) * 0.7
+        lo = lon + rng.uniform(-deg, deg) * 0.7
+        if rng.random() < 0.4:
+            k, v = rng.choice(POI_KINDS)
+            tags = {k: v, "name": f"{v.replace('_', ' ').title()} {i}"}
+            if rng.random() < 0.5:
+                tags["wheelchair"] = rng.choice(["yes", "no", "limited", "designated"])
+        else:
+            amenity = rng.choice(RESTO_KINDS)
+            tags = {"amenity": amenity, "name": f"{amenity.replace('_', ' ').title()} {i}"}
+            cuisine = rng.choice(CUISINES)
+            if cuisine:
+                tags["cuisine"] = cuisine
+            if rng.random() < 0.15:
+                tags[rng.choice(["diet:vegan", "diet:vegetarian", "diet:gluten_free"])] = rng.choice(["yes", "only"])
+        if rng.random() < 0.5:
+            tags["addr:street"] = f"{rng.randint(1, 999)} Main St"
+        if rng.random() < 0.3:
+            out.append({"type": "way", "id": 10_000_000 + i, "center": {"lat": la, "lon": lo}, "tags": tags})
+        else:
+            out.append({"type": "node", "id": i, "lat": la, "lon": lo, "tags": tags})
+    return out
+
+_AROUND = re.compile(r"around:(\d+),(-?[\d.]+),(-?[\d.]+)")
+_LIMIT = re.compile(r"out center (\d+)")
+_SET = re.compile(r"->\.(\w+);")
+_OUT = re.compile(r"\.(\w+) out (?:count|center (\d+));")
+
+def _km(lat: float, lon: float, e: dict) -> float:
+    p = e.get("center") or e
+    return math.hypot(p["lat"] - lat, (p["lon"] - lon) * math.cos(math.radians(lat))) * 111.0
+
+def overpass_payload(ql: str, n: int) -> dict:
+    """Canned answer to a single-set query, or to named sets (`(...)->.r0; .r0 out count;
+    .r0 out center N;`): each set is the canned elements within its radius."""
+    m = _AROUND.search(ql)
+    if not m:
+        return {"elements": []}
+    lat, lon = float(m[2]), float(m[3])
+    radii, pos = {}, 0
+    for s in _SET.finditer(ql):
+        radii[s[1]] = int(_AROUND.findall(ql, pos, s.start())[-1][0])
+        pos = s.end()
+    if not radii:
+        elements = overpass_elements(lat, lon, int(m[1]), n)
+        limit = _LIMIT.search(ql)
+        return {"elements": elements[: int(limit[1])] if limit else elements}
+    canned = overpass_elements(lat, lon, max(radii.values()), n)
+    out = []
+    for o in _OUT.finditer(ql):
+        inside = [e for e in canned if _km(lat, lon, e) <= radii[o[1]] / 1000]
+        if o[2] is None:
+            ways = sum(e["type"] == "way" for e in inside)
+            out.append({"type": "count", "id": 0, "tags": {"nodes": str(len(inside) - ways), "ways": str(ways),
+                                                          "relations": "0", "total": str(len(inside))}})
+        else:
+            out += inside[: int(o[2])]
+    return {"elements": out}
+
+def tavily_payload(query: str) -> dict:
+    rng = random.Random(_seed(query))
+    return {"results": [{"title": f"{rng.choice(['Jazz night', 'Street fair', 'Food festival', 'Gallery walk'])} #{i}",
+                         "url": f"https://events.example/{i}"} for i in range(rng.randint(0, 4))]}
+
+_WORDS = {"museum", "park", "garden", "gallery", "theatre", "viewpoint", "library", "playground", "attraction"}
+_DIETS = ("vegan", "vegetarian", "halal", "kosher", "gluten-free")
+
+def chat_payload(messages: List[dict]) -> dict:
+    ask = (messages[-1].get("content") or "").lower() if messages else ""
+    words = set(re.findall(r"[a-z-]+", ask))
+    parsed = {
+        "budget_tier": "$" if "cheap" in words else "$$$" if "luxury" in words else "$$",
+        "interests": sorted(w.rstrip("s") for w in words if w.rstrip("s") in _WORDS),
+        "mobility": "wheelchair" if "wheelchair" in words else None,
+        "dietary": next((d for d in _DIETS if d in ask), None),
+    }
+    content = json.dumps(parsed)
+    return {"id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": "gpt-4o-mini",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(ask) // 4 + 60, "completion_tokens": len(content) // 4,
+                      "total_tokens": len(ask) // 4 + 60 + len(content) // 4}}
+
+# ---------- Server ----------
+
+@dataclass
+class Profile:
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    fail: float = 0.0          # share of requests answered 503
+
+    @classmethod
+    def parse(cls, spec: str, base: "Profile") -> "Profile":
+        """From LATENCY[:FAIL[:JITTER]], e.g. "400:0.5"; missing parts come from `base`."""
+        parts = spec.split(":")
+        return cls(float(parts[0]) if parts[0] else base.latency_ms,
+                   float(parts[2]) if len(parts) > 2 else base.jitter_ms,
+                   float(parts[1]) if len(parts) > 1 and parts[1] else base.fail)
+
+class Stubs:
+    """One HTTP/1.1 keep-alive server for every upstream, routed by path prefix. Profiles are
+    looked up by upstream name ("overpass-1" falls back to "overpass", then to the default)."""
+
+    def __init__(self, default: Profile | None = None, profiles: Dict[str, Profile] | None = None,
+                 overpass_elements: int = 800, seed: int = 0, host: str = "127.0.0.1", port: int = 0):
+        self.default = default or Profile()
+        self.profiles = dict(profiles or {})
+        self.n_elements = overpass_elements
+        self.rng = random.Random(seed)
+        self.host, self.port = host, port
+        self.counts: Dict[str, int] = {}
+        self.failures: Dict[str, int] = {}
+        self._server = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    @property
+    def base(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def env(self) -> Dict[str, str]:
+        """Settings that send every upstream call of the agent here."""
+        return {
+            "GEOCODE_URL": f"{self.base}/geocode/v1/search",
+            "FORECAST_URL": f"{self.base}/forecast/v1/forecast",
+            "OVERPASS_URLS": ",".join(f"{self.base}/overpass-{i}/api/interpreter" for i in range(MIRRORS)),
+            "TAVILY_URL": f"{self.base}/tavily/search",
+            "TAVILY_API_KEY": "stub",
+            "OPENAI_BASE_URL": f"{self.base}/openai/v1",
+            "OPENAI_API_KEY": "stub",
+            "LLM_FAKE": "0",
+        }
+
+    def profile(self, name: str) -> Profile:
+        return self.profiles.get(name) or self.profiles.get(name.split("-")[0]) or self.default
+
+    def _route(self, method: str, target: str, body: bytes) -> Tuple[str, object]:
+        url = urlsplit(target)
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        name = url.path.strip("/").split("/")[0]
+        if name == "geocode":
+            return name, lambda: geocode_payload(q.get("name", ""))
+        if name == "forecast":
+            return name, lambda: forecast_payload(float(q["latitude"]), float(q["longitude"]),
+                                                  date.fromisoformat(q["start_date"]), date.fromisoformat(q["end_date"]))
+        if name.startswith("overpass-"):
+            ql = parse_qs(body.decode()).get("data", [""])[0]
+            return name, lambda: overpass_payload(ql, self.n_elements)
+        if name == "tavily":
+            return name, lambda: tavily_payload(json.loads(body or b"{}").get("query", ""))
+        if name == "openai":
+            return "llm", lambda: chat_payload(json.loads(body or b"{}").get("messages") or [])
+        return name, None
+
+    async def _respond(self, method: str, target: str, body: bytes) -> Tuple[int, bytes]:
+        name, make = self._route(method, target, body)
+        if make is None:
+            return 404, b'{"error": "no such stub"}'
+        self.counts[name] = self.counts.get(name, 0) + 1
+        p = self.profile(name)
+        delay = max(0.0, p.latency_ms + (self.rng.uniform(-p.jitter_ms, p.jitter_ms) if p.jitter_ms else 0.0))
+        if delay:
+            await asyncio.sleep(delay / 1000)
+        if p.fail and self.rng.random() < p.fail:
+            self.failures[name] = self.failures.get(name, 0) + 1
+            return 503, b'{"error": "stub failure"}'
+        return 200, json.dumps(make()).encode()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                method, target, _ = lines[0].split(" ", 2)
+                length = 0
+                for line in lines[1:]:
+                    if line.lower().startswith("content-length:"):
+                        length = int(line.split(":", 1)[1])
+                body = await reader.readexactly(length) if length else b""
+                status, payload = await self._respond(method, target, body)
+                writer.write(b"HTTP/1.1 %d %s\r\ncontent-type: application/json\r\ncontent-length: %d\r\n\r\n%s"
+                             % (status, b"OK" if status == 200 else b"ERR", len(payload), payload))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self) -> "Stubs":
+        """Serve on the running loop (in-process benchmarks)."""
+        self._server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def aclose(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def start_thread(self) -> "Stubs":
+        """Serve from a background thread with its own loop, so a load driver in this process
+        doesn't share an event loop with the upstreams it is waiting on."""
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            ready.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=run, name="bench-stubs", daemon=True).start()
+        ready.wait()
+        return self
+
+    def stop_thread(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self.aclose(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+def agent_env(stubs: Stubs, workdir: str, database_url: str | None = None) -> Dict[str, str]:
+    """Everything an agent process needs to run against `stubs` without touching anything
+    shared: its own database (SQLite in `workdir` unless given), Overpass disk cache and no
+    background jobs, warming or retention passes competing with the measured requests."""
+    return {
+        **stubs.env(),
+        "DATABASE_URL": database_url or f"sqlite:///{workdir}/bench.db",
+        "OVERPASS_CACHE_DIR": f"{workdir}/overpass",
+        "JOB_WORKERS": "0", "PREFETCH_EVERY_S": "0", "RUN_RETENTION_EVERY_S": "0",
+        "SQLITE_WAL": "1",
+    }
+
+def profiles_from_args(default: Profile, specs: List[str]) -> Dict[str, Profile]:
+    out = {}
+    for spec in specs or []:
+        name, _, rest = spec.partition("=")
+        out[name] = Profile.parse(rest, default)
+    return out
+
+def add_profile_args(ap: argparse.ArgumentParser, latency_ms: float = 30.0):
+    ap.add_argument("--latency-ms", type=float, default=latency_ms, help="stub response time for every upstream")
+    ap.add_argument("--jitter-ms", type=float, default=latency_ms / 3, help="+/- uniform jitter on that")
+    ap.add_argument("--fail", type=float, default=0.0, help="share of stub requests answered 503")
+    ap.add_argument("--profile", action="append", default=[], metavar="NAME=MS[:FAIL[:JITTER]]",
+                    help="per-upstream override: geocode, forecast, overpass, overpass-0..2, tavily, llm")
+    ap.add_argument("--overpass-elements", type=int, default=800, help="elements per canned Overpass answer")
+
+def stubs_from_args(args, **kw) -> Stubs:
+    default = Profile(args.latency_ms, args.jitter_ms, args.fail)
+    return Stubs(default, profiles_from_args(default, args.profile), args.overpass_elements, **kw)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8700)
+    add_profile_args(ap)
+    args = ap.parse_args(argv)
+
+    async def serve():
+        stubs = await stubs_from_args(args, host=args.host, port=args.port).start()
+        for k, v in stubs.env().items():
+            print(f"{k}={v}")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
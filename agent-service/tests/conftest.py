@@ -0,0 +1,12 @@
+"""Settings are read when app.config is imported, so the test environment goes in before any
+test module imports the app: a throwaway SQLite file and no real LLM."""
+import os
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="agent-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{_tmp}/test.db",
+    "OVERPASS_CACHE_DIR": f"{_tmp}/overpass",
+    "LLM_FAKE": "0",
+    "OPENAI_API_KEY": "",
+})
@@ -0,0 +1,84 @@
+"""MirrorPool failover, hedging and circuit breaker against bench.stubs' Overpass mirrors.
+
+    cd agent-service && python -m pytest tests
+"""
+from __future__ import annotations
+import asyncio
+import time
+
+import httpx
+
+from app.mirrors import MirrorPool
+from bench.stubs import Profile, Stubs
+
+QL = "[out:json];(node(around:2000,45.5152,-122.6784)[tourism~\"museum\"];);out center 50;"
+
+def run(profiles, check, **pool_kw):
+    """Start stubs with the given per-mirror profiles and call check(pool, send, stubs)."""
+    async def main():
+        stubs = await Stubs(profiles=profiles, overpass_elements=50).start()
+        pool = MirrorPool([f"{stubs.base}/overpass-{i}/api/interpreter" for i in range(3)], **pool_kw)
+        try:
+            async with httpx.AsyncClient() as client:
+                async def send(url):
+                    r = await client.post(url, data={"data": QL})
+                    r.raise_for_status()
+                    return r.json()["elements"]
+                await check(pool, send, stubs)
+        finally:
+            await stubs.aclose()
+    asyncio.run(main())
+
+def test_failover_to_next_mirror_on_503():
+    async def check(pool, send, stubs):
+        elements = await pool.query(send)
+        assert len(elements) == 50
+        assert stubs.failures == {"overpass-0": 1}
+        assert stubs.counts == {"overpass-0": 1, "overpass-1": 1}
+        first, second, _ = pool.snapshot()
+        assert (first["failures"], first["wins"]) == (1, 0)
+        assert second["wins"] == 1
+        # the failing mirror now ranks behind the healthy ones
+        assert pool.ranked()[-1] == first["url"]
+    run({"overpass-0": Profile(fail=1.0)}, check, hedge_after_s=5.0)
+
+def test_slow_mirror_is_hedged():
+    async def check(pool, send, stubs):
+        t0 = time.monotonic()
+        elements = await pool.query(send)
+        assert elements and time.monotonic() - t0 < 0.4
+        assert stubs.counts == {"overpass-0": 1, "overpass-1": 1}
+        await asyncio.sleep(0.01)                       # let the cancelled loser record its time
+        slow, fast, _ = pool.snapshot()
+        assert fast["wins"] == 1 and slow["wins"] == 0
+        # losing a hedge race isn't a failure
+        assert slow["failures"] == 0 and slow["ewma_latency_s"] >= 0.05
+    run({"overpass-0": Profile(latency_ms=600)}, check, hedge_after_s=0.05)
+
+def test_breaker_opens_then_probes_after_cooldown():
+    async def check(pool, send, stubs):
+        bad = pool.snapshot()[0]["url"]
+        for _ in range(2):
+            # keep the failing mirror first in line so each query hits it
+            pool.stats[bad].ewma_error = pool.stats[bad].ewma_latency = 0.0
+            assert await pool.query(send)
+        assert pool.snapshot()[0]["circuit_open"]
+        assert bad not in pool.ranked()
+        await pool.query(send)
+        assert stubs.counts["overpass-0"] == 2          # skipped while open
+
+        await asyncio.sleep(0.25)
+        stubs.profiles.pop("overpass-0")                # mirror recovers
+        pool.stats[bad].ewma_error = pool.stats[bad].ewma_latency = 0.0
+        assert pool.ranked()[0] == bad                  # half-open: back in the ranking
+        assert await pool.query(send)
+        assert stubs.counts["overpass-0"] == 3
+        assert not pool.snapshot()[0]["circuit_open"]
+        assert pool.stats[bad].consecutive_failures == 0
+    run({"overpass-0": Profile(fail=1.0)}, check, hedge_after_s=5.0, breaker_failures=2, breaker_cooldown_s=0.2)
+
+def test_every_mirror_failing_gives_empty_answer():
+    async def check(pool, send, stubs):
+        assert await pool.query(send) == []
+        assert stubs.counts == {"overpass-0": 1, "overpass-1": 1, "overpass-2": 1}
+    run({"overpass": Profile(fail=1.0)}, check, hedge_after_s=5.0)
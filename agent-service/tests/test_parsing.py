@@ -0,0 +1,94 @@
+"""Tiered ask parsing: local keywords -> LRU -> ask_parses table -> LLM (a FakeLLM with canned
+answers that differ from the local parse, so each tier's answer is recognisable).
+
+    cd agent-service && python -m pytest tests
+"""
+from __future__ import annotations
+import asyncio
+
+import pytest
+
+from app import metrics, parsing
+from app.db import async_engine
+from app.migrate import ensure_schema
+from app.parsing import FakeLLM, local_parse, parse_free_text, set_llm
+
+@pytest.fixture(scope="module", autouse=True)
+def schema():
+    ensure_schema()
+
+@pytest.fixture(autouse=True)
+def fresh():
+    parsing._parse_lru.clear()
+    yield
+    set_llm(None)
+
+def run(coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            await async_engine.dispose()      # pooled aiosqlite connections belong to this loop
+    return asyncio.run(main())
+
+def parses(source: str) -> float:
+    return metrics._metrics["ask_parses_total"].series.get((("source", source),), 0)
+
+def test_local_fast_path_skips_the_llm():
+    llm = FakeLLM()
+    set_llm(llm)
+    assert local_parse("vegan, wheelchair, cheap") == (
+        {"dietary": "vegan", "mobility": "wheelchair", "budget_tier": "$"}, 1.0)
+    before = parses("local")
+    assert run(parse_free_text("vegan, wheelchair, cheap")) == {
+        "dietary": "vegan", "mobility": "wheelchair", "budget_tier": "$"}
+    assert llm.calls == 0 and parses("local") == before + 1
+
+@pytest.mark.parametrize("ask, local, canned", [
+    # '$$' and 'budget' ($) conflict: the field is dropped, not guessed
+    ("$$ budget", {}, {"budget_tier": "$$"}),
+    # 'nothing too expensive' must not come back as the $$$ keyword it negates
+    ("museums, nothing too expensive", {"interests": ["museum"]}, {"interests": ["museum"], "budget_tier": "$$"}),
+])
+def test_unsafe_keyword_reading_goes_to_the_llm(ask, local, canned):
+    assert local_parse(ask) == (local, 0.0)
+    llm = FakeLLM({ask: canned})
+    set_llm(llm)
+    assert run(parse_free_text(ask)) == canned
+    assert llm.asks == [ask]
+
+def test_lru_then_table_then_llm():
+    ask = "somewhere quiet with history"
+    canned = {"interests": ["history", "library"], "budget_tier": "$$"}
+    llm = FakeLLM({ask: canned})
+    set_llm(llm)
+    counts = {s: parses(s) for s in ("llm", "memory", "db")}
+
+    assert run(parse_free_text(ask)) == {**local_parse(ask)[0], **canned}
+    assert run(parse_free_text(ask)) == canned
+    parsing._parse_lru.clear()                     # e.g. another process: only the table has it
+    assert run(parse_free_text(ask)) == canned
+    assert run(parse_free_text(ask)) == canned
+
+    assert llm.calls == 1
+    assert {s: parses(s) - n for s, n in counts.items()} == {"llm": 1, "memory": 2, "db": 1}
+
+def test_llm_fills_in_and_local_findings_stay_without_negation():
+    ask = "museums and somewhere romantic"
+    assert local_parse(ask)[0] == {"interests": ["museum"]}
+    set_llm(FakeLLM({ask: {"budget_tier": "$$$", "interests": [], "dietary": ""}}))
+    # empty LLM fields don't wipe local findings
+    assert run(parse_free_text(ask)) == {"interests": ["museum"], "budget_tier": "$$$"}
+
+def test_negated_ask_takes_only_the_llm_reading():
+    ask = "parks but no museums, fancy dinner"
+    # keywords keep what comes before the negation and drop the rest ('fancy' may be negated too)
+    assert local_parse(ask) == ({"interests": ["park"]}, 0.0)
+    set_llm(FakeLLM({ask: {"interests": ["garden"], "budget_tier": "$$$"}}))
+    assert run(parse_free_text(ask)) == {"interests": ["garden"], "budget_tier": "$$$"}
+
+def test_without_an_llm_local_findings_minus_the_negated():
+    set_llm(None)
+    before = parses("local_fallback")
+    assert run(parse_free_text("parks but no museums")) == {"interests": ["park"]}
+    assert parses("local_fallback") == before + 1